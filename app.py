@@ -2,10 +2,24 @@ import streamlit as st
 import pandas as pd
 import time
 import sys
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # 既存のファイルからクラスと設定をインポート
 # ※ ファイル名が indeed_job_analyzer.py である前提
-from indeed_job_analyzer import TalentScopeAI, GROQ_API_KEY
+from indeed_job_analyzer import (
+    TalentScopeAI, GROQ_API_KEY, MAX_PARALLEL_SEARCHES, INDEED_MAX_RPS, MAX_RESULT_PAGES, MAX_JOBS_PER_COMPANY,
+    REPORT_SUMMARY_KEY, HEDGE_REQUESTS, event_sink, job_records, jobs_parquet_bytes, normalize_salaries,
+    salary_summary
+)
+
+# ダッシュボード全体で同時に走らせる分析の数（超えた分は順番待ち）
+DASHBOARD_MAX_RUNS = 2
+# 実行中の画面を更新する間隔（秒）
+DASHBOARD_REFRESH_SECONDS = 1.0
+# 画面に出す進捗ログの行数
+DASHBOARD_LOG_LINES = 30
 
 # ==========================================
 # ページ設定
@@ -16,6 +30,411 @@ st.set_page_config(
     layout="wide"
 )
 
+# ==========================================
+# 共有リソース（再実行・利用者をまたいで使い回す）
+# ==========================================
+class AnalyzerRegistry:
+    """ ブラウザプール・Groq クライアント・キャッシュを持った分析器。設定が同じなら全員で共有する。
+        設定が変わったら新しく作り、古い分析器は実行中の分析が終わりしだい閉じる（ブラウザを残さない） """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._settings = None
+        self._current = None
+        self._users = {}     # id(分析器) -> 実行中の分析の数
+        self._retired = []   # 閉じ待ちの分析器
+
+    def acquire(self, api_key, browser_pool_size, max_rps, hedge=HEDGE_REQUESTS):
+        """ この設定の分析器を借りる。使い終わったら release() """
+        settings = {"api_key": api_key, "browser_pool_size": browser_pool_size, "max_rps": max_rps, "hedge": hedge}
+        with self._lock:
+            if self._settings != settings:
+                if self._current is not None:
+                    self._retired.append(self._current)
+                self._current = TalentScopeAI(**settings)
+                self._settings = settings
+            analyzer = self._current
+            self._users[id(analyzer)] = self._users.get(id(analyzer), 0) + 1
+            idle = self._take_idle()
+        for old in idle:
+            old.close()
+        return analyzer
+
+    def release(self, analyzer):
+        with self._lock:
+            self._users[id(analyzer)] -= 1
+            idle = self._take_idle()
+        for old in idle:
+            old.close()
+
+    def run(self, analyzer, fn):
+        """ fn() を実行し、終わったら analyzer を返す（裏のスレッドから呼ぶ） """
+        try:
+            fn()
+        finally:
+            self.release(analyzer)
+
+    def _take_idle(self):
+        """ ロック保持中に呼ぶ。閉じ待ちのうち誰も使っていないものを取り出す """
+        idle = [a for a in self._retired if not self._users.get(id(a))]
+        self._retired = [a for a in self._retired if self._users.get(id(a))]
+        for analyzer in idle:
+            self._users.pop(id(analyzer), None)
+        return idle
+
+
+@st.cache_resource(show_spinner=False)
+def get_analyzers():
+    return AnalyzerRegistry()
+
+
+@st.cache_resource(show_spinner=False)
+def get_run_executor():
+    """ 分析はこのスレッドで走らせ、画面の描画スレッドはふさがない """
+    return ThreadPoolExecutor(max_workers=DASHBOARD_MAX_RUNS, thread_name_prefix="talentscope-run")
+
+
+class DashboardRun:
+    """ 1回分の分析。裏のスレッドで進め、進捗イベントと結果をここに貯めて画面から読む """
+
+    def __init__(self, analyzer, companies_info, max_workers, max_pages, max_jobs):
+        self.analyzer = analyzer
+        self.companies_info = companies_info
+        self.max_workers = max_workers
+        self.search_kwargs = {"max_pages": max_pages, "max_jobs": max_jobs}
+        self._lock = threading.Lock()
+        self.state = "queued"   # queued / running / done / error
+        self.error = None
+        self.events = []
+        self.filter_data = None
+        self.done = []          # 検索が終わった企業名（終わった順）
+        self.results = {}
+        self.streamed_jobs = []
+        self.report_drafts = {}
+        self.report_sections = {}
+        self.report = None
+        self.trace_id = None    # 今回の実行の計測 (analyzer.tracer) を絞り込むキー
+
+    @property
+    def finished(self):
+        return self.state in ("done", "error")
+
+    def snapshot(self):
+        """ 描画用のコピー（裏のスレッドが書き込んでいる最中でも崩れないように） """
+        with self._lock:
+            return {
+                "state": self.state,
+                "error": self.error,
+                "events": list(self.events[-DASHBOARD_LOG_LINES:]),
+                "filter_data": self.filter_data,
+                "done": list(self.done),
+                "results": dict(self.results),
+                "streamed_jobs": list(self.streamed_jobs),
+                "report_drafts": dict(self.report_drafts),
+                "report_sections": dict(self.report_sections),
+                "report": self.report,
+            }
+
+    def _on_event(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def _on_job(self, comp, job):
+        with self._lock:
+            self.streamed_jobs.append({
+                "company": comp['name'],
+                "title": job.get('title'),
+                "salary": job.get('salary'),
+                "location": job.get('location'),
+            })
+
+    def _on_report_event(self, event):
+        key = event["section"]
+        with self._lock:
+            if event["type"] == "delta":
+                self.report_drafts[key] = self.report_drafts.get(key, "") + event["text"]
+            else:
+                self.report_sections[key] = event["text"]
+
+    def run(self):
+        with self._lock:
+            self.state = "running"
+        try:
+            with event_sink(self._on_event):
+                self._run()
+            with self._lock:
+                self.state = "done"
+        except Exception as e:
+            with self._lock:
+                self.state = "error"
+                self.error = str(e)
+
+    def _run(self):
+        with self.analyzer.tracer.span("run", companies=len(self.companies_info)) as span:
+            self.trace_id = span.trace_id
+            self._run_stages()
+
+    def _run_stages(self):
+        analyzer = self.analyzer
+        filter_data = analyzer.build_strict_filter(self.companies_info)
+        with self._lock:
+            self.filter_data = filter_data
+
+        for i, comp, data in analyzer.iter_many(self.companies_info, filter_data, max_workers=self.max_workers,
+                                                on_job=self._on_job, **self.search_kwargs):
+            if data and data['count'] > 0:
+                for job in data.get('raw_data', []):
+                    if isinstance(job, dict):
+                        job['company'] = comp['name'] # 企業名を追加
+            else:
+                data = {"count": 0, "jobs": "", "raw_data": []}
+            with self._lock:
+                self.results[comp['name']] = data
+                self.done.append(comp['name'])
+
+        # レポートは入力順で作りたいので並べ直す
+        results = {comp['name']: self.results[comp['name']]
+                   for comp in self.companies_info if comp['name'] in self.results}
+        if results:
+            report = analyzer.analyze_with_groq(results, self.companies_info, filter_data,
+                                                on_event=self._on_report_event)
+            with self._lock:
+                self.report = report
+
+
+def format_event(event):
+    """ 進捗イベントをログ1行にする """
+    stamp = time.strftime("%H:%M:%S", time.localtime(event["time"]))
+    company = f"[{event['company']}] " if event.get("company") else ""
+    if event.get("message"):
+        return f"{stamp} {company}{event['message']}"
+    details = ", ".join(f"{k}={v}" for k, v in event.items() if k not in ("time", "stage", "message", "company"))
+    return f"{stamp} {company}<{event['stage']}> {details}"
+
+
+def render_progress(run, view):
+    total = len(run.companies_info)
+    if view["state"] == "queued":
+        st.info("⏳ 他の分析が終わるのを待っています...")
+    st.progress(len(view["done"]) / total if total else 1.0,
+                text=f"検索済み {len(view['done'])}/{total}社")
+
+    if view["filter_data"]:
+        st.success(f"ターゲット業界: **{view['filter_data'].get('target_industry')}**")
+
+    with st.expander("📜 進捗ログ", expanded=not run.finished):
+        st.code("\n".join(format_event(e) for e in view["events"]) or "開始待ち...", language=None)
+
+    for name in view["done"]:
+        data = view["results"][name]
+        if data['count'] > 0:
+            st.write(f"✅ {name}: {data['count']}件の求人を検出しました")
+        else:
+            st.write(f"⚠️ {name}: 求人が見つかりませんでした")
+
+    # 見つかった求人をその場で表示するテーブル
+    if not run.finished and view["streamed_jobs"]:
+        st.dataframe(pd.DataFrame(view["streamed_jobs"]), use_container_width=True, height=250)
+
+
+def render_report_progress(run, view):
+    st.caption("🧠 企業ごとのセクションを並列に作成しています（書き上がった順に表示）")
+    for key in [comp['name'] for comp in run.companies_info] + [REPORT_SUMMARY_KEY]:
+        if key in view["report_sections"]:
+            text = view["report_sections"][key]
+        elif key in view["report_drafts"]:
+            text = view["report_drafts"][key] + " ▌"
+        else:
+            continue
+        if key == REPORT_SUMMARY_KEY:
+            text = "【全体サマリー】\n\n" + text
+        st.text(text)
+
+
+def render_results(run, view):
+    results = view["results"]
+    all_jobs_df = [job for comp in run.companies_info
+                   for job in results.get(comp['name'], {}).get('raw_data', []) if isinstance(job, dict)]
+
+    st.divider()
+    st.header("📊 分析結果")
+    
+    # タブで表示を切り替え
+    tab1, tab2, tab3, tab4 = st.tabs(["📝 AIレポート", "📋 求人データ一覧", "💴 給与分析", "⏱️ パフォーマンス"])
+    
+    with tab1:
+        if view["report"] is None:
+            render_report_progress(run, view)
+        else:
+            # テキストエリアでコピーしやすく表示
+            st.text_area("分析レポート", value=view["report"], height=600)
+            
+            # ダウンロードボタン
+            st.download_button(
+                label="📥 レポートをダウンロード (.txt)",
+                data=view["report"],
+                file_name="indeed_analysis_report.txt"
+            )
+
+    with tab2:
+        if all_jobs_df:
+            df = pd.DataFrame(all_jobs_df)
+            # 不要なカラムや順序の整理（存在する場合のみ）
+            display_cols = [c for c in ['company', 'title', 'salary', 'location', 'url'] if c in df.columns]
+            if display_cols:
+                st.dataframe(
+                    df[display_cols],
+                    column_config={
+                        "url": st.column_config.LinkColumn("リンク"),
+                        "salary": "給与",
+                        "title": "職種",
+                        "company": "企業名"
+                    },
+                    use_container_width=True
+                )
+            else:
+                st.dataframe(df)
+            render_jobs_download(run, results)
+        else:
+            st.info("表示できる求人データがありません。")
+
+    with tab3:
+        render_salaries(all_jobs_df)
+
+    with tab4:
+        render_performance(run)
+
+
+def render_salaries(jobs):
+    """ 給与テキストを年換算して、企業別・職種別に集計する """
+    if not jobs:
+        st.info("表示できる求人データがありません。")
+        return
+    df = pd.DataFrame(jobs)
+    if 'salary' not in df.columns:
+        st.info("給与情報がありません。")
+        return
+    df = normalize_salaries(df)
+
+    parsed = int(df['annual_mid'].notna().sum())
+    col1, col2, col3 = st.columns(3)
+    col1.metric("給与を読めた求人", f"{parsed}/{len(df)}件")
+    if parsed:
+        col2.metric("年換算の中央値", f"{df['annual_mid'].median() / 10000:,.0f}万円")
+        col3.metric("年換算の範囲", f"{df['annual_min'].min() / 10000:,.0f}〜{df['annual_max'].max() / 10000:,.0f}万円")
+    st.caption("時給は 8時間×月20日、日給は 月20日、月給は 12ヶ月で年換算しています。単位の無い金額は額から推定します。")
+
+    summary_config = {
+        "company": "企業名",
+        "title": "職種",
+        "postings": "求人数",
+        "parsed": "給与あり",
+        "median_annual": st.column_config.NumberColumn("中央値(年換算)", format="¥%d"),
+        "min_annual": st.column_config.NumberColumn("下限(年換算)", format="¥%d"),
+        "max_annual": st.column_config.NumberColumn("上限(年換算)", format="¥%d"),
+    }
+    st.subheader("企業ごとの給与")
+    st.dataframe(salary_summary(df, "company"), column_config=summary_config, use_container_width=True)
+    if 'title' in df.columns:
+        st.subheader("職種ごとの給与")
+        st.dataframe(salary_summary(df, "title"), column_config=summary_config, use_container_width=True)
+
+
+def render_jobs_download(run, results):
+    """ 求人データを型付きの Parquet でダウンロード（pandas / Arrow でそのまま読める） """
+    records = [record for comp in run.companies_info
+               for record in job_records(comp['name'], results.get(comp['name'], {}).get('raw_data'))]
+    try:
+        data = jobs_parquet_bytes(records)
+    except RuntimeError as e:
+        st.caption(f"⚠️ {e}")
+        return
+    st.download_button(
+        label="📥 求人データをダウンロード (.parquet)",
+        data=data,
+        file_name=f"talentscope_jobs_{time.strftime('%Y%m%d')}.parquet",
+        mime="application/vnd.apache.parquet"
+    )
+
+
+def render_performance(run):
+    """ 今回の実行の段階別・企業別の所要時間とトークン数 """
+    tracer = run.analyzer.tracer
+    if run.trace_id is None:
+        st.info("計測データがまだありません。")
+        return
+
+    st.subheader("段階ごとの所要時間")
+    stages = tracer.summary(run.trace_id)
+    if stages:
+        st.dataframe(
+            pd.DataFrame(stages),
+            column_config={
+                "name": "段階",
+                "count": "回数",
+                "total_s": "合計(秒)",
+                "p50_ms": "p50(ms)",
+                "p95_ms": "p95(ms)",
+                "max_ms": "最大(ms)",
+                "errors": "失敗",
+                "prompt_tokens": "入力tok",
+                "completion_tokens": "出力tok",
+                "retries": "リトライ",
+                "throttle_s": "待ち(秒)",
+            },
+            use_container_width=True
+        )
+
+    st.subheader("企業ごとの所要時間")
+    companies = tracer.company_summary(run.trace_id)
+    if companies:
+        st.dataframe(
+            pd.DataFrame(companies),
+            column_config={
+                "company": "企業名",
+                "search_s": "検索(秒)",
+                "pages": "ページ数",
+                "llm_calls": "LLM呼び出し",
+                "prompt_tokens": "入力tok",
+                "completion_tokens": "出力tok",
+                "throttle_s": "待ち(秒)",
+            },
+            use_container_width=True
+        )
+
+    st.subheader("モデルごとの応答")
+    models = run.analyzer.router.snapshot()
+    if models:
+        st.dataframe(
+            pd.DataFrame(models),
+            column_config={
+                "model": "モデル",
+                "calls": "呼び出し",
+                "p50_ms": "p50(ms)",
+                "p95_ms": "p95(ms)",
+                "p95_ms_per_ktok": "p95(ms/1000tok)",
+                "error_rate": "失敗率",
+                "throttle_rate": "429率",
+            },
+            use_container_width=True
+        )
+        st.caption(f"🧭 {run.analyzer.router.report()}")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            label="📥 トレース (JSON Lines)",
+            data=tracer.to_jsonl(run.trace_id),
+            file_name="talentscope_trace.jsonl"
+        )
+    with col2:
+        st.download_button(
+            label="📥 トレース (OTLP/JSON)",
+            data=json.dumps(tracer.to_otlp(run.trace_id), ensure_ascii=False),
+            file_name="talentscope_trace_otlp.json"
+        )
+
+
 # タイトルエリア
 st.title("🕵️ TalentScope AI - 競合分析ダッシュボード")
 st.markdown("Indeedの求人情報をAIが自動収集・分析し、レポートを作成します。")
@@ -41,6 +460,18 @@ with st.sidebar:
     
     company_input = st.text_area("企業リスト", value=default_companies.strip(), height=150)
     
+    with st.expander("⚡ 並列実行の設定"):
+        workers_input = st.slider("同時に検索する企業数", min_value=1, max_value=8, value=MAX_PARALLEL_SEARCHES)
+        rps_input = st.number_input("Indeedへのアクセス上限 (回/秒)", min_value=0.1, max_value=5.0,
+                                    value=float(INDEED_MAX_RPS), step=0.1)
+        max_pages_input = st.number_input("1検索あたりの結果ページ数", min_value=1, max_value=10,
+                                          value=MAX_RESULT_PAGES, step=1)
+        max_jobs_input = st.number_input("1社あたりの求人数の上限", min_value=10, max_value=500,
+                                         value=MAX_JOBS_PER_COMPANY, step=10)
+        hedge_input = st.checkbox("遅い応答は別モデルにも送る (ヘッジ)", value=HEDGE_REQUESTS,
+                                  help="応答がそのモデルの p95 を超えたら別モデルにも送り、先に届いた方を使います。"
+                                       "トークンを余分に使います。")
+    
     start_button = st.button("🚀 分析を開始する", type="primary", use_container_width=True)
     
     st.markdown("---")
@@ -58,114 +489,41 @@ if start_button:
         st.warning("⚠️ 企業リストを入力してください。")
         st.stop()
 
-    # 入力データの整形
-    input_str = company_input.replace("，", ",").replace("　", " ").strip()
-    raw_list = [x.strip() for x in input_str.split(",") if x.strip()]
-    
-    companies_info = []
-    for item in raw_list:
-        if "@" in item:
-            parts = item.split("@")
-            companies_info.append({"name": parts[0].strip(), "loc": parts[1].strip()})
-        else:
-            companies_info.append({"name": item, "loc": None})
+    current = st.session_state.get("run")
+    if current is not None and not current.finished:
+        st.warning("⚠️ 前回の分析がまだ実行中です。終わるまでお待ちください。")
+    else:
+        # 入力データの整形
+        input_str = company_input.replace("，", ",").replace("　", " ").strip()
+        raw_list = [x.strip() for x in input_str.split(",") if x.strip()]
+        
+        companies_info = []
+        for item in raw_list:
+            if "@" in item:
+                parts = item.split("@")
+                companies_info.append({"name": parts[0].strip(), "loc": parts[1].strip()})
+            else:
+                companies_info.append({"name": item, "loc": None})
 
-    # インスタンス化
-    analyzer = TalentScopeAI(api_key=api_key_input)
-    results = {}
-    
-    # 全体進捗バー
-    progress_bar = st.progress(0)
-    
-    # コンテナを作成（ログ表示用）
-    log_container = st.container()
+        # 分析器は共有し、実行は裏のスレッドへ（このスクリプトはすぐ描画に戻る）
+        analyzers = get_analyzers()
+        analyzer = analyzers.acquire(api_key_input, workers_input, rps_input, hedge_input)
+        run = DashboardRun(analyzer, companies_info, workers_input, int(max_pages_input), int(max_jobs_input))
+        get_run_executor().submit(analyzers.run, analyzer, run.run)
+        st.session_state["run"] = run
 
-    try:
-        # 1. 業界情報の学習
-        with st.status("🌍 業界コンテキストを学習中...", expanded=True) as status:
-            status.write("Web検索を実行中...")
-            web_info = analyzer.search_web_for_company_info(companies_info)
-            status.write("業界フィルターを生成中...")
-            filter_data = analyzer.generate_strict_filter(web_info)
-            status.update(label="✅ 準備完了", state="complete", expanded=False)
-            
-            st.success(f"ターゲット業界: **{filter_data.get('target_industry')}**")
+# 結果はセッションに残すので、タブの切り替えやダウンロードで再実行されても検索し直さない
+run = st.session_state.get("run")
+if run is not None:
+    view = run.snapshot()
+    render_progress(run, view)
 
-        # 2. 各企業の検索実行
-        all_jobs_df = [] # テーブル表示用データ
-        
-        for i, comp in enumerate(companies_info):
-            company_name = comp['name']
-            
-            # ステータス表示（折りたたみ可能なログ）
-            with st.status(f"🔍 {company_name} を調査中... ({i+1}/{len(companies_info)})", expanded=True) as status:
-                
-                # 実際の検索処理を実行
-                # コンソールへのprint出力をキャプチャするのは難しいため、
-                # 処理が終わるのを待って結果を表示する形になります
-                data = analyzer.run_single_search(comp, filter_data)
-                
-                if data and data['count'] > 0:
-                    status.write(f"✅ {data['count']}件の求人を検出しました")
-                    results[company_name] = data
-                    
-                    # テーブル用データの蓄積（手順1の修正をしていない場合はここはスキップされます）
-                    if 'raw_data' in data:
-                        for job in data['raw_data']:
-                            if isinstance(job, dict):
-                                job['company'] = company_name # 企業名を追加
-                                all_jobs_df.append(job)
-                else:
-                    status.write("⚠️ 求人が見つかりませんでした")
-                    results[company_name] = {"count": 0, "jobs": "", "raw_data": []}
-                
-                status.update(label=f"✅ {company_name} 完了", state="complete", expanded=False)
-            
-            # 進捗バー更新
-            progress_bar.progress((i + 1) / len(companies_info))
+    if view["state"] == "error":
+        st.error(f"エラーが発生しました: {view['error']}")
+    if view["done"] and (view["report"] is not None or view["report_drafts"] or view["report_sections"]
+                         or run.finished):
+        render_results(run, view)
 
-        # 3. 最終レポート生成
-        if results:
-            st.divider()
-            st.header("📊 分析結果")
-            
-            # タブで表示を切り替え
-            tab1, tab2 = st.tabs(["📝 AIレポート", "📋 求人データ一覧"])
-            
-            with tab1:
-                with st.spinner("🧠 最終レポートを作成中..."):
-                    final_report = analyzer.analyze_with_groq(results, companies_info, filter_data)
-                    
-                    # テキストエリアでコピーしやすく表示
-                    st.text_area("分析レポート", value=final_report, height=600)
-                    
-                    # ダウンロードボタン
-                    st.download_button(
-                        label="📥 レポートをダウンロード (.txt)",
-                        data=final_report,
-                        file_name="indeed_analysis_report.txt"
-                    )
-
-            with tab2:
-                if all_jobs_df:
-                    df = pd.DataFrame(all_jobs_df)
-                    # 不要なカラムや順序の整理（存在する場合のみ）
-                    display_cols = [c for c in ['company', 'title', 'salary', 'location', 'url'] if c in df.columns]
-                    if display_cols:
-                        st.dataframe(
-                            df[display_cols],
-                            column_config={
-                                "url": st.column_config.LinkColumn("リンク"),
-                                "salary": "給与",
-                                "title": "職種",
-                                "company": "企業名"
-                            },
-                            use_container_width=True
-                        )
-                    else:
-                        st.dataframe(df)
-                else:
-                    st.info("表示できる求人データがありません。")
-        
-    except Exception as e:
-        st.error(f"エラーが発生しました: {e}")
\ No newline at end of file
+    if not run.finished:
+        time.sleep(DASHBOARD_REFRESH_SECONDS)
+        st.rerun()
\ No newline at end of file
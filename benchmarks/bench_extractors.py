@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+求人カード抽出エンジンの一致確認 & 速度計測
+
+使い方:
+    python benchmarks/bench_extractors.py            # fixtures/*.html すべて
+    python benchmarks/bench_extractors.py --repeat 200 saved_page.html
+
+各エンジンの [JOB_BLOCK_n] 出力・全文テキスト・行分割が BeautifulSoup 版と完全一致するかを確認し、
+1ページあたりの処理時間とスループット(ページ/秒)、全文モードの圧縮率を表示します。
+除外キーワード照合（英数字は単語単位・日本語は部分一致）と給与テキストの解析も確認します。
+一致しないページ・照合や解析の誤りがあれば終了コード 1 を返します。
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from indeed_job_analyzer import (JOB_EXTRACTORS, KeywordMatcher, compact_page_lines,  # noqa: E402
+                                 format_job_blocks, normalize_salaries, pd)
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# (除外キーワード, カードのテキスト, 当たるべきキーワード or None)
+KEYWORD_CASES = [
+    (["IT"], "Digital マーケター", None),
+    (["IT"], "IT企業の社内SE", "IT"),
+    (["IT"], "ＩＴサポート", "IT"),
+    (["AI"], "Email 対応スタッフ", None),
+    (["AI"], "Tailwind CSS でのフロント開発", None),
+    (["AI"], "生成AIエンジニア", "AI"),
+    (["AI", "Email"], "Email マーケティング", "Email"),
+    (["ホテル"], "ホテルフロントスタッフ", "ホテル"),
+    (["清掃"], "客室清掃・ベッドメイク", "清掃"),
+    (["C++"], "C++ エンジニア", "C++"),
+]
+
+# (給与テキスト, 下限, 上限, 支給単位)  金額が無い側は None
+SALARY_CASES = [
+    ("月給25万円〜", 250000, None, "month"),
+    ("月給 25万 ~ 40万円", 250000, 400000, "month"),
+    ("月給25~40万円", 250000, 400000, "month"),
+    ("時給 1,200 ~ 1,500円", 1200, 1500, "hour"),
+    ("年収 400万円以上", 4000000, None, "year"),
+    ("~40万円", None, 400000, "month"),
+    ("日給 1万2,000円", 12000, None, "day"),
+    ("月給 25万5,000円 ~ 30万円", 255000, 300000, "month"),
+    ("月給 20万〜25万5000円", 200000, 255000, "month"),
+    ("月給 25万 8時間", 250000, None, "month"),
+]
+
+
+def load_pages(paths):
+    pages = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            pages.append((os.path.basename(path), f.read()))
+    return pages
+
+
+def check_parity(engines, pages):
+    """ 基準 (bs4) とブロック・全文テキスト・行分割が一致するか """
+    ok = True
+    reference = engines["bs4"]
+    for name, html in pages:
+        expected_blocks = format_job_blocks(reference.extract_blocks(html))
+        expected_text = reference.full_text(html)
+        expected_lines = reference.text_lines(html)
+        for engine_name, engine in engines.items():
+            if engine is reference:
+                continue
+            blocks_match = format_job_blocks(engine.extract_blocks(html)) == expected_blocks
+            text_match = engine.full_text(html) == expected_text
+            lines_match = engine.text_lines(html) == expected_lines
+            status = "✅" if blocks_match and text_match and lines_match else "❌"
+            print(f"{status} {name}: {engine_name} blocks={'一致' if blocks_match else '不一致'} "
+                  f"fulltext={'一致' if text_match else '不一致'} lines={'一致' if lines_match else '不一致'}")
+            ok = ok and blocks_match and text_match and lines_match
+    return ok
+
+
+def check_keywords():
+    """ KEYWORD_CASES のとおりに当たる・当たらないか """
+    ok = True
+    for keywords, text, expected in KEYWORD_CASES:
+        found = KeywordMatcher(keywords).search(text)
+        if found != expected:
+            print(f"❌ 除外キーワード {keywords}: 「{text}」 -> {found}（期待 {expected}）")
+            ok = False
+    if ok:
+        print(f"✅ 除外キーワード照合: {len(KEYWORD_CASES)}件")
+    return ok
+
+
+def check_salaries():
+    """ SALARY_CASES のとおりに下限・上限・支給単位が取れるか """
+    if pd is None:
+        print("⚠️ 給与の解析はスキップ: pandas がありません")
+        return True
+    df = normalize_salaries(pd.DataFrame({"salary": [text for text, *_ in SALARY_CASES]}))
+    ok = True
+    for (text, lo, hi, period), (_, row) in zip(SALARY_CASES, df.iterrows()):
+        got = tuple(None if pd.isna(v) else v for v in (row["salary_min"], row["salary_max"], row["salary_period"]))
+        if got != (lo, hi, period):
+            print(f"❌ 給与「{text}」 -> {got}（期待 {(lo, hi, period)}）")
+            ok = False
+    if ok:
+        print(f"✅ 給与の解析: {len(SALARY_CASES)}件")
+    return ok
+
+
+def report_compaction(engine, pages):
+    """ 全文モードに落ちたときの圧縮率（ページ全体を対象に計算） """
+    print("\n🗜️ 全文モードの圧縮")
+    for name, html in pages:
+        _, stats = compact_page_lines(engine.text_lines(html))
+        print(f"   {name}: {stats['tokens_in']} → {stats['tokens_out']}tok ({stats['ratio']:.0%})  "
+              f"定型文 {stats['boilerplate']}行 / 重複 {stats['duplicates']}行 / "
+              f"領域 {stats['regions_kept']}/{stats['regions']}")
+
+
+def measure(engine, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _, html in pages:
+            engine.extract_blocks(html)
+    elapsed = time.perf_counter() - start
+    count = repeat * len(pages)
+    return elapsed / count, count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="抽出エンジンの一致確認とベンチマーク")
+    parser.add_argument("files", nargs="*", help="保存した検索結果HTML（省略時は fixtures/*.html）")
+    parser.add_argument("--repeat", type=int, default=50, help="各ページを処理する回数")
+    args = parser.parse_args()
+
+    paths = args.files or sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.html")))
+    if not paths:
+        print("❌ HTML がありません")
+        return 1
+    pages = load_pages(paths)
+
+    engines = {}
+    for name, cls in JOB_EXTRACTORS.items():
+        try:
+            engines[name] = cls()
+        except ImportError as e:
+            print(f"⚠️ {name} はスキップ: {e}")
+
+    ok = check_parity(engines, pages)
+    ok = check_keywords() and ok
+    ok = check_salaries() and ok
+    report_compaction(engines["bs4"], pages)
+
+    print(f"\n📊 {len(pages)}ページ x {args.repeat}回")
+    base = None
+    for name, engine in engines.items():
+        per_page, throughput = measure(engine, pages, args.repeat)
+        if base is None:
+            base = per_page
+        print(f"   {name:>5}: {per_page * 1000:8.2f} ms/ページ  {throughput:8.1f} ページ/秒  "
+              f"(x{base / per_page:.1f})")
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+indeed_job_analyzer の import 時間の確認
+
+使い方:
+    python benchmarks/bench_import.py                 # 5回計測して中央値を表示
+    python benchmarks/bench_import.py --budget-ms 100 --repeat 9
+
+新しいプロセスで `python -X importtime -c "import indeed_job_analyzer"` を実行し、
+累積時間の中央値と、時間のかかったモジュールの上位を表示します。
+予算 (--budget-ms) を超えたとき、またはブラウザ・HTTP クライアントなど
+使うまで読み込まないはずのライブラリが import 時に読み込まれていたときは終了コード 1 を返します。
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# import しただけでは読み込まれてはいけないもの（最初に使ったときに読み込む）
+LAZY_MODULES = ["DrissionPage", "bs4", "groq", "duckduckgo_search", "lxml", "zstandard", "pyarrow",
+                "pandas", "asyncio"]
+DEFAULT_BUDGET_MS = 150.0
+
+
+def measure_once(module):
+    """ 新しいプロセスで1回 import して {モジュール名: (自身のμs, 累積μs)} を返す """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT_DIR, os.environ.get("PYTHONPATH")])))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, cwd=ROOT_DIR, env=env)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import 失敗")
+    timings = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="import 時間の計測と予算チェック")
+    parser.add_argument("--module", default="indeed_job_analyzer", help="計測するモジュール")
+    parser.add_argument("--repeat", type=int, default=5, help="計測回数（中央値を使う）")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="累積 import 時間の上限")
+    parser.add_argument("--top", type=int, default=10, help="表示する重いモジュールの数")
+    args = parser.parse_args()
+
+    # 1回目は .pyc の作成が混ざるので捨てる
+    measure_once(args.module)
+    runs = [measure_once(args.module) for _ in range(max(1, args.repeat))]
+
+    totals = [run[args.module][1] / 1000 for run in runs]
+    median_ms = statistics.median(totals)
+    print(f"📦 import {args.module}: 中央値 {median_ms:.1f} ms "
+          f"(最小 {min(totals):.1f} / 最大 {max(totals):.1f} ms, {len(runs)}回)")
+
+    last = runs[-1]
+    heaviest = sorted(last.items(), key=lambda item: item[1][1], reverse=True)
+    print(f"\n   {'モジュール':<40}{'自身(ms)':>10}{'累積(ms)':>10}")
+    for name, (self_us, cumulative_us) in heaviest[:args.top]:
+        print(f"   {name:<40}{self_us / 1000:>10.1f}{cumulative_us / 1000:>10.1f}")
+
+    ok = True
+    loaded = sorted({name.split(".")[0] for name in last} & set(LAZY_MODULES))
+    if loaded:
+        print(f"\n❌ import 時に読み込まれています: {', '.join(loaded)}")
+        ok = False
+    if median_ms > args.budget_ms:
+        print(f"\n❌ 予算 {args.budget_ms:.0f} ms を超えています")
+        ok = False
+    if ok:
+        print(f"\n✅ 予算 {args.budget_ms:.0f} ms 以内・重いライブラリは未読み込み")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+パイプライン全体のオフライン・ベンチマーク
+
+使い方:
+    python benchmarks/bench_pipeline.py                          # 6社・偽Groq 200ms
+    python benchmarks/bench_pipeline.py --companies 12 --rate-429 0.05 --latency-ms 400
+    python benchmarks/bench_pipeline.py --hedge --model-latency llama-3.1-8b-instant=800
+    python benchmarks/bench_pipeline.py --save-baseline          # 結果を基準として保存
+    python benchmarks/bench_pipeline.py --baseline baselines/pipeline.json
+
+ブラウザ・Groq・DuckDuckGo を使わずに
+    企業情報検索 (スタブ) → 業界フィルター → 検索結果の解析 (fixtures/*.html をスナップショットから再生)
+    → 最終レポート
+を一通り実行し、スループット（社/分）、段階ごとの p50/p95、最大メモリを表示します。
+Groq は fake_groq.py の偽サーバー（遅延・429 を設定可能）に向けます。
+キャッシュ類は毎回空の一時ディレクトリに作るので、常に「初回実行」の計測になります。
+基準より悪化していれば終了コード 1 を返します。
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import indeed_job_analyzer as analyzer_module  # noqa: E402
+from indeed_job_analyzer import GroqRateScheduler, ModelRouter, TalentScopeAI, MODEL_HEAVY, MODEL_LIGHT  # noqa: E402
+from fake_groq import FakeGroqState, parse_model_latency, start_background  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCH_DIR, "fixtures")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baselines", "pipeline.json")
+
+
+class StubSearchBackend:
+    """ DDGSSearchBackend の代わり。決まった検索結果を少し待ってから返す """
+    name = "stub"
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+
+    def search(self, query, max_results=2):
+        time.sleep(self.latency)
+        body = f"{query} は映像制作・広告制作を手がける企業です。"
+        return [{"title": query, "href": "https://example.com/", "body": body}][:max_results]
+
+
+def make_companies(count):
+    return [{"name": f"ベンチ企業{i + 1:02d}", "loc": "東京都渋谷区"} for i in range(count)]
+
+
+def seed_snapshots(analyzer, companies, fixtures):
+    """ 各社の検索戦略すべてに fixtures の HTML を順番に割り当てて保存する """
+    for i, comp in enumerate(companies):
+        html = fixtures[i % len(fixtures)]
+        for strategy in analyzer._build_strategies(comp):
+            analyzer.snapshots.save(html, strategy["q"], strategy["l"], strategy["desc"])
+
+
+def peak_memory_mb():
+    """ プロセスの最大常駐メモリ (MB)。取れなければ None """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS は bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_pipeline(args, fixtures):
+    state = FakeGroqState(args.latency_ms, args.jitter_ms, args.rate_429, args.retry_after,
+                          args.rpm, args.tpm, seed=args.seed, model_latency=parse_model_latency(args.model_latency))
+    server, base_url = start_background(state)
+    companies = make_companies(args.companies)
+    output = io.StringIO()
+    try:
+        with tempfile.TemporaryDirectory(prefix="talentscope_bench_") as tmp:
+            # キャッシュ・スナップショット・求人インデックスを一時ディレクトリへ
+            analyzer_module.CACHE_DIR = tmp
+            limits = {model: {"rpm": args.rpm, "tpm": args.tpm} for model in (MODEL_HEAVY, MODEL_LIGHT)}
+            GroqRateScheduler._shared = GroqRateScheduler(limits)
+            ModelRouter._shared = ModelRouter(limits=limits)
+
+            quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(output)
+            with quiet, TalentScopeAI(api_key="bench", groq_base_url=base_url,
+                                      search_backend=StubSearchBackend(args.search_latency_ms / 1000),
+                                      extractor_engine=args.engine, hedge=args.hedge) as analyzer:
+                seed_snapshots(analyzer, companies, fixtures)
+                started = time.perf_counter()
+                with analyzer.tracer.span("run", companies=len(companies)) as run_span:
+                    filter_data = analyzer.build_strict_filter(companies)
+                    results = analyzer.run_many(companies, filter_data, max_workers=args.workers, replay=True)
+                    report = analyzer.analyze_with_groq(results, companies, filter_data)
+                elapsed = time.perf_counter() - started
+                stages = analyzer.tracer.summary(run_span.trace_id)
+                rate_metrics = analyzer.rate_scheduler.metrics
+                models = analyzer.router.snapshot()
+                router_metrics = dict(analyzer.router.metrics)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    jobs = sum(data["count"] for data in results.values() if data)
+    return {
+        "config": {key: getattr(args, key) for key in
+                   ("companies", "workers", "engine", "latency_ms", "jitter_ms", "rate_429", "rpm", "tpm",
+                    "model_latency", "hedge")},
+        "fixtures": len(fixtures),
+        "elapsed_s": round(elapsed, 3),
+        "companies_per_min": round(len(companies) / elapsed * 60, 2),
+        "jobs": jobs,
+        "report_chars": len(report or ""),
+        "peak_memory_mb": peak_memory_mb(),
+        "server": state.stats,
+        "client_rate_limited": rate_metrics["rate_limited"],
+        "models": models,
+        "router": router_metrics,
+        "stages": {row["name"]: {"count": row["count"], "p50_ms": row["p50_ms"], "p95_ms": row["p95_ms"],
+                                 "total_s": row["total_s"]} for row in stages},
+    }
+
+
+def print_result(result):
+    print(f"\n📊 {result['config']['companies']}社 / {result['config']['workers']}並列 / "
+          f"偽Groq {result['config']['latency_ms']:.0f}ms 429率 {result['config']['rate_429']:.0%}")
+    print(f"   所要時間: {result['elapsed_s']:.2f}秒  スループット: {result['companies_per_min']:.1f} 社/分  "
+          f"求人: {result['jobs']}件")
+    memory = result["peak_memory_mb"]
+    print(f"   最大メモリ: {f'{memory:.1f} MB' if memory is not None else '不明'}  "
+          f"Groq: {result['server']['requests']}回 (429 {result['server']['rate_limited']}回)")
+    print(f"\n   {'段階':<20}{'回数':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'合計(秒)':>10}")
+    for name, row in result["stages"].items():
+        print(f"   {name:<20}{row['count']:>6}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['total_s']:>10.2f}")
+    print(f"\n   {'モデル':<28}{'回数':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'失敗率':>8}{'429率':>8}")
+    for row in result.get("models", []):
+        print(f"   {row['model']:<28}{row['calls']:>6}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+              f"{row['error_rate']:>8.0%}{row['throttle_rate']:>8.0%}")
+    router = result.get("router", {})
+    print(f"   振替 {router.get('routed', 0)}回 / ヘッジ {router.get('hedged', 0)}回 "
+          f"(うち勝ち {router.get('hedge_wins', 0)}回)")
+
+
+def compare(result, baseline, tolerance):
+    """ 基準と比べて tolerance (割合) を超えて悪化した項目を返す """
+    regressions = []
+    # 後から増えた設定項目は既定値として比べる
+    base_config = {"model_latency": [], "hedge": False, **baseline.get("config", {})}
+    if base_config != result["config"]:
+        print("⚠️ 基準と設定が異なります（比較は参考値）")
+
+    floor = baseline["companies_per_min"] * (1 - tolerance)
+    if result["companies_per_min"] < floor:
+        regressions.append(f"スループット {result['companies_per_min']:.1f} < {baseline['companies_per_min']:.1f} 社/分")
+
+    base_memory, memory = baseline.get("peak_memory_mb"), result["peak_memory_mb"]
+    if base_memory and memory and memory > base_memory * (1 + tolerance):
+        regressions.append(f"最大メモリ {memory:.1f} > {base_memory:.1f} MB")
+
+    for name, row in result["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        # 数ms の段階は揺らぎが大きいので比べない
+        if not base or base["p95_ms"] < 5:
+            continue
+        if row["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name} p95 {row['p95_ms']:.1f} > {base['p95_ms']:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="パイプライン全体のオフライン・ベンチマーク")
+    parser.add_argument("files", nargs="*", help="保存した検索結果HTML（省略時は fixtures/*.html）")
+    parser.add_argument("--companies", type=int, default=6, help="ダミー企業の数")
+    parser.add_argument("--workers", type=int, default=3, help="同時に解析する企業数")
+    parser.add_argument("--engine", default="auto", help="求人カード抽出エンジン")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="偽Groqの平均遅延")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="偽Groqの遅延の標準偏差")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="偽Groqが 429 を返す割合 (0〜1)")
+    parser.add_argument("--retry-after", type=float, default=0.5, help="429 の retry-after 秒")
+    parser.add_argument("--rpm", type=int, default=1000, help="1分あたりのリクエスト上限")
+    parser.add_argument("--tpm", type=int, default=1000000, help="1分あたりのトークン上限")
+    parser.add_argument("--search-latency-ms", type=float, default=50.0, help="スタブ Web 検索の遅延")
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=MS",
+                        help="偽Groqでこのモデルだけ平均遅延を変える（複数指定可）")
+    parser.add_argument("--hedge", action="store_true", help="遅い応答を別モデルにも送る（ヘッジ）")
+    parser.add_argument("--seed", type=int, default=0, help="遅延・429 の乱数シード")
+    parser.add_argument("--json", metavar="PATH", help="結果を JSON で書き出す")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, metavar="PATH",
+                        help="結果を基準として保存する")
+    parser.add_argument("--baseline", metavar="PATH", help="この基準と比べる（省略時は既定の基準があれば使う）")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="悪化とみなす割合")
+    parser.add_argument("--verbose", action="store_true", help="解析中のログも表示する")
+    args = parser.parse_args()
+
+    paths = args.files or sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.html")))
+    if not paths:
+        print("❌ HTML がありません")
+        return 1
+    fixtures = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            fixtures.append(f.read())
+
+    result = run_pipeline(args, fixtures)
+    print_result(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 基準を保存しました: {args.save_baseline}")
+        return 0
+
+    baseline_path = args.baseline or (DEFAULT_BASELINE if os.path.exists(DEFAULT_BASELINE) else None)
+    if baseline_path is None:
+        return 0
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(result, baseline, args.tolerance)
+    if regressions:
+        print(f"\n❌ 基準 ({baseline_path}) より悪化:")
+        for line in regressions:
+            print(f"   - {line}")
+        return 1
+    print(f"\n✅ 基準 ({baseline_path}) の範囲内")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+非同期 API (AsyncGroq) の通し確認
+
+使い方:
+    python benchmarks/check_async.py
+    python benchmarks/check_async.py --latency-ms 100 saved_page.html
+
+fake_groq.py の偽サーバーに向けて
+    generate_strict_filter_async → extract_jobs_via_ai_async (fixtures/*.html) → analyze_with_groq_async
+を実行し、同期版と同じ結果になるか（失敗時の既定値に落ちていないか）を確認します。
+一致しない・応答が取れない項目があれば終了コード 1 を返します。
+"""
+import argparse
+import asyncio
+import contextlib
+import glob
+import io
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import indeed_job_analyzer as analyzer_module  # noqa: E402
+from indeed_job_analyzer import GroqRateScheduler, ModelRouter, TalentScopeAI, MODEL_HEAVY, MODEL_LIGHT  # noqa: E402
+from fake_groq import DEFAULT_FILTER, FakeGroqState, start_background  # noqa: E402
+from bench_pipeline import FIXTURE_DIR, StubSearchBackend  # noqa: E402
+
+COMPANY = {"name": "株式会社Example", "loc": "東京都渋谷区"}
+
+
+def run_both(analyzer, pages):
+    """ 同期版・非同期版で同じ処理をして (同期, 非同期) の結果を返す """
+    search_results = f"■{COMPANY['name']}の情報:\n- 映像制作・広告制作を手がける企業です。\n"
+
+    def sync_run():
+        filter_data = analyzer.generate_strict_filter(search_results)
+        jobs = [analyzer.extract_jobs_via_ai(html, COMPANY["name"], COMPANY["loc"], filter_data) for html in pages]
+        results = {COMPANY["name"]: analyzer._format_search_result([j for page in jobs for j in page])}
+        return filter_data, jobs, analyzer.analyze_with_groq(results, [COMPANY], filter_data, summary=False)
+
+    async def async_run():
+        filter_data = await analyzer.generate_strict_filter_async(search_results)
+        jobs = await asyncio.gather(*(analyzer.extract_jobs_via_ai_async(html, COMPANY["name"], COMPANY["loc"],
+                                                                          filter_data) for html in pages))
+        results = {COMPANY["name"]: analyzer._format_search_result([j for page in jobs for j in page])}
+        report = await analyzer.analyze_with_groq_async(results, [COMPANY], filter_data, summary=False)
+        return filter_data, list(jobs), report
+
+    return sync_run(), asyncio.run(async_run())
+
+
+def check(sync_result, async_result):
+    """ 確認項目ごとに (名前, OK か, 詳細) を返す """
+    sync_filter, sync_jobs, sync_report = sync_result
+    async_filter, async_jobs, async_report = async_result
+    return [
+        ("業界フィルター", async_filter == DEFAULT_FILTER, f"{async_filter}"),
+        ("求人抽出", [len(p) for p in async_jobs] == [len(p) for p in sync_jobs] and sum(map(len, async_jobs)) > 0,
+         f"同期 {[len(p) for p in sync_jobs]} / 非同期 {[len(p) for p in async_jobs]}"),
+        ("レポート", bool(async_report) and "生成失敗" not in async_report and async_report == sync_report,
+         f"同期 {len(sync_report or '')}文字 / 非同期 {len(async_report or '')}文字"),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="非同期 API の通し確認")
+    parser.add_argument("files", nargs="*", help="保存した検索結果HTML（省略時は fixtures/*.html）")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="偽Groqの平均遅延")
+    parser.add_argument("--verbose", action="store_true", help="解析中のログも表示する")
+    args = parser.parse_args()
+
+    paths = args.files or sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.html")))
+    pages = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            pages.append(f.read())
+
+    server, base_url = start_background(FakeGroqState(args.latency_ms, 0.0, seed=0))
+    output = io.StringIO()
+    try:
+        with tempfile.TemporaryDirectory(prefix="talentscope_async_") as tmp:
+            analyzer_module.CACHE_DIR = tmp
+            limits = {model: {"rpm": 1000, "tpm": 1000000} for model in (MODEL_HEAVY, MODEL_LIGHT)}
+            GroqRateScheduler._shared = GroqRateScheduler(limits)
+            ModelRouter._shared = ModelRouter(limits=limits)
+            quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(output)
+            # キャッシュを使うと非同期側が同期側の応答を読むだけになるので切る
+            with quiet, TalentScopeAI(api_key="bench", groq_base_url=base_url, use_cache=False,
+                                      use_job_index=False, search_backend=StubSearchBackend(0)) as analyzer:
+                sync_result, async_result = run_both(analyzer, pages)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    ok = True
+    for name, passed, detail in check(sync_result, async_result):
+        print(f"{'✅' if passed else '❌'} {name}: {detail}")
+        ok = ok and passed
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Groq chat.completions API のローカル偽サーバー（ベンチマーク用）
+
+使い方:
+    python benchmarks/fake_groq.py --port 8765 --latency-ms 300 --rate-429 0.05
+    python benchmarks/fake_groq.py --model-latency llama-3.1-8b-instant=1500   # モデルごとに遅延を変える
+
+TalentScopeAI(groq_base_url="http://127.0.0.1:8765") で接続できます。
+応答は決まった JSON を返します。
+    - 業界フィルター: {"target_industry": ..., "negative_keywords": ...}
+    - 求人抽出: プロンプト中の [JOB_BLOCK_n] ごとに1件
+    - stream=True: レポート風のテキストを SSE で少しずつ返す
+指定した割合で 429 (retry-after 付き) を返し、x-ratelimit-* ヘッダーも付けます。
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHAT_PATH = "/openai/v1/chat/completions"
+
+DEFAULT_FILTER = {"target_industry": "映像制作", "negative_keywords": "ホテル, クリニック, 清掃"}
+DEFAULT_REPORT = (
+    "## 採用動向\n\n"
+    "| 職種 | 給与 | 勤務地 |\n|---|---|---|\n"
+    "| 映像ディレクター | 月給30万円〜 | 東京都渋谷区 |\n\n"
+    "### 分析\n\n"
+    "クリエイティブ職の採用が中心で、経験者向けの給与水準はやや高めです。"
+    "リモート可の求人は少なく、出社前提の制作体制がうかがえます。\n"
+)
+
+_BLOCK_PATTERN = re.compile(r'\[JOB_BLOCK_(\d+)\]')
+_URL_PATTERN = re.compile(r'URL: (\S+)')
+
+
+def estimate_tokens(text):
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+class FakeGroqState:
+    """ 設定と集計（ハンドラーのスレッド間で共有） """
+
+    def __init__(self, latency_ms=200.0, jitter_ms=50.0, rate_429=0.0, retry_after=1.0,
+                 rpm=1000, tpm=1000000, filter_data=None, report=None, seed=None, model_latency=None):
+        self.latency_ms = latency_ms
+        self.model_latency = dict(model_latency or {})  # model -> 平均遅延(ms)。無ければ latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rpm = rpm
+        self.tpm = tpm
+        self.filter_data = filter_data or DEFAULT_FILTER
+        self.report = report or DEFAULT_REPORT
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window = deque()  # (時刻, トークン数)  直近1分の受付分
+        self.stats = {"requests": 0, "streams": 0, "rate_limited": 0, "prompt_tokens": 0,
+                      "completion_tokens": 0}
+
+    def delay(self, model=None):
+        with self._lock:
+            ms = self._random.gauss(self.model_latency.get(model, self.latency_ms), self.jitter_ms)
+        return max(0.0, ms) / 1000
+
+    def admit(self, tokens):
+        """ 429 にするかを決め、受け付けたら残量を返す: (ok, 残りリクエスト, 残りトークン) """
+        now = time.monotonic()
+        with self._lock:
+            while self._window and now - self._window[0][0] > 60:
+                self._window.popleft()
+            used_requests = len(self._window)
+            used_tokens = sum(t for _, t in self._window)
+            if self._random.random() < self.rate_429:
+                self.stats["rate_limited"] += 1
+                return False, max(0, self.rpm - used_requests), max(0, self.tpm - used_tokens)
+            self._window.append((now, tokens))
+            self.stats["requests"] += 1
+            return True, max(0, self.rpm - used_requests - 1), max(0, self.tpm - used_tokens - tokens)
+
+    def count(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    def reply_for(self, body):
+        """ リクエスト内容から返すテキストを決める """
+        prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+        if body.get("response_format", {}).get("type") == "json_object":
+            if "target_industry" in prompt and "JOB_BLOCK" not in prompt:
+                return json.dumps(self.filter_data, ensure_ascii=False)
+            return json.dumps({"jobs": self._jobs_for(prompt)}, ensure_ascii=False)
+        return self.report
+
+    def _jobs_for(self, prompt):
+        jobs = []
+        sections = _BLOCK_PATTERN.split(prompt)
+        for no, text in zip(sections[1::2], sections[2::2]):
+            url = _URL_PATTERN.search(text)
+            jobs.append({
+                "block": int(no),
+                "title": f"職種{no}",
+                "url": url.group(1) if url else "URL_NOT_FOUND",
+                "salary": "月給25万円〜",
+                "location": "東京都渋谷区",
+                "remote": "不明",
+                "details": "ベンチマーク用の固定応答",
+            })
+        return jobs
+
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None  # FakeGroqState（make_server で差し込む）
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # ヘッジで負けた側がキャンセルされると、応答を書く前に切断される
+            pass
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _limit_headers(self, remaining_requests, remaining_tokens):
+        return {
+            "x-ratelimit-limit-requests": str(self.state.rpm),
+            "x-ratelimit-remaining-requests": str(remaining_requests),
+            "x-ratelimit-reset-requests": "60s",
+            "x-ratelimit-limit-tokens": str(self.state.tpm),
+            "x-ratelimit-remaining-tokens": str(remaining_tokens),
+            "x-ratelimit-reset-tokens": "60s",
+        }
+
+    def do_POST(self):
+        if self.path.rstrip("/") != CHAT_PATH:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON"}})
+            return
+
+        prompt_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in body.get("messages", []))
+        ok, remaining_requests, remaining_tokens = self.state.admit(prompt_tokens)
+        headers = self._limit_headers(remaining_requests, remaining_tokens)
+        if not ok:
+            headers["retry-after"] = str(self.state.retry_after)
+            self._send_json(429, {"error": {"message": "Rate limit reached (fake)", "type": "tokens",
+                                            "code": "rate_limit_exceeded"}}, headers)
+            return
+
+        text = self.state.reply_for(body)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": estimate_tokens(text),
+                 "total_tokens": prompt_tokens + estimate_tokens(text)}
+        self.state.count(prompt_tokens=usage["prompt_tokens"], completion_tokens=usage["completion_tokens"])
+        model = body.get("model", "fake")
+        if body.get("stream"):
+            self._stream(model, text, usage, headers)
+            return
+
+        time.sleep(self.state.delay(model))
+        self._send_json(200, {
+            "id": f"chatcmpl-{random.getrandbits(48):x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                         "finish_reason": "stop"}],
+            "usage": usage,
+        }, headers)
+
+    def _stream(self, model, text, usage, headers):
+        """ SSE で少しずつ返す（遅延の半分を最初の断片まで、残りを断片間に配分） """
+        self.state.count(streams=1)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.close_connection = True
+
+        completion_id = f"chatcmpl-{random.getrandbits(48):x}"
+        pieces = [text[i:i + 40] for i in range(0, len(text), 40)] or [""]
+        delay = self.state.delay(model)
+        time.sleep(delay / 2)
+
+        def chunk(delta, finish_reason=None, extra=None):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if extra:
+                payload.update(extra)
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        for i, piece in enumerate(pieces):
+            chunk({"role": "assistant", "content": piece} if i == 0 else {"content": piece})
+            time.sleep(delay / 2 / len(pieces))
+        chunk({}, "stop", {"x_groq": {"id": completion_id, "usage": usage}})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def parse_model_latency(items):
+    """ ["model=ms", ...] を {model: ms} にする """
+    latency = {}
+    for item in items:
+        model, _, ms = item.rpartition("=")
+        if not model:
+            raise ValueError(f"MODEL=MS の形で指定してください: {item}")
+        latency[model] = float(ms)
+    return latency
+
+
+def make_server(state, host="127.0.0.1", port=0):
+    """ ThreadingHTTPServer を作る（port=0 なら空きポート）。base_url は server_address から """
+    handler = type("BoundFakeGroqHandler", (FakeGroqHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_background(state, host="127.0.0.1", port=0):
+    """ 別スレッドで起動して (server, base_url) を返す。止めるときは server.shutdown() """
+    server = make_server(state, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{server.server_address[0]}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Groq API の偽サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="応答までの平均遅延")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="遅延の標準偏差")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="429 を返す割合 (0〜1)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 の retry-after 秒")
+    parser.add_argument("--rpm", type=int, default=1000, help="ヘッダーで知らせる1分あたりのリクエスト上限")
+    parser.add_argument("--tpm", type=int, default=1000000, help="ヘッダーで知らせる1分あたりのトークン上限")
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=MS",
+                        help="このモデルだけ平均遅延を変える（複数指定可）")
+    args = parser.parse_args()
+
+    state = FakeGroqState(args.latency_ms, args.jitter_ms, args.rate_429, args.retry_after, args.rpm, args.tpm,
+                          model_latency=parse_model_latency(args.model_latency))
+    server = make_server(state, args.host, args.port)
+    print(f"🧪 偽 Groq サーバー: http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"   集計: {state.stats}")
+
+
+if __name__ == "__main__":
+    main()
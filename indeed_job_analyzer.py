@@ -3,13 +3,79 @@ import time
 import random
 import sys
 import json
+import argparse
+import csv
+import functools
 import re
 import os
+import queue
+import socket
+import sqlite3
+import gzip
+import hashlib
+import heapq
+import importlib
+import importlib.util
+import contextvars
+import itertools
+import threading
+import unicodedata
 import urllib.parse
-from DrissionPage import ChromiumPage, ChromiumOptions
-from bs4 import BeautifulSoup
-from groq import Groq, RateLimitError
-from duckduckgo_search import DDGS
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+
+class _LazyModule:
+    """ 最初に属性を参照したときに import するモジュールの代理。
+        ブラウザ・HTTP クライアントなど重いライブラリは、使う処理が走るまで読み込まない """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def _optional_module(name):
+    """ インストールされていれば遅延読み込みの代理、無ければ None（有無の確認では import しない） """
+    if importlib.util.find_spec(name.split(".")[0]) is None:
+        return None
+    return _LazyModule(name)
+
+
+DrissionPage = _LazyModule("DrissionPage")
+bs4 = _LazyModule("bs4")
+groq = _LazyModule("groq")
+duckduckgo_search = _LazyModule("duckduckgo_search")
+# asyncio も非同期 API (*_async) を使うときだけ読み込む
+asyncio = _LazyModule("asyncio")
+
+# zstandard があればスナップショットを zstd で圧縮（無ければ gzip）
+zstandard = _optional_module("zstandard")
+
+# lxml があれば高速な抽出エンジンを使う（無ければ BeautifulSoup のみ）
+lxml_etree = _optional_module("lxml.etree")
+lxml_html = _optional_module("lxml.html")
+
+# pyarrow があれば求人データを Parquet で書き出せる
+pyarrow = _optional_module("pyarrow")
+pyarrow_parquet = _optional_module("pyarrow.parquet")
+
+# pandas があれば給与テキストを列ごとまとめて数値化できる
+pd = _optional_module("pandas")
 
 # ==========================================
 # 設定エリア
@@ -19,92 +85,2813 @@ GROQ_API_KEY = "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"
 MODEL_HEAVY = "llama-3.3-70b-versatile"
 MODEL_LIGHT = "llama-3.1-8b-instant"
 
+# Groq API の接続先。None なら本番（ベンチマークではローカルの偽サーバーを指す）
+GROQ_BASE_URL = None
+
+# 並列検索の設定
+# 同時に調べる企業数と、jp.indeed.com へのアクセス上限（回/秒, 全スレッド合計）
+MAX_PARALLEL_SEARCHES = 3
+INDEED_MAX_RPS = 0.5
+
+# ブラウザを使い回す数（同時に起動しておく Chromium の上限）
+# 並列検索の数より少ないと、残りのスレッドはブラウザの返却待ちになる
+BROWSER_POOL_SIZE = MAX_PARALLEL_SEARCHES
+
+# 求人カード抽出エンジン ("auto" / "lxml" / "bs4")
+JOB_EXTRACTOR_ENGINE = "auto"
+
+# カードから給与・勤務地などをルールで先に埋め、LLM には残りだけ聞く
+RULE_EXTRACTION = True
+
+# 抽出プロンプトの分割設定
+# 1回の LLM 呼び出しに載せる求人テキストの目安トークン数と、同時に投げる数
+EXTRACTION_BATCH_TOKENS = 6000
+# 抽出プロンプトの指示文の分として見込むトークン数
+EXTRACTION_PROMPT_TOKENS = 400
+EXTRACTION_MAX_CONCURRENCY = 4
+# 全文モードで送るチャンク数の上限
+FULLTEXT_MAX_BATCHES = 4
+# 全文モードでは求人らしい部分だけを残して詰めてから送る
+FULLTEXT_COMPACT = True
+
+# Groq のレート制限（1分あたりのリクエスト数・トークン数）
+# 実際の残量はレスポンスヘッダーで随時上書きされるので、ここは初期値
+MODEL_RATE_LIMITS = {
+    MODEL_HEAVY: {"rpm": 30, "tpm": 12000},
+    MODEL_LIGHT: {"rpm": 30, "tpm": 6000},
+}
+DEFAULT_RATE_LIMIT = {"rpm": 30, "tpm": 6000}
+# 応答分として見込んでおくトークン数
+EXPECTED_COMPLETION_TOKENS = 512
+# 429 で retry-after が無いときのバックオフ（秒）
+RATE_LIMIT_BACKOFF_BASE = 5
+RATE_LIMIT_BACKOFF_MAX = 60
+
+# 非同期 API で 1回の Groq 呼び出しを待つ上限（秒）
+GROQ_CALL_TIMEOUT = 120
+
+# モデルの選び分け（直近の応答時間・失敗率・429率を見て、リクエストごとに使うモデルを決める）
+# 並びは重い（品質の高い）順。allow_fallback のない呼び出しは指定より軽いモデルへは回さない
+ROUTER_MODELS = [MODEL_HEAVY, MODEL_LIGHT]
+ROUTER_WINDOW = 100          # モデルごとに覚えておく直近の呼び出し数
+ROUTER_MIN_SAMPLES = 5       # 成功がこれより少ないモデルは実績で判断しない
+ROUTER_MAX_ERROR_RATE = 0.5  # 直近の失敗率（429 を含む）がこれを超えたモデルは避ける
+# 一括抽出 (PRIORITY_BULK) を重いモデルへ振り替えるか。振り替えるとレポート生成と同じ枠を食い合うので既定は off
+ROUTER_BULK_UPGRADE = False
+# 求人抽出 1バッチの締め切り（秒）。見込みの p95 がこれを超えるなら間に合うモデルへ回す
+# （抽出はいちばん軽いモデルを使うので、振り替え先は ROUTER_BULK_UPGRADE が on のときだけある。
+#  既定ではこの締め切りで経路は変わらない）
+EXTRACTION_DEADLINE = 30
+# レポート 1セクション（と全体サマリー）の締め切り（秒）。重いモデルの見込みの p95 がこれを超えるなら
+# 軽いモデルで書く（レポートは allow_fallback 付きなので、既定で振り替えが効くのはこちら）
+REPORT_DEADLINE = 60
+# ヘッジ: 1本目が そのモデルの p95 を過ぎても返らなければ別モデルにも送り、先に届いた正しい応答を使う
+# （遅い尾は削れるが、ヘッジした分のトークンとリクエスト枠を余分に使う）
+HEDGE_REQUESTS = False
+HEDGE_MAX_WORKERS = 8
+
+# 最終レポート: 企業ごとのセクションを同時に何社分作るか / 最後に全体サマリーを付けるか
+REPORT_MAX_CONCURRENCY = 4
+REPORT_SUMMARY = True
+REPORT_SUMMARY_KEY = "__summary__"
+
+# Groq 呼び出しの優先度（小さいほど先に通す）
+PRIORITY_INTERACTIVE = 0  # レポート生成
+PRIORITY_NORMAL = 1       # 業界フィルター生成など
+PRIORITY_BULK = 2         # 求人の一括抽出
+
+# ローカルキャッシュの置き場所と Groq 応答キャッシュの設定
+CACHE_DIR = os.path.join(os.getcwd(), ".talentscope_cache")
+GROQ_CACHE_TTL = 7 * 24 * 3600          # 1週間
+GROQ_CACHE_MAX_BYTES = 200 * 1024 * 1024  # 200MB を超えたら古い順に削除
+
+# 企業情報の Web 検索
+WEB_SEARCH_WORKERS = 4                 # 同時に検索する企業数
+WEB_SEARCH_MAX_RPS = 1.0               # 検索エンジンへのアクセス上限（回/秒）
+WEB_SEARCH_MAX_RESULTS = 2
+COMPANY_INFO_TTL = 30 * 24 * 3600      # 検索結果を使い回す期間（30日）
+STRICT_FILTER_TTL = 7 * 24 * 3600      # 同じ企業リストの業界フィルターを使い回す期間（1週間）
+
+# 処理ごとの所要時間の計測 (スパン)
+TRACE_FILE = None        # JSON Lines の書き出し先。None ならメモリ上だけ
+TRACE_MAX_SPANS = 20000  # メモリに残すスパン数（古いものから捨てる）
+STATS_MAX_RECORDS = 2000  # 抽出バッチ・読み込み待ちの記録をメモリに残す件数（古いものから捨てる）
+
+# 取得した検索結果ページ(HTML)を保存しておく（オフライン再解析用）
+SAVE_SNAPSHOTS = True
+SNAPSHOT_DIR = None  # None なら CACHE_DIR/snapshots
+
+# jk ごとの求人インデックス（変わっていない求人は LLM に送らない）
+USE_JOB_INDEX = True
+
+# バッチモード（CSV / JSONL の企業リストを順に処理して JSONL へ書き出す）
+BATCH_CHUNK_PER_WORKER = 4   # 1度に読み込む企業数 = 並列数 x これ
+BATCH_FILTER_SAMPLE = 20     # 業界フィルターを作るのに使う先頭の企業数
+
+# 複数ワーカーで分担するときの作業キュー（SQLite）
+QUEUE_LEASE_SECONDS = 120     # タスクを借りてから、ハートビートが途切れて他のワーカーに渡すまで
+QUEUE_TASK_TIMEOUT = 900      # 1社にこれ以上かかったらリースの延長をやめて他のワーカーに任せる
+QUEUE_MAX_ATTEMPTS = 3        # これだけ失敗したらデッドレターにする
+QUEUE_RETRY_DELAY = 30        # 失敗したタスクを再び貸し出すまでの秒数
+QUEUE_POLL_SECONDS = 2.0
+
+# 求人データの Parquet 書き出し（run_date=YYYY-MM-DD/company=企業名/ で分割）
+PARQUET_PARTITION_COLS = ["run_date", "company"]
+
+# 給与テキストの正規化
+# 支給単位を表す語 -> 単位、単位ごとの年換算の倍率（1日8時間・月20日勤務）
+SALARY_PERIODS = {
+    "時給": "hour", "日給": "day", "日額": "day", "週給": "week",
+    "月給": "month", "月収": "month", "月額": "month", "年収": "year", "年俸": "year", "年額": "year",
+}
+SALARY_ANNUAL_FACTORS = {"hour": 8 * 20 * 12, "day": 20 * 12, "week": 52, "month": 12, "year": 1}
+# 単位が書かれていないときは金額から推定する（この金額未満ならこの単位）
+SALARY_PERIOD_GUESS = [(5000, "hour"), (50000, "day"), (2000000, "month")]
+
+# 検索結果のページ送り
+MAX_RESULT_PAGES = 1          # 1戦略あたり読むページ数（Indeed は1ページ約10〜15件）
+MAX_JOBS_PER_COMPANY = 100    # 1社あたりの求人数の上限（達したら打ち切り）
+RESULTS_PER_PAGE = 10         # Indeed の start= の刻み
+NEXT_PAGE_LOCATORS = [
+    'css:a[data-testid="pagination-page-next"]',
+    'css:a[aria-label="Next Page"]',
+    'css:a[aria-label="次へ"]',
+]
+
+# ページ読み込み待ちの上限（秒）
+PAGE_READY_TIMEOUT = 15
+DOCUMENT_READY_TIMEOUT = 10
+
+# 検索結果ページが「読み終わった」と判断できる DOM 条件
+# (名前, DrissionPage のロケーター or page を受け取る関数)
+SEARCH_RESULT_CONDITIONS = [
+    ("results", "css:h2.jobTitle"),
+    ("no_results", "css:.jobsearch-NoResult-messageContainer"),
+    ("no_results_text", "text:に一致する求人は見つかりませんでした"),
+    ("challenge", "css:iframe[src^='https://challenges.cloudflare.com']"),
+]
+DOCUMENT_READY_CONDITIONS = [
+    ("document_complete", lambda page: page.states.ready_state == "complete"),
+]
+
+
+# ==========================================
+# ▼ 進捗イベント (コンソール以外へのログ配信)
+# ==========================================
+# 今の処理の出力先。スレッドごと・実行ごとに分かれるよう contextvars で持つ
+_EVENT_SINK = contextvars.ContextVar("talentscope_event_sink", default=None)
+_EVENT_FIELDS = contextvars.ContextVar("talentscope_event_fields", default={})
+
+
+@contextmanager
+def event_sink(callback):
+    """ この中で起きた進捗イベントを callback(event) に渡す（別スレッドで動く分も含む） """
+    token = _EVENT_SINK.set(callback)
+    try:
+        yield
+    finally:
+        _EVENT_SINK.reset(token)
+
+
+@contextmanager
+def event_context(**fields):
+    """ この中で出すイベントに company などの項目を足す """
+    token = _EVENT_FIELDS.set({**_EVENT_FIELDS.get(), **fields})
+    try:
+        yield
+    finally:
+        _EVENT_FIELDS.reset(token)
+
+
+def emit_event(stage, message=None, **fields):
+    """ {"time", "stage", "message", ...} を今の出力先へ送る。出力先が無ければ何もしない """
+    sink = _EVENT_SINK.get()
+    if sink is None:
+        return
+    event = {"time": time.time(), "stage": stage, "message": message, **_EVENT_FIELDS.get(), **fields}
+    try:
+        sink(event)
+    except Exception:
+        pass
+
+
+def log(message, stage="log", **fields):
+    """ コンソールに出しつつ、同じ内容をイベントとしても流す """
+    print(message)
+    emit_event(stage, str(message).strip(), **fields)
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """ 投入したスレッドの contextvars を引き継ぐ ThreadPoolExecutor（イベントの出力先を失わないため） """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# ==========================================
+# ▼ 計測 (スパン)
+# ==========================================
+# 今開いているスパン。子スパンの親になる（スレッドへは ContextThreadPoolExecutor で引き継ぐ）
+_CURRENT_SPAN = contextvars.ContextVar("talentscope_span", default=None)
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class Span:
+    """ 1つの処理の開始・終了と属性（モデル名・トークン数など） """
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start = time.time()
+        self.duration = None
+        self.status = "ok"
+        self._t0 = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, key, amount):
+        """ 数値の属性に足し込む（リトライ回数・待ち時間など） """
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._t0
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class Tracer:
+    """ スパンを記録し、JSON Lines / OTLP(JSON) で書き出し、段階ごとに集計する。
+        一番外側のスパンが1回の実行（trace_id）になる """
+
+    def __init__(self, path=TRACE_FILE, max_spans=TRACE_MAX_SPANS):
+        self.path = path
+        self._lock = threading.Lock()
+        self.spans = deque(maxlen=max_spans)
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        parent = _CURRENT_SPAN.get()
+        trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        # event_context の company なども付けておく（企業ごとの集計用）
+        span = Span(name, trace_id, parent.span_id if parent else None,
+                    {**_EVENT_FIELDS.get(), **attributes})
+        token = _CURRENT_SPAN.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.status = "error"
+            span.set(error=str(e)[:200])
+            raise
+        finally:
+            _CURRENT_SPAN.reset(token)
+            span.finish()
+            self._record(span)
+
+    def _record(self, span):
+        with self._lock:
+            self.spans.append(span)
+            if self.path:
+                try:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+                except OSError as e:
+                    print(f"   ⚠️ トレース書き込み失敗: {e}")
+
+    def select(self, trace_id=None):
+        with self._lock:
+            return [s for s in self.spans if trace_id is None or s.trace_id == trace_id]
+
+    def summary(self, trace_id=None):
+        """ 段階 (スパン名) ごとの 回数・合計・p50/p95・トークン数 """
+        groups = {}
+        for span in self.select(trace_id):
+            groups.setdefault(span.name, []).append(span)
+
+        rows = []
+        for name, spans in groups.items():
+            ms = [s.duration * 1000 for s in spans]
+            total = lambda attr: sum(s.attributes.get(attr) or 0 for s in spans)
+            rows.append({
+                "name": name,
+                "count": len(spans),
+                "total_s": round(sum(ms) / 1000, 3),
+                "p50_ms": round(_percentile(ms, 50), 1),
+                "p95_ms": round(_percentile(ms, 95), 1),
+                "max_ms": round(max(ms), 1),
+                "errors": sum(1 for s in spans if s.status != "ok"),
+                "prompt_tokens": total("prompt_tokens"),
+                "completion_tokens": total("completion_tokens"),
+                "retries": total("retries"),
+                "throttle_s": round(total("throttle_s"), 3),
+            })
+        rows.sort(key=lambda r: r["total_s"], reverse=True)
+        return rows
+
+    def company_summary(self, trace_id=None):
+        """ 企業ごとの 検索時間・ページ数・LLM 呼び出し・トークン数・待ち時間
+            （スパンは入れ子なので、時間は company_search だけを足す） """
+        rows = {}
+        for span in self.select(trace_id):
+            company = span.attributes.get("company")
+            if company is None:
+                continue
+            row = rows.setdefault(company, {"company": company, "search_s": 0.0, "pages": 0, "llm_calls": 0,
+                                            "prompt_tokens": 0, "completion_tokens": 0, "throttle_s": 0.0})
+            attrs = span.attributes
+            if span.name == "company_search":
+                row["search_s"] += span.duration
+            elif span.name == "parse" and "mode" not in attrs:
+                row["pages"] += 1
+            elif span.name == "llm":
+                row["llm_calls"] += 1
+                row["prompt_tokens"] += attrs.get("prompt_tokens") or 0
+                row["completion_tokens"] += attrs.get("completion_tokens") or 0
+            if span.name in ("llm", "navigate"):
+                row["throttle_s"] += attrs.get("throttle_s") or 0
+        for row in rows.values():
+            row["search_s"] = round(row["search_s"], 3)
+            row["throttle_s"] = round(row["throttle_s"], 3)
+        return sorted(rows.values(), key=lambda r: r["search_s"], reverse=True)
+
+    def report(self, trace_id=None):
+        rows = self.summary(trace_id)
+        if not rows:
+            return "記録なし"
+        return " / ".join(f"{r['name']}: {r['count']}回 計{r['total_s']:.1f}秒 p95 {r['p95_ms']:.0f}ms"
+                          for r in rows)
+
+    def to_jsonl(self, trace_id=None):
+        return "".join(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n"
+                       for s in self.select(trace_id))
+
+    def to_otlp(self, trace_id=None, service_name="talentscope"):
+        """ OpenTelemetry の OTLP/JSON (ExportTraceServiceRequest) 形式 """
+        def value(v):
+            if isinstance(v, bool):
+                return {"boolValue": v}
+            if isinstance(v, int):
+                return {"intValue": str(v)}
+            if isinstance(v, float):
+                return {"doubleValue": v}
+            return {"stringValue": str(v)}
+
+        spans = []
+        for s in self.select(trace_id):
+            start_ns = int(s.start * 1e9)
+            spans.append({
+                "traceId": s.trace_id,
+                "spanId": s.span_id,
+                "parentSpanId": s.parent_id or "",
+                "name": s.name,
+                "kind": 1,
+                "startTimeUnixNano": str(start_ns),
+                "endTimeUnixNano": str(start_ns + int(s.duration * 1e9)),
+                "attributes": [{"key": k, "value": value(v)} for k, v in s.attributes.items() if v is not None],
+                "status": {"code": 2 if s.status == "error" else 1},
+            })
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "indeed_job_analyzer"}, "spans": spans}],
+        }]}
+
+    def export(self, path, trace_id=None, fmt="jsonl"):
+        """ ファイルへ書き出す（fmt: "jsonl" / "otlp"） """
+        with open(path, "w", encoding="utf-8") as f:
+            if fmt == "otlp":
+                json.dump(self.to_otlp(trace_id), f, ensure_ascii=False)
+            else:
+                f.write(self.to_jsonl(trace_id))
+
+
+# ==========================================
+# ▼ ページ準備完了の待機 (固定 sleep の代わり)
+# ==========================================
+class PageReadiness:
+    """ DOM 条件が満たされるまで待ち、かかった時間をラベルごとに記録する """
+
+    def __init__(self, poll_interval=0.2, max_records=STATS_MAX_RECORDS):
+        self.poll_interval = poll_interval
+        self.max_records = max_records
+        self._lock = threading.Lock()
+        self.timings = {}  # label -> deque[(秒, 一致した条件名 or None)]（直近 max_records 件）
+
+    def _check(self, page, condition):
+        try:
+            if callable(condition):
+                return bool(condition(page))
+            # timeout=0 で「今あるか」だけを見る（DrissionPage 既定の待機を避ける）
+            return bool(page.ele(condition, timeout=0))
+        except Exception:
+            return False
+
+    def wait_for(self, page, conditions, timeout, label):
+        """ いずれかの条件を満たしたらその名前を返す。時間切れなら None """
+        start = time.monotonic()
+        matched = None
+        while matched is None:
+            for name, condition in conditions:
+                if self._check(page, condition):
+                    matched = name
+                    break
+            if matched is None:
+                if time.monotonic() - start >= timeout:
+                    break
+                time.sleep(self.poll_interval)
+
+        elapsed = time.monotonic() - start
+        with self._lock:
+            records = self.timings.get(label)
+            if records is None:
+                records = self.timings[label] = deque(maxlen=self.max_records)
+            records.append((elapsed, matched))
+        return matched
+
+    def summary(self):
+        """ ラベルごとの 回数 / 平均 / 最大 / 時間切れ回数 """
+        result = {}
+        with self._lock:
+            for label, records in self.timings.items():
+                secs = [r[0] for r in records]
+                result[label] = {
+                    "count": len(secs),
+                    "avg": sum(secs) / len(secs),
+                    "max": max(secs),
+                    "timeouts": sum(1 for r in records if r[1] is None),
+                }
+        return result
+
+    def report(self):
+        lines = []
+        for label, st in self.summary().items():
+            lines.append(f"{label}: {st['count']}回 平均{st['avg']:.2f}秒 最大{st['max']:.2f}秒 "
+                         f"時間切れ{st['timeouts']}回")
+        return " / ".join(lines) if lines else "記録なし"
+
+
+# ==========================================
+# ▼ アクセス間隔の制御 (ホストごと)
+# ==========================================
+class HostRateLimiter:
+    """ ホストごとに「1秒あたり rps 回」までにリクエストを間引く（スレッド共有） """
+
+    def __init__(self, rps=INDEED_MAX_RPS):
+        self.interval = 1.0 / rps if rps and rps > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = {}  # host -> 次に送ってよい時刻
+        self.total_wait = 0.0
+
+    def wait(self, url):
+        """ 自分の順番が来るまで待つ。待った秒数を返す """
+        if self.interval <= 0:
+            return 0.0
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+            with self._lock:
+                self.total_wait += delay
+        return max(delay, 0.0)
+
+
+# ==========================================
+# ▼ ブラウザプール (Chromium の使い回し)
+# ==========================================
+class BrowserPool:
+    """ 長寿命の ChromiumPage セッションを貸し出し・返却するプール """
+
+    def __init__(self, factory, size=BROWSER_POOL_SIZE):
+        # factory(slot) -> ChromiumPage 。slot ごとに別プロファイルを使う
+        self._factory = factory
+        self._size = max(1, size)
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._sessions = {}  # id(page) -> slot
+        self._free_slots = list(range(self._size))
+        self._closed = False
+        self.stats = {
+            "launches": 0,
+            "checkouts": 0,
+            "launches_avoided": 0,
+            "health_failures": 0,
+            "replaced": 0,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _is_alive(self, page):
+        """ セッションが応答するか確認（クラッシュ検知） """
+        try:
+            return page.run_js("return 1;") == 1
+        except Exception:
+            return False
+
+    def _launch(self, slot):
+        page = self._factory(slot)
+        with self._lock:
+            self._sessions[id(page)] = slot
+            self.stats["launches"] += 1
+        return page
+
+    def _discard(self, page):
+        with self._lock:
+            slot = self._sessions.pop(id(page), None)
+            if slot is not None:
+                self._free_slots.append(slot)
+        try:
+            page.quit()
+        except Exception:
+            pass
+
+    def acquire(self, timeout=None):
+        """ 空いているセッションを借りる。無ければ起動し、上限なら返却を待つ """
+        if self._closed:
+            raise RuntimeError("BrowserPool は既に閉じられています")
+
+        while True:
+            try:
+                page = self._idle.get_nowait()
+            except queue.Empty:
+                page = None
+
+            if page is None:
+                slot = None
+                with self._lock:
+                    if self._free_slots:
+                        slot = self._free_slots.pop(0)
+                if slot is not None:
+                    try:
+                        page = self._launch(slot)
+                    except Exception:
+                        with self._lock:
+                            self._free_slots.append(slot)
+                        raise
+                    with self._lock:
+                        self.stats["checkouts"] += 1
+                    return page
+                # 上限まで起動済み → 誰かが返すのを待つ
+                try:
+                    page = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError("ブラウザの空きがありません")
+
+            if self._is_alive(page):
+                with self._lock:
+                    self.stats["checkouts"] += 1
+                    self.stats["launches_avoided"] += 1
+                return page
+
+            # 死んでいるセッションは捨てて作り直す
+            log("   ♻️ ブラウザ応答なし。セッションを再起動します...")
+            with self._lock:
+                self.stats["health_failures"] += 1
+                self.stats["replaced"] += 1
+            self._discard(page)
+
+    def release(self, page, broken=False):
+        """ 借りたセッションを返す。broken=True なら破棄する """
+        if page is None:
+            return
+        if broken or self._closed or not self._is_alive(page):
+            if not self._closed and not broken:
+                with self._lock:
+                    self.stats["health_failures"] += 1
+            self._discard(page)
+            return
+        self._idle.put(page)
+
+    @contextmanager
+    def session(self):
+        """ with pool.session() as page: の形で借りて自動返却する """
+        page = self.acquire()
+        try:
+            yield page
+        except Exception:
+            self.release(page)
+            raise
+        else:
+            self.release(page)
+
+    def close(self):
+        """ 全セッションを終了する """
+        self._closed = True
+        while True:
+            try:
+                page = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(page)
+
+    def report(self):
+        """ 統計を1行の文字列で返す """
+        s = self.stats
+        return (f"起動 {s['launches']}回 / 貸出 {s['checkouts']}回 / "
+                f"起動回避 {s['launches_avoided']}回 / 再起動 {s['replaced']}回")
+
+
+# ==========================================
+# ▼ 求人カード抽出エンジン
+# ==========================================
+# 全文モードで取り除くタグ
+FULLTEXT_DROP_TAGS = ["script", "style", "svg", "path", "footer", "nav", "noscript", "header"]
+
+# 全文を行に分けるときの区切りになるタグ（これ以外のタグの中身は前後の文字列とつなげる）
+FULLTEXT_BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "body", "br", "dd", "div", "dl", "dt", "fieldset",
+    "figcaption", "figure", "form", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "li", "main", "ol", "option",
+    "p", "pre", "section", "select", "table", "tbody", "td", "tfoot", "th", "thead", "tr", "ul",
+}
+
+_JK_PATTERN = re.compile(r'jk=([a-zA-Z0-9]+)')
+
+
+def _job_block(title, href, card_text):
+    """ 1件分の求人カード情報を dict にまとめる """
+    jk_id = ""
+    if "jk=" in href:
+        match = _JK_PATTERN.search(href)
+        if match: jk_id = match.group(1)
+    stable_url = f"https://jp.indeed.com/viewjob?jk={jk_id}" if jk_id else "URL_NOT_FOUND"
+    return {"title": title, "url": stable_url, "jk": jk_id, "card_text": card_text}
+
+
+def format_job_block(no, block, missing=None, max_content=None):
+    """ 求人カード1件を [JOB_BLOCK_n] 形式のテキストにする。
+        missing を渡すと Missing 行を付ける（空なら "none" = 対象かどうかの判定だけ） """
+    missing_line = f"\n            Missing: {', '.join(missing) or 'none'}" if missing is not None else ""
+    content = block['card_text'][:max_content] if max_content else block['card_text']
+    return f"""
+            [JOB_BLOCK_{no}]{missing_line}
+            Title: {block['title']}
+            URL: {block['url']}
+            RawContent: {content}
+            --------------------------------
+            """
+
+
+def format_job_blocks(blocks):
+    """ 抽出した求人カードを LLM に渡す [JOB_BLOCK_n] 形式のテキストにする """
+    return "".join(format_job_block(i + 1, block) for i, block in enumerate(blocks))
+
+
+def estimate_tokens(text):
+    """ トークン数の概算（英数字は約4文字で1トークン、日本語は1文字1トークン） """
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def extraction_batch_budget():
+    """ 1バッチに載せる求人テキストのトークン数。
+        指示文と応答の分を足しても軽量モデルの1分あたりの上限に収まるようにする
+        （収まらないとルーターが重いモデルへ回すか、Groq に断られる） """
+    light_tpm = MODEL_RATE_LIMITS.get(MODEL_LIGHT, DEFAULT_RATE_LIMIT)["tpm"]
+    return max(1000, min(EXTRACTION_BATCH_TOKENS,
+                         light_tpm - EXTRACTION_PROMPT_TOKENS - EXPECTED_COMPLETION_TOKENS))
+
+
+def pack_by_tokens(texts, budget=None):
+    """ テキストを順番どおり、合計が budget 以下になるようにまとめる（1件は分割しない）
+        戻り値: [[index, ...], ...] """
+    budget = budget or extraction_batch_budget()
+    batches = []
+    current, used = [], 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and used + tokens > budget:
+            batches.append(current)
+            current, used = [], 0
+        current.append(i)
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def split_text_by_tokens(text, budget=None, max_chunks=None):
+    """ 全文テキストを空白の位置で budget ごとのチャンクに切る """
+    budget = budget or extraction_batch_budget()
+    max_chunks = max_chunks or FULLTEXT_MAX_BATCHES
+    chunks = []
+    current, used = [], 0
+    for word in text.split(" "):
+        tokens = estimate_tokens(word) + 1
+        if current and used + tokens > budget:
+            chunks.append(" ".join(current))
+            if len(chunks) >= max_chunks:
+                return chunks
+            current, used = [], 0
+        current.append(word)
+        used += tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks[:max_chunks]
+
+
+# 全文の圧縮: 求人らしさの手がかり (パターン, 重み)。重み2以上は「強い」手がかり
+_JOB_SIGNALS = [
+    (re.compile(r'(?:月給|月収|年収|年俸|時給|日給|週給)\s*[0-9０-９]|[0-9０-９][0-9０-９,，.]*\s*万?\s*円'), 3),
+    (re.compile(r'北海道|東京都|大阪府|京都府|[^\s|]{2,3}県|リモート|在宅|テレワーク'), 2),
+    (re.compile(r'正社員|契約社員|派遣社員|アルバイト|パート|業務委託|新卒|中途|インターン'), 2),
+    (re.compile(r'エンジニア|ディレクター|デザイナー|プランナー|プロデューサー|マネージャー|アシスタント'
+                r'|スタッフ|リーダー|責任者|営業|事務|編集|制作|開発|企画|講師|オペレーター'), 1),
+    (re.compile(r'募集|求人|職種|仕事内容|応募資格|経験|歓迎|未経験|勤務|休日|賞与|福利厚生|資格'), 1),
+]
+# 求人とは関係のない定型文。手がかりの無い行と、手がかりの弱い短い行を落とす
+_BOILERPLATE_LINE = re.compile(
+    r'©|copyright|all rights reserved|利用規約|プライバシー|個人情報|cookie|クッキー|ログイン|ログアウト'
+    r'|会員登録|サイトマップ|ヘルプ|お問い合わせ|求人広告掲載|求人を掲載|企業の方|採用担当者|企業クチコミ'
+    r'|求人検索|仕事検索|給与検索|検索条件|絞り込み|並べ替え|新着順|関連度順|履歴書|マイページ|トップへ'
+    r'|ページの先頭|^次へ|^前へ|^[0-9]+$', re.IGNORECASE)
+# 絞り込みメニューの項目（"正社員 (123)" のように件数が付く）
+_FACET_LINE = re.compile(r'[（(]\s*[0-9０-９,，]+\s*件?\s*[)）]$')
+BOILERPLATE_MAX_CHARS = 40
+# 手がかりのある行の前後この行数までを、同じ求人の文脈として残す
+FULLTEXT_CONTEXT_LINES = 2
+
+
+def score_job_line(line, boost_terms=()):
+    """ 1行の求人らしさ（手がかりの重みの合計。業界キーワードを含めば +1） """
+    score = sum(weight for pattern, weight in _JOB_SIGNALS if pattern.search(line))
+    if score and any(term in line for term in boost_terms):
+        score += 1
+    return score
+
+
+def compact_page_lines(lines, budget=None, boost_terms=()):
+    """ 全文モード用に、ページのテキスト行から求人の載っている部分だけを残す
+        1. 空白をまとめ、定型文・絞り込みメニューの行と、手がかりの無い重複行を落とす
+        2. 手がかりのある行とその前後 FULLTEXT_CONTEXT_LINES 行を「領域」としてまとめる
+        3. 領域を求人らしさの密度（点数/トークン）の高い順に budget まで採り、元の順に並べる
+        戻り値: (残した行のリスト, 統計 dict) """
+    budget = budget or extraction_batch_budget() * FULLTEXT_MAX_BATCHES
+    stats = {"lines_in": 0, "boilerplate": 0, "duplicates": 0, "regions": 0, "regions_kept": 0,
+             "tokens_in": 0, "tokens_out": 0}
+
+    candidates = []   # (行, 点数)
+    seen = set()
+    for raw in lines:
+        line = " ".join(raw.split())
+        if not line:
+            continue
+        stats["lines_in"] += 1
+        stats["tokens_in"] += estimate_tokens(line)
+        score = score_job_line(line, boost_terms)
+        boilerplate_limit = None if score == 0 else BOILERPLATE_MAX_CHARS if score < 2 else 0
+        if _FACET_LINE.search(line) or (
+                (boilerplate_limit is None or len(line) <= boilerplate_limit) and _BOILERPLATE_LINE.search(line)):
+            stats["boilerplate"] += 1
+            continue
+        # 勤務地・給与など求人ごとに同じになりうる行は重複でも残す
+        if line in seen and score < 2:
+            stats["duplicates"] += 1
+            continue
+        seen.add(line)
+        candidates.append((line, score))
+
+    # 手がかりのある行の周辺を残す印を付け、連続した範囲を領域にする
+    keep = [False] * len(candidates)
+    for i, (_, score) in enumerate(candidates):
+        if score:
+            for j in range(max(0, i - FULLTEXT_CONTEXT_LINES), min(len(candidates), i + FULLTEXT_CONTEXT_LINES + 1)):
+                keep[j] = True
+    regions = []      # [(開始, 終了), ...]
+    start = None
+    for i, flag in enumerate(keep + [False]):
+        if flag and start is None:
+            start = i
+        elif not flag and start is not None:
+            regions.append((start, i))
+            start = None
+    stats["regions"] = len(regions)
+
+    def density(region):
+        rows = candidates[region[0]:region[1]]
+        tokens = sum(estimate_tokens(line) for line, _ in rows) or 1
+        return sum(score for _, score in rows) / tokens
+
+    selected = []     # 残す行の位置
+    used = 0
+    for region in sorted(regions, key=density, reverse=True):
+        taken = 0
+        for i in range(*region):
+            tokens = estimate_tokens(candidates[i][0]) + 1
+            if used + tokens > budget:
+                break
+            selected.append(i)
+            used += tokens
+            taken += 1
+        if taken:
+            stats["regions_kept"] += 1
+        if used >= budget:
+            break
+
+    kept = [candidates[i][0] for i in sorted(selected)]
+    stats["tokens_out"] = sum(estimate_tokens(line) for line in kept)
+    stats["ratio"] = round(stats["tokens_out"] / stats["tokens_in"], 3) if stats["tokens_in"] else 1.0
+    return kept, stats
+
+
+def _dedupe_jobs(jobs):
+    """ バッチをまたいだ重複を URL で除く（URL が無いものは 職種+給与+勤務地 で判定） """
+    seen = set()
+    unique = []
+    for job in jobs:
+        if not isinstance(job, dict):
+            continue
+        url = job.get("url")
+        if url and url != "URL_NOT_FOUND":
+            key = url
+        else:
+            key = (job.get("title"), job.get("salary"), job.get("location"))
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(job)
+    return unique
+
+
+class Bs4JobExtractor:
+    """ BeautifulSoup(html.parser) による抽出（従来の実装） """
+    name = "bs4"
+
+    def extract_blocks(self, raw_html):
+        soup = bs4.BeautifulSoup(raw_html, "html.parser")
+
+        job_titles = soup.find_all("h2", class_=lambda x: x and "jobTitle" in x)
+        if not job_titles:
+            job_links = soup.find_all("a", href=True)
+            candidates = [a for a in job_links if "jk=" in a['href'] or "/rc/clk" in a['href']]
+        else:
+            candidates = [h2.find("a") for h2 in job_titles if h2.find("a")]
+
+        blocks = []
+        for a_tag in candidates:
+            if not a_tag: continue
+            title = a_tag.get_text(strip=True)
+
+            card = a_tag.find_parent("div", class_=lambda x: x and "card" in x.lower())
+            if not card: card = a_tag.find_parent("td")
+            if not card: card = a_tag.find_parent("div")
+
+            card_text = card.get_text(separator=" | ", strip=True) if card else ""
+            blocks.append(_job_block(title, a_tag.get('href', ''), card_text))
+        return blocks
+
+    def full_text(self, raw_html):
+        soup = bs4.BeautifulSoup(raw_html, "html.parser")
+        for tag in soup(FULLTEXT_DROP_TAGS):
+            tag.decompose()
+        return soup.get_text(separator=" ", strip=True)
+
+    def text_lines(self, raw_html):
+        """ full_text と同じ範囲のテキストを、ブロック要素 (FULLTEXT_BLOCK_TAGS) ごとの行で返す """
+        soup = bs4.BeautifulSoup(raw_html, "html.parser")
+        for tag in soup(FULLTEXT_DROP_TAGS):
+            tag.decompose()
+        lines, buffer = [], []
+
+        def flush():
+            line = " ".join(" ".join(buffer).split())
+            if line: lines.append(line)
+            buffer.clear()
+
+        def walk(node):
+            for child in node.children:
+                if isinstance(child, bs4.element.PreformattedString):
+                    continue  # コメント・DOCTYPE など
+                if isinstance(child, bs4.element.NavigableString):
+                    buffer.append(str(child))
+                elif child.name in FULLTEXT_BLOCK_TAGS:
+                    flush()
+                    walk(child)
+                    flush()
+                else:
+                    walk(child)
+
+        walk(soup)
+        flush()
+        return lines
+
+
+class LxmlJobExtractor:
+    """ lxml + コンパイル済み XPath による高速抽出（出力は Bs4JobExtractor と同じ） """
+    name = "lxml"
+
+    # get_text と同じく、これらの中身はテキストに含めない
+    _SKIP_TEXT_TAGS = {"script", "style", "template"}
+
+    def __init__(self):
+        if lxml_etree is None:
+            raise ImportError("lxml がインストールされていません")
+        lower = "translate(@class, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')"
+        self._x_titles = lxml_etree.XPath("//h2[contains(@class, 'jobTitle')]")
+        self._x_first_link = lxml_etree.XPath("(.//a)[1]")
+        self._x_job_links = lxml_etree.XPath(
+            "//a[@href][contains(@href, 'jk=') or contains(@href, '/rc/clk')]")
+        self._x_card = lxml_etree.XPath(f"ancestor::div[contains({lower}, 'card')][1]")
+        self._x_td = lxml_etree.XPath("ancestor::td[1]")
+        self._x_div = lxml_etree.XPath("ancestor::div[1]")
+        self._x_drop = lxml_etree.XPath(" | ".join(f"//{t}" for t in FULLTEXT_DROP_TAGS))
+
+    def _parse(self, raw_html):
+        if not raw_html or not raw_html.strip():
+            return None
+        try:
+            return lxml_html.document_fromstring(raw_html)
+        except ValueError:
+            # encoding 宣言付きの文字列は bytes で渡す必要がある
+            return lxml_html.document_fromstring(raw_html.encode("utf-8"))
+
+    def _strings(self, node):
+        """ BeautifulSoup の get_text(strip=True) と同じ順序で文字列を返す """
+        if not isinstance(node.tag, str) or node.tag in self._SKIP_TEXT_TAGS:
+            return
+        if node.text:
+            text = node.text.strip()
+            if text: yield text
+        for child in node:
+            yield from self._strings(child)
+            if child.tail:
+                tail = child.tail.strip()
+                if tail: yield tail
+
+    def _get_text(self, node, separator=""):
+        return separator.join(self._strings(node))
+
+    def extract_blocks(self, raw_html):
+        root = self._parse(raw_html)
+        if root is None:
+            return []
+
+        job_titles = self._x_titles(root)
+        if not job_titles:
+            candidates = self._x_job_links(root)
+        else:
+            candidates = []
+            for h2 in job_titles:
+                links = self._x_first_link(h2)
+                if links: candidates.append(links[0])
+
+        blocks = []
+        for a_tag in candidates:
+            title = self._get_text(a_tag)
+            card = self._x_card(a_tag) or self._x_td(a_tag) or self._x_div(a_tag)
+            card_text = self._get_text(card[0], " | ") if card else ""
+            blocks.append(_job_block(title, a_tag.get('href', ''), card_text))
+        return blocks
+
+    def full_text(self, raw_html):
+        root = self._parse(raw_html)
+        if root is None:
+            return ""
+        for el in self._x_drop(root):
+            el.drop_tree()
+        return self._get_text(root, " ")
+
+    def _block_lines(self, node, lines, buffer):
+        if not isinstance(node.tag, str) or node.tag in self._SKIP_TEXT_TAGS:
+            return
+        block = node.tag in FULLTEXT_BLOCK_TAGS
+        if block: self._flush_line(lines, buffer)
+        if node.text: buffer.append(node.text)
+        for child in node:
+            self._block_lines(child, lines, buffer)
+            if child.tail: buffer.append(child.tail)
+        if block: self._flush_line(lines, buffer)
+
+    @staticmethod
+    def _flush_line(lines, buffer):
+        line = " ".join(" ".join(buffer).split())
+        if line: lines.append(line)
+        buffer.clear()
+
+    def text_lines(self, raw_html):
+        """ full_text と同じ範囲のテキストを、ブロック要素 (FULLTEXT_BLOCK_TAGS) ごとの行で返す """
+        root = self._parse(raw_html)
+        if root is None:
+            return []
+        for el in self._x_drop(root):
+            el.drop_tree()
+        lines, buffer = [], []
+        self._block_lines(root, lines, buffer)
+        self._flush_line(lines, buffer)
+        return lines
+
+
+JOB_EXTRACTORS = {"bs4": Bs4JobExtractor, "lxml": LxmlJobExtractor}
+
+
+def get_job_extractor(engine=JOB_EXTRACTOR_ENGINE):
+    """ 抽出エンジンを作る。"auto" は lxml があれば lxml、無ければ bs4 """
+    if engine == "auto":
+        engine = "lxml" if lxml_etree is not None else "bs4"
+    if engine not in JOB_EXTRACTORS:
+        raise ValueError(f"未知の抽出エンジン: {engine}")
+    return JOB_EXTRACTORS[engine]()
+
+
+# ==========================================
+# ▼ ルールベースの項目抽出 (LLM に聞く前に自前で埋める)
+# ==========================================
+JOB_FIELDS = ["title", "url", "salary", "location", "remote", "details"]
+
+_SALARY_SEGMENT = re.compile(
+    r'^(?:月給|月収|年収|年俸|時給|日給|週給)\s*[0-9０-９]'
+    r'|^[0-9０-９][0-9０-９,，.]*\s*万?\s*円')
+_LOCATION_SEGMENT = re.compile(r'^(?:北海道|東京都|大阪府|京都府|[^\s|]{2,3}県)')
+_REMOTE_PHRASE = re.compile(r'[^\s|/・、]*(?:リモート|在宅|テレワーク)[^\s|/・、]*')
+DETAILS_MAX_CHARS = 200
+# 項目がすべて埋まったカードも対象かどうか（業種・除外条件・他社の求人）は LLM に判定させる。
+# そのとき送るカード本文の文字数
+RELEVANCE_CONTENT_CHARS = 120
+
+
+def _card_segments(block):
+    return [seg.strip() for seg in block.get("card_text", "").split(" | ") if seg.strip()]
+
+
+def rule_extract_fields(block):
+    """ カードのテキストから決まった形の項目を取り出す。取れない項目は None """
+    segments = _card_segments(block)
+    title = block.get("title") or None
+    url = block.get("url") if block.get("jk") else None
+
+    salary = next((seg for seg in segments if _SALARY_SEGMENT.search(seg)), None)
+    location = next((seg for seg in segments
+                     if len(seg) <= 40 and _LOCATION_SEGMENT.search(seg)), None)
+
+    remote = None
+    if segments:
+        match = _REMOTE_PHRASE.search(block["card_text"])
+        remote = match.group(0) if match else "記載なし"
+
+    # 概要: タイトル・給与・勤務地以外の断片をつなげたもの
+    used = {title, salary, location}
+    rest = [seg for seg in segments if seg not in used]
+    details = " / ".join(rest)[:DETAILS_MAX_CHARS] if rest else None
+
+    return {"title": title, "url": url, "salary": salary,
+            "location": location, "remote": remote, "details": details}
+
+
+def _split_keywords(keywords):
+    """ "A, B、C" のような除外キーワード文字列をリストにする """
+    if isinstance(keywords, list):
+        keywords = ",".join(str(k) for k in keywords)
+    return [k.strip() for k in re.split(r'[,、，\n/]', keywords or "") if k.strip()]
+
+
+def normalize_match_text(text):
+    """ 全角/半角・大文字/小文字の違いをならした照合用テキスト """
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def _ascii_alnum(ch):
+    return ch.isascii() and ch.isalnum()
+
+
+def _keyword_pattern(keyword):
+    """ 英数字で始まる・終わるキーワードは単語の途中に当たらないようにする（"it" が "digital" に当たらない）。
+        日本語は単語の区切りが無いので部分一致のまま """
+    pattern = re.escape(keyword)
+    if _ascii_alnum(keyword[0]):
+        pattern = r"(?<![a-z0-9])" + pattern
+    if _ascii_alnum(keyword[-1]):
+        pattern += r"(?![a-z0-9])"
+    return pattern
+
+
+class KeywordMatcher:
+    """ 除外キーワードを1本の正規表現にまとめた照合器（同じ位置なら長いキーワードを優先） """
+
+    def __init__(self, keywords):
+        self.keywords = {}  # 正規化後 -> 元の表記
+        for keyword in keywords:
+            normalized = normalize_match_text(keyword).strip()
+            if normalized:
+                self.keywords.setdefault(normalized, keyword)
+        ordered = sorted(self.keywords, key=len, reverse=True)
+        self._pattern = re.compile("|".join(map(_keyword_pattern, ordered))) if ordered else None
+
+    def search(self, text):
+        """ 最初に当たったキーワード（元の表記）。当たらなければ None """
+        if self._pattern is None or not text:
+            return None
+        match = self._pattern.search(normalize_match_text(text))
+        return self.keywords[match.group(0)] if match else None
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_keywords(keywords):
+    return KeywordMatcher(keywords)
+
+
+def keyword_matcher(filter_data):
+    """ 業界フィルターの除外キーワードから照合器を作る（同じキーワードなら作り直さない） """
+    return _compile_keywords(tuple(_split_keywords((filter_data or {}).get('negative_keywords'))))
+
+
+def _raise_if_all_failed(responses, company):
+    """ 抽出の LLM 呼び出しがすべて失敗したら例外にする（「求人ゼロ」と区別するため） """
+    if responses and all(response is None for response in responses):
+        raise RuntimeError(f"{company} の抽出で LLM 呼び出しがすべて失敗しました（{len(responses)}回）")
+
+
+def _parse_json_list(response):
+    """ LLM の JSON 応答から求人リストを取り出す """
+    if not response: return []
+    try:
+        data = json.loads(response.choices[0].message.content)
+        if isinstance(data, dict):
+            for key in data:
+                if isinstance(data[key], list): return data[key]
+            return []
+        return data
+    except:
+        return []
+
+
+# ==========================================
+# ▼ ローカルキャッシュ (SQLite, TTL + LRU)
+# ==========================================
+class SQLiteCache:
+    """ 期限(TTL)と容量上限つきの key-value キャッシュ。上限を超えたら最終利用が古い順に消す """
+
+    def __init__(self, path, table="cache", ttl=GROQ_CACHE_TTL, max_bytes=GROQ_CACHE_MAX_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 複数スレッド・複数プロセスから使うので WAL + ロック待ちを長めに
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, expires REAL, accessed REAL NOT NULL)")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table}(accessed)")
+        self._conn.commit()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "writes": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(*parts):
+        """ 任意の JSON 化できる値からハッシュキーを作る """
+        raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            value, expires = row
+            if expires is not None and expires < now:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._conn.commit()
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._conn.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.stats["hits"] += 1
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        raw = json.dumps(value, ensure_ascii=False)
+        size = len(raw.encode("utf-8"))
+        expires = now + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, size, created, expires, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)", (key, raw, size, now, expires, now))
+            self.stats["writes"] += 1
+            self._evict_locked(now)
+            self._conn.commit()
+
+    def _evict_locked(self, now):
+        # 期限切れを先に消し、それでも容量を超えていれば LRU で消す
+        self._conn.execute(f"DELETE FROM {self.table} WHERE expires IS NOT NULL AND expires < ?", (now,))
+        if not self.max_bytes:
+            return
+        total = self._conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(f"SELECT key, size FROM {self.table} ORDER BY accessed ASC").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            total -= size
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def report(self):
+        s = self.stats
+        lookups = s["hits"] + s["misses"]
+        rate = (s["hits"] / lookups * 100) if lookups else 0.0
+        return (f"ヒット {s['hits']} / ミス {s['misses']} ({rate:.0f}%) / "
+                f"期限切れ {s['expired']} / 追い出し {s['evictions']}")
+
+
+class GroqResponseCache(SQLiteCache):
+    """ Groq の chat.completions 応答を (model, messages, temperature, response_format) で保存 """
+
+    def __init__(self, path=None, ttl=GROQ_CACHE_TTL, max_bytes=GROQ_CACHE_MAX_BYTES):
+        super().__init__(path or os.path.join(CACHE_DIR, "groq_cache.sqlite3"),
+                         table="completions", ttl=ttl, max_bytes=max_bytes)
+
+    def completion_key(self, model, messages, temperature, response_format):
+        return self.make_key(model, messages, temperature, response_format)
+
+    def get_completion(self, key):
+        """ 保存済みなら、本物の応答と同じく .choices[0].message.content で読める形で返す """
+        data = self.get(key)
+        if data is None:
+            return None
+        return SimpleNamespace(
+            id=data.get("id"),
+            model=data.get("model"),
+            choices=[SimpleNamespace(
+                index=0,
+                finish_reason=data.get("finish_reason"),
+                message=SimpleNamespace(role="assistant", content=data["content"]),
+            )],
+            usage=SimpleNamespace(**data["usage"]) if data.get("usage") else None,
+            cached=True,
+        )
+
+    def put_completion(self, key, response):
+        try:
+            choice = response.choices[0]
+            usage = getattr(response, "usage", None)
+            self.set(key, {
+                "id": getattr(response, "id", None),
+                "model": getattr(response, "model", None),
+                "content": choice.message.content,
+                "finish_reason": getattr(choice, "finish_reason", None),
+                "usage": {
+                    "prompt_tokens": getattr(usage, "prompt_tokens", 0),
+                    "completion_tokens": getattr(usage, "completion_tokens", 0),
+                    "total_tokens": getattr(usage, "total_tokens", 0),
+                } if usage else None,
+            })
+        except Exception as e:
+            log(f"   ⚠️ キャッシュ保存失敗: {e}")
+
+
+# ==========================================
+# ▼ Groq レート制御 (プロセス共通のスケジューラ)
+# ==========================================
+def _parse_reset_seconds(value):
+    """ Groq のヘッダー値 "2m59.56s" / "7.66s" / "120ms" / "3" を秒にする """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    found = False
+    for number, unit in re.findall(r'([\d.]+)(ms|h|m|s)', value):
+        found = True
+        number = float(number)
+        total += {"h": 3600, "m": 60, "s": 1, "ms": 0.001}[unit] * number
+    return total if found else None
+
+
+class _TokenBucket:
+    """ 1分あたり capacity 個まで補充されるバケツ """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.reset_at = None  # サーバーが教えてくれた、満タンに戻る時刻
+
+    def refill(self, now):
+        if self.reset_at is not None and now >= self.reset_at:
+            self.level = self.capacity
+            self.reset_at = None
+        else:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self.refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        wait = (amount - self.level) / self.rate
+        if self.reset_at is not None:
+            wait = min(wait, self.reset_at - now)
+        return wait
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def sync(self, remaining, reset_seconds, now):
+        """ サーバーが教えてくれた残量に合わせ、reset の時刻に満タンへ戻す（補充の速さは変えない） """
+        self.refill(now)
+        self.level = min(self.capacity, float(remaining))
+        self.reset_at = now + reset_seconds if reset_seconds and remaining < self.capacity else None
+
+
+class GroqRateScheduler:
+    """ モデルごとに リクエスト数/トークン数 のバケツを持ち、優先度順に通すスケジューラ。
+        スレッドからは acquire()、asyncio からは await acquire_async() を使う """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """ プロセスで1つのインスタンスを返す """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def __init__(self, limits=None):
+        self.limits = dict(MODEL_RATE_LIMITS if limits is None else limits)
+        self._cond = threading.Condition()
+        self._buckets = {}       # model -> (requests, tokens)
+        self._waiters = {}       # model -> heap[(priority, seq)]
+        self._blocked_until = {} # model -> 429 明けの時刻
+        self._seq = itertools.count()
+        self.metrics = {
+            "requests": 0,
+            "rate_limited": 0,
+            "throttled_seconds": {},             # model -> 秒
+            "throttled_seconds_by_priority": {}, # priority -> 秒
+            "daily_remaining": {},               # model -> 今日あと何回送れるか (RPD)
+        }
+
+    def _buckets_for(self, model):
+        if model not in self._buckets:
+            limit = self.limits.get(model, DEFAULT_RATE_LIMIT)
+            self._buckets[model] = (_TokenBucket(limit["rpm"]), _TokenBucket(limit["tpm"]))
+        return self._buckets[model]
+
+    def _enqueue(self, model, priority):
+        ticket = (priority, next(self._seq))
+        heapq.heappush(self._waiters.setdefault(model, []), ticket)
+        return ticket
+
+    def _dequeue(self, model, ticket):
+        waiters = self._waiters.get(model, [])
+        if ticket in waiters:
+            waiters.remove(ticket)
+            heapq.heapify(waiters)
+
+    def _try_acquire(self, model, ticket, tokens):
+        """ ロック保持中に呼ぶ。通れたら 0、待つなら待ち秒数を返す """
+        if self._waiters[model][0] != ticket:
+            # 優先度の高い（または先に並んだ）リクエストが先
+            return 0.05
+        now = time.monotonic()
+        blocked = self._blocked_until.get(model, 0) - now
+        if blocked > 0:
+            return blocked
+        requests, token_bucket = self._buckets_for(model)
+        wait = max(requests.wait_time(1, now), token_bucket.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        requests.take(1)
+        token_bucket.take(tokens)
+        heapq.heappop(self._waiters[model])
+        self.metrics["requests"] += 1
+        return 0.0
+
+    def _record_wait(self, model, priority, seconds):
+        if seconds <= 0:
+            return
+        by_model = self.metrics["throttled_seconds"]
+        by_model[model] = by_model.get(model, 0.0) + seconds
+        by_priority = self.metrics["throttled_seconds_by_priority"]
+        by_priority[priority] = by_priority.get(priority, 0.0) + seconds
+
+    def acquire(self, model, tokens, priority=PRIORITY_NORMAL):
+        """ 送ってよくなるまでブロックする。待った秒数を返す """
+        start = time.monotonic()
+        with self._cond:
+            ticket = self._enqueue(model, priority)
+            try:
+                while True:
+                    wait = self._try_acquire(model, ticket, tokens)
+                    if wait <= 0:
+                        break
+                    self._cond.wait(min(wait, 0.5))
+            except BaseException:
+                self._dequeue(model, ticket)
+                raise
+            finally:
+                self._cond.notify_all()
+            waited = time.monotonic() - start
+            self._record_wait(model, priority, waited)
+        return waited
+
+    async def acquire_async(self, model, tokens, priority=PRIORITY_NORMAL):
+        """ acquire の asyncio 版（キャンセルされたら列から外れる） """
+        start = time.monotonic()
+        with self._cond:
+            ticket = self._enqueue(model, priority)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_acquire(model, ticket, tokens)
+                    if wait <= 0:
+                        self._cond.notify_all()
+                        break
+                await asyncio.sleep(min(wait, 0.5))
+        except BaseException:
+            with self._cond:
+                self._dequeue(model, ticket)
+                self._cond.notify_all()
+            raise
+        waited = time.monotonic() - start
+        with self._cond:
+            self._record_wait(model, priority, waited)
+        return waited
+
+    def update_from_headers(self, model, headers):
+        """ x-ratelimit-* / retry-after ヘッダーでバケツの残量を合わせる。
+            トークンのバケツをサーバーの残量に合わせたら True を返す """
+        if not headers:
+            return False
+        synced = False
+        now = time.monotonic()
+        with self._cond:
+            _, token_bucket = self._buckets_for(model)
+            # Groq の requests 系ヘッダーは1日あたり (RPD) なので RPM のバケツには使わない。
+            # 残りを覚えておき、使い切ったら reset まで送らない
+            remaining = headers.get("x-ratelimit-remaining-requests")
+            if remaining is not None:
+                try:
+                    remaining = float(remaining)
+                    self.metrics["daily_remaining"][model] = remaining
+                    reset = _parse_reset_seconds(headers.get("x-ratelimit-reset-requests"))
+                    if remaining < 1 and reset:
+                        self._blocked_until[model] = max(self._blocked_until.get(model, 0), now + reset)
+                except ValueError:
+                    pass
+            remaining = headers.get("x-ratelimit-remaining-tokens")
+            if remaining is not None:
+                try:
+                    token_bucket.sync(float(remaining), _parse_reset_seconds(
+                        headers.get("x-ratelimit-reset-tokens")), now)
+                    synced = True
+                except ValueError:
+                    pass
+            retry_after = _parse_reset_seconds(headers.get("retry-after"))
+            if retry_after:
+                self._blocked_until[model] = max(self._blocked_until.get(model, 0), now + retry_after)
+            self._cond.notify_all()
+        return synced
+
+    def penalize(self, model, headers=None, attempt=0):
+        """ 429 を受けたとき。retry-after があればそれ、無ければ揺らぎ付き指数バックオフ。
+            全スレッドの同じモデルへの送信を止め、待つ秒数を返す """
+        retry_after = _parse_reset_seconds(headers.get("retry-after")) if headers else None
+        if not retry_after:
+            backoff = min(RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_BACKOFF_BASE * (2 ** attempt))
+            retry_after = backoff * random.uniform(0.5, 1.0)
+        now = time.monotonic()
+        with self._cond:
+            self.metrics["rate_limited"] += 1
+            self._blocked_until[model] = max(self._blocked_until.get(model, 0), now + retry_after)
+            self._cond.notify_all()
+        if headers:
+            self.update_from_headers(model, {k: v for k, v in headers.items() if k != "retry-after"})
+        return retry_after
+
+    def settle(self, model, estimated, actual, synced=False):
+        """ 見込みと実際のトークン数の差をバケツに戻す（または追加で引く）。
+            synced=True（このレスポンスのヘッダーで残量を合わせ済み）なら、実際の消費は
+            サーバーの残量に入っているので何もしない（差を足すと二重に数える） """
+        if actual is None or synced:
+            return
+        with self._cond:
+            _, token_bucket = self._buckets_for(model)
+            token_bucket.level = min(token_bucket.capacity, token_bucket.level + (estimated - actual))
+            self._cond.notify_all()
+
+    def report(self):
+        m = self.metrics
+        throttled = ", ".join(f"{k}: {v:.1f}秒" for k, v in m["throttled_seconds"].items()) or "なし"
+        report = f"送信 {m['requests']}回 / 429 {m['rate_limited']}回 / 待機 {throttled}"
+        if m["daily_remaining"]:
+            daily = ", ".join(f"{k}: {v:.0f}回" for k, v in m["daily_remaining"].items())
+            report += f" / 本日の残り {daily}"
+        return report
+
+
+class ModelRouter:
+    """ モデルごとに直近の 応答時間・失敗率・429率 を覚え、リクエストごとに使うモデルを選ぶ。
+        ヘッジ（1本目が遅いときに別モデルへも送る）までの待ち時間もここから決める。
+        GroqRateScheduler と同じくプロセスで1つを共有する """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """ プロセスで1つのインスタンスを返す """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def __init__(self, models=None, limits=None, window=ROUTER_WINDOW, min_samples=ROUTER_MIN_SAMPLES):
+        self.models = list(ROUTER_MODELS if models is None else models)
+        self.limits = dict(MODEL_RATE_LIMITS if limits is None else limits)
+        self.window = window
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._calls = {}  # model -> deque[(秒, 見込みトークン数, "ok" / "error" / "throttled")]
+        self.metrics = {"routed": 0, "hedged": 0, "hedge_wins": 0}
+
+    def record(self, model, seconds, tokens, outcome="ok"):
+        """ 1回の送信結果を記録する """
+        with self._lock:
+            calls = self._calls.get(model)
+            if calls is None:
+                calls = self._calls[model] = deque(maxlen=self.window)
+            calls.append((seconds, max(1, tokens), outcome))
+
+    def record_hedge(self, backup_won):
+        with self._lock:
+            self.metrics["hedged"] += 1
+            if backup_won:
+                self.metrics["hedge_wins"] += 1
+
+    def _stats(self, model):
+        """ ロック保持中に呼ぶ """
+        calls = self._calls.get(model, ())
+        ok = [(seconds, tokens) for seconds, tokens, outcome in calls if outcome == "ok"]
+        count = len(calls)
+        return {
+            "calls": count,
+            "ok": len(ok),
+            "error_rate": sum(1 for c in calls if c[2] != "ok") / count if count else 0.0,
+            "throttle_rate": sum(1 for c in calls if c[2] == "throttled") / count if count else 0.0,
+            "p50_s": _percentile([seconds for seconds, _ in ok], 50),
+            "p95_s": _percentile([seconds for seconds, _ in ok], 95),
+            # 入力の大きさで応答時間を見積もるための、1000トークンあたりの秒数
+            "p95_s_per_ktok": _percentile([seconds / tokens * 1000 for seconds, tokens in ok], 95),
+        }
+
+    def _fits(self, model, tokens):
+        """ 1分あたりのトークン上限に収まらないプロンプトはそのモデルに送れない """
+        return tokens <= self.limits.get(model, DEFAULT_RATE_LIMIT)["tpm"]
+
+    def _rank(self, model):
+        return self.models.index(model) if model in self.models else len(self.models)
+
+    def choose(self, preferred, tokens, deadline=None, allow_downgrade=False, allow_upgrade=True):
+        """ (使うモデル, ヘッジ先 or None) を返す。
+            既定は preferred。トークン上限に収まらない・失敗が多い・締め切りに間に合わない見込みのときだけ替える。
+            allow_downgrade が無ければ preferred より軽いモデルは、allow_upgrade が無ければ重いモデルは選ばない """
+        def allowed(model):
+            rank, base = self._rank(model), self._rank(preferred)
+            return (allow_downgrade or rank <= base) and (allow_upgrade or rank >= base)
+
+        candidates = [preferred] + [m for m in self.models if m != preferred and allowed(m)]
+        with self._lock:
+            stats = {m: self._stats(m) for m in candidates}
+        usable = [m for m in candidates if self._fits(m, tokens)] or candidates[:1]
+        healthy = [m for m in usable
+                   if stats[m]["calls"] < self.min_samples or stats[m]["error_rate"] <= ROUTER_MAX_ERROR_RATE]
+        healthy = healthy or usable
+
+        def predicted(model):
+            if stats[model]["ok"] < self.min_samples:
+                return None
+            return stats[model]["p95_s_per_ktok"] * tokens / 1000
+
+        model = healthy[0]
+        if deadline is not None and (predicted(model) or 0) > deadline:
+            known = [m for m in healthy if predicted(m) is not None]
+            in_time = [m for m in known if predicted(m) <= deadline]
+            model = in_time[0] if in_time else min(known, key=predicted)
+        if model != preferred:
+            with self._lock:
+                self.metrics["routed"] += 1
+        backup = next((m for m in healthy if m != model), None)
+        return model, backup
+
+    def hedge_delay(self, model):
+        """ このモデルの p95（秒）。実績が足りなければ None（ヘッジしない） """
+        with self._lock:
+            stats = self._stats(model)
+        return stats["p95_s"] if stats["ok"] >= self.min_samples else None
+
+    def snapshot(self):
+        """ モデルごとの直近の成績（表示・調整用） """
+        with self._lock:
+            models = list(self._calls)
+            rows = [(m, self._stats(m)) for m in models]
+        return [{
+            "model": model,
+            "calls": stats["calls"],
+            "p50_ms": round(stats["p50_s"] * 1000, 1),
+            "p95_ms": round(stats["p95_s"] * 1000, 1),
+            "p95_ms_per_ktok": round(stats["p95_s_per_ktok"] * 1000, 1),
+            "error_rate": round(stats["error_rate"], 3),
+            "throttle_rate": round(stats["throttle_rate"], 3),
+        } for model, stats in rows]
+
+    def report(self):
+        m = self.metrics
+        models = " / ".join(f"{row['model']}: {row['calls']}回 p95 {row['p95_ms']:.0f}ms "
+                            f"失敗 {row['error_rate']:.0%} 429 {row['throttle_rate']:.0%}"
+                            for row in self.snapshot()) or "記録なし"
+        return f"{models} / 振替 {m['routed']}回 / ヘッジ {m['hedged']}回 (うち勝ち {m['hedge_wins']}回)"
+
+
+class StrictFilterCache(SQLiteCache):
+    """ 企業リストごとの業界フィルターを期限つきで保存する """
+
+    def __init__(self, path=None, ttl=STRICT_FILTER_TTL):
+        super().__init__(path or os.path.join(CACHE_DIR, "strict_filter.sqlite3"),
+                         table="strict_filters", ttl=ttl, max_bytes=0)
+
+
+class CompanyInfoCache(SQLiteCache):
+    """ 企業ごとの Web 検索結果を期限つきで保存する """
+
+    def __init__(self, path=None, ttl=COMPANY_INFO_TTL):
+        super().__init__(path or os.path.join(CACHE_DIR, "company_info.sqlite3"),
+                         table="company_info", ttl=ttl, max_bytes=0)
+
+
+# ==========================================
+# ▼ 検索結果ページのスナップショット
+# ==========================================
+class SnapshotStore:
+    """ 取得した検索結果 HTML を圧縮して保存し、(query, location, strategy) で引けるようにする """
+
+    def __init__(self, root=None):
+        self.root = root or SNAPSHOT_DIR or os.path.join(CACHE_DIR, "snapshots")
+        os.makedirs(self.root, exist_ok=True)
+        self.codec = "zstd" if zstandard is not None else "gzip"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.root, "index.sqlite3"), timeout=30,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, query TEXT NOT NULL, location TEXT NOT NULL,"
+            " strategy TEXT NOT NULL, fetched_at REAL NOT NULL, url TEXT, path TEXT NOT NULL,"
+            " codec TEXT NOT NULL, size INTEGER NOT NULL, raw_size INTEGER NOT NULL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS snapshots_key ON snapshots(query, location, strategy, fetched_at)")
+        self._conn.commit()
+
+    def _compress(self, data):
+        if self.codec == "zstd":
+            return zstandard.ZstdCompressor(level=10).compress(data)
+        return gzip.compress(data, compresslevel=6)
+
+    def _decompress(self, data, codec):
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("zstd のスナップショットを読むには zstandard が必要です")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def save(self, html, query, location, strategy, url=None, fetched_at=None):
+        """ HTML を保存してファイルパスを返す """
+        fetched_at = fetched_at or time.time()
+        raw = html.encode("utf-8")
+        blob = self._compress(raw)
+        day = time.strftime("%Y%m%d", time.localtime(fetched_at))
+        key = SQLiteCache.make_key(query, location or "", strategy)[:16]
+        ext = "zst" if self.codec == "zstd" else "gz"
+        rel_path = os.path.join(day, f"{key}_{int(fetched_at * 1000)}.html.{ext}")
+        path = os.path.join(self.root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(blob)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO snapshots (query, location, strategy, fetched_at, url, path, codec, size, raw_size)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (query, location or "", strategy, fetched_at, url, rel_path, self.codec, len(blob), len(raw)))
+            self._conn.commit()
+        return path
+
+    def _read(self, rel_path, codec):
+        with open(os.path.join(self.root, rel_path), "rb") as f:
+            return self._decompress(f.read(), codec).decode("utf-8")
+
+    def latest(self, query, location, strategy):
+        """ 一番新しいスナップショットの HTML。無ければ None """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, codec FROM snapshots WHERE query = ? AND location = ? AND strategy = ?"
+                " ORDER BY fetched_at DESC LIMIT 1", (query, location or "", strategy)).fetchone()
+        if row is None:
+            return None
+        try:
+            return self._read(*row)
+        except (OSError, RuntimeError) as e:
+            log(f"   ⚠️ スナップショット読み込み失敗: {e}")
+            return None
+
+    def iter_snapshots(self, query=None):
+        """ (query, location, strategy, fetched_at, html) を古い順に返す """
+        sql = "SELECT query, location, strategy, fetched_at, path, codec FROM snapshots"
+        params = ()
+        if query is not None:
+            sql += " WHERE query = ?"
+            params = (query,)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY fetched_at", params).fetchall()
+        for q, loc, strategy, fetched_at, rel_path, codec in rows:
+            yield q, loc or None, strategy, fetched_at, self._read(rel_path, codec)
+
+    def stats(self):
+        with self._lock:
+            count, size, raw_size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(raw_size), 0) FROM snapshots").fetchone()
+        return {"count": count, "size": size, "raw_size": raw_size}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# ==========================================
+# ▼ 求人インデックス (Indeed の jk で管理)
+# ==========================================
+# 「3日前」「新着」のように日々変わる表示はハッシュから除く
+_VOLATILE_SEGMENT = re.compile(r'^(?:\d+\+?\s*日前|今日|本日|新着|NEW|掲載日.*|\d+\s*時間前)$', re.IGNORECASE)
+
+
+def job_content_hash(block):
+    """ カードの中身のハッシュ（日付表示などの揺れは無視） """
+    segments = [seg for seg in _card_segments(block) if not _VOLATILE_SEGMENT.match(seg)]
+    raw = block.get("title", "") + "\n" + "\n".join(segments)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class JobIndex:
+    """ 求人ごとの 正規化済み項目・カード内容ハッシュ・初出/最終確認日時 を保存する。
+        判定（対象外かどうか）は企業によって変わるので、(企業キー, jk) ごとに持つ。
+        企業キーは company_key() の "企業名@エリア" """
+
+    def __init__(self, path=None):
+        path = path or os.path.join(CACHE_DIR, "jobs.sqlite3")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # 以前の jk だけを主キーにした表は作り直す（中身は次の抽出で入り直す）
+        primary_key = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)") if row[5]]
+        if primary_key == ["jk"]:
+            self._conn.execute("DROP TABLE jobs")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " company TEXT NOT NULL, jk TEXT NOT NULL, content_hash TEXT NOT NULL,"
+            " filter_key TEXT NOT NULL, relevant INTEGER NOT NULL, record TEXT,"
+            " status TEXT NOT NULL DEFAULT 'open', first_seen REAL NOT NULL, last_seen REAL NOT NULL,"
+            " closed_at REAL, PRIMARY KEY (company, jk))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_company ON jobs(company, status)")
+        self._conn.commit()
+
+    def lookup(self, company, jks):
+        """ この企業で保存した {jk: {"content_hash", "filter_key", "relevant", "record"}} """
+        jks = [jk for jk in jks if jk]
+        if not jks:
+            return {}
+        placeholders = ",".join("?" * len(jks))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT jk, content_hash, filter_key, relevant, record FROM jobs"
+                f" WHERE company = ? AND jk IN ({placeholders})",
+                [company, *jks]).fetchall()
+        return {
+            jk: {"content_hash": h, "filter_key": fk, "relevant": bool(rel),
+                 "record": json.loads(rec) if rec else None}
+            for jk, h, fk, rel, rec in rows
+        }
+
+    def upsert(self, company, jk, content_hash, filter_key, record, seen_at=None):
+        """ 新規・変更ありの求人を保存する。record=None は「対象外」と判定されたもの """
+        seen_at = seen_at or time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (jk, company, content_hash, filter_key, relevant, record, status,"
+                "                  first_seen, last_seen)"
+                " VALUES (?, ?, ?, ?, ?, ?, 'open', ?, ?)"
+                " ON CONFLICT(company, jk) DO UPDATE SET"
+                "   content_hash = excluded.content_hash, filter_key = excluded.filter_key,"
+                "   relevant = excluded.relevant, record = excluded.record, status = 'open',"
+                "   last_seen = excluded.last_seen, closed_at = NULL",
+                (jk, company, content_hash, filter_key, int(record is not None),
+                 json.dumps(record, ensure_ascii=False) if record is not None else None, seen_at, seen_at))
+            self._conn.commit()
+
+    def touch(self, company, jks, seen_at=None):
+        """ 変更なしで再確認できた求人の最終確認日時を更新する """
+        seen_at = seen_at or time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE jobs SET last_seen = ?, status = 'open', closed_at = NULL WHERE company = ? AND jk = ?",
+                [(seen_at, company, jk) for jk in jks if jk])
+            self._conn.commit()
+
+    def close_missing(self, company, since):
+        """ since 以降に一度も見かけなかった企業の求人を「掲載終了」にする。件数を返す """
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = 'closed', closed_at = ?"
+                " WHERE company = ? AND status = 'open' AND last_seen < ?",
+                (time.time(), company, since))
+            self._conn.commit()
+            return cur.rowcount
+
+    def counts(self, company=None):
+        sql = "SELECT status, COUNT(*) FROM jobs"
+        params = ()
+        if company is not None:
+            sql += " WHERE company = ?"
+            params = (company,)
+        with self._lock:
+            rows = self._conn.execute(sql + " GROUP BY status", params).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# ==========================================
+# ▼ バッチモードの企業リストと進捗
+# ==========================================
+def parse_company_entry(item):
+    """ "企業名@エリア" を {"name", "loc"} にする。空なら None """
+    item = str(item).replace("　", " ").strip()
+    if not item:
+        return None
+    if "@" in item:
+        name, loc = item.split("@", 1)
+        return {"name": name.strip(), "loc": loc.strip() or None}
+    return {"name": item, "loc": None}
+
+
+def company_key(company_info):
+    return f"{company_info['name']}@{company_info.get('loc') or ''}"
+
+
+def iter_company_entries(path):
+    """ CSV / JSONL の企業リストを1件ずつ返す（ファイル全体は読み込まない）
+        CSV: name, loc 列のヘッダー付き、またはヘッダー無しで1列目が "企業名@エリア"
+        JSONL: {"name", "loc"} / {"company": "企業名@エリア"} / "企業名@エリア" """
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                row = json.loads(line)
+                if isinstance(row, dict) and row.get("name"):
+                    entry = {"name": str(row["name"]).strip(), "loc": (str(row.get("loc") or "").strip() or None)}
+                else:
+                    entry = parse_company_entry(row.get("company", "") if isinstance(row, dict) else row)
+                if entry:
+                    yield entry
+            return
+
+        first = f.readline()
+        f.seek(0)
+        header = [c.strip().lower() for c in next(csv.reader([first]), [])]
+        if "name" in header:
+            for row in csv.DictReader(f, fieldnames=header):
+                if row is None or (row.get("name") or "").strip().lower() in ("", "name"):
+                    continue
+                yield {"name": row["name"].strip(), "loc": (row.get("loc") or "").strip() or None}
+        else:
+            for row in csv.reader(f):
+                entry = parse_company_entry(row[0]) if row else None
+                if entry:
+                    yield entry
+
+
+class BatchCheckpoint:
+    """ バッチモードの進捗（終わった企業と、使った業界フィルター）を保存する。
+        再実行すると終わった企業は飛ばす（status が error の企業は終わった扱いにしない） """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS done ("
+            " key TEXT PRIMARY KEY, status TEXT NOT NULL, count INTEGER NOT NULL, finished_at REAL NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+    def is_done(self, key):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM done WHERE key = ? AND status != 'error'",
+                                      (key,)).fetchone() is not None
+
+    def mark_done(self, key, status, count):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO done (key, status, count, finished_at) VALUES (?, ?, ?, ?)",
+                (key, status, count, time.time()))
+            self._conn.commit()
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                               (key, json.dumps(value, ensure_ascii=False)))
+            self._conn.commit()
+
+    def counts(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM done GROUP BY status").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class WorkQueue:
+    """ 企業ごとの検索タスクを SQLite に置く永続キュー。
+        タスクは期限つきで貸し出し（リース）、ワーカーはハートビートで延長する。
+        ワーカーが落ちたり固まったりしてリースが切れたタスクは他のワーカーが取り直し、
+        max_attempts 回失敗したものはデッドレター (status='dead') にする。
+        複数プロセスから同時に使える（別マシンからはロックの効く共有ディスク上に置く。NFS は不可） """
+
+    def __init__(self, path, lease_seconds=QUEUE_LEASE_SECONDS, max_attempts=QUEUE_MAX_ATTEMPTS):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # トランザクションは自分で BEGIN IMMEDIATE する（貸し出しを他プロセスと取り合わないため）
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL UNIQUE, payload TEXT NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,"
+            " available_at REAL NOT NULL, owner TEXT, lease_expires REAL, heartbeat_at REAL,"
+            " last_error TEXT, result TEXT, updated REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks(status, available_at)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def enqueue(self, payloads, key=company_key, batch_size=500):
+        """ タスクを追加する（同じキーのタスクがあれば追加しない）。追加した数を返す """
+        payloads = iter(payloads)
+        added = 0
+        while True:
+            batch = list(itertools.islice(payloads, batch_size))
+            if not batch:
+                return added
+            now = time.time()
+            with self._transaction() as conn:
+                for payload in batch:
+                    cur = conn.execute(
+                        "INSERT OR IGNORE INTO tasks (key, payload, available_at, updated) VALUES (?, ?, ?, ?)",
+                        (key(payload), json.dumps(payload, ensure_ascii=False), now, now))
+                    added += cur.rowcount
+
+    def lease(self, owner):
+        """ 次のタスクを借りる。(タスクID, payload, 何回目か) か、借りられるものが無ければ None """
+        now = time.time()
+        with self._transaction() as conn:
+            # リースが切れたタスクを戻す（回数を使い切っていればデッドレター）
+            conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'pending' END,"
+                " owner = NULL, available_at = ?, last_error = 'lease expired', updated = ?"
+                " WHERE status = 'leased' AND lease_expires < ?",
+                (self.max_attempts, now, now, now))
+            row = conn.execute(
+                "SELECT id, payload, attempts FROM tasks WHERE status = 'pending' AND available_at <= ?"
+                " ORDER BY id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE tasks SET status = 'leased', owner = ?, attempts = attempts + 1, lease_expires = ?,"
+                " heartbeat_at = ?, updated = ? WHERE id = ?",
+                (owner, now + self.lease_seconds, now, now, row[0]))
+        return row[0], json.loads(row[1]), row[2] + 1
+
+    def heartbeat(self, task_id, owner):
+        """ リースを延長する。もう自分のリースでなければ False """
+        now = time.time()
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "UPDATE tasks SET lease_expires = ?, heartbeat_at = ?, updated = ?"
+                " WHERE id = ? AND owner = ? AND status = 'leased'",
+                (now + self.lease_seconds, now, now, task_id, owner))
+        return cur.rowcount == 1
+
+    def complete(self, task_id, owner, result):
+        """ 結果を保存して完了にする。リースを他に取られていたら何もせず False """
+        now = time.time()
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "UPDATE tasks SET status = 'done', result = ?, owner = NULL, last_error = NULL, updated = ?"
+                " WHERE id = ? AND owner = ? AND status = 'leased'",
+                (json.dumps(result, ensure_ascii=False), now, task_id, owner))
+        return cur.rowcount == 1
+
+    def fail(self, task_id, owner, error, retry_delay=QUEUE_RETRY_DELAY):
+        """ 失敗を記録する。回数が残っていれば retry_delay 秒後に再び貸し出す """
+        now = time.time()
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'pending' END,"
+                " owner = NULL, available_at = ?, last_error = ?, updated = ?"
+                " WHERE id = ? AND owner = ? AND status = 'leased'",
+                (self.max_attempts, now + retry_delay, str(error)[:500], now, task_id, owner))
+        return cur.rowcount == 1
+
+    def requeue_dead(self):
+        """ デッドレターを回数を戻して再投入する。戻した数を返す """
+        now = time.time()
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "UPDATE tasks SET status = 'pending', attempts = 0, available_at = ?, updated = ?"
+                " WHERE status = 'dead'", (now, now))
+        return cur.rowcount
+
+    def counts(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+
+    def is_drained(self):
+        """ 待ち・実行中のタスクが1つも無い（全部 完了 かデッドレター） """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM tasks WHERE status IN ('pending', 'leased') LIMIT 1").fetchone()
+        return row is None
+
+    def results(self):
+        """ (payload, 結果) を投入順に返す（デッドレターの結果は None） """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload, result FROM tasks WHERE status IN ('done', 'dead') ORDER BY id").fetchall()
+        for payload, result in rows:
+            yield json.loads(payload), json.loads(result) if result else None
+
+    def dead_letters(self):
+        """ [(payload, 試行回数, 最後のエラー)] """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload, attempts, last_error FROM tasks WHERE status = 'dead' ORDER BY id").fetchall()
+        return [(json.loads(payload), attempts, error) for payload, attempts, error in rows]
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_meta(self, key, value):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                         (key, json.dumps(value, ensure_ascii=False)))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# ==========================================
+# ▼ 求人データの書き出し (Parquet)
+# ==========================================
+def _require_pyarrow():
+    if pyarrow is None:
+        raise RuntimeError("Parquet で書き出すには pyarrow が必要です (pip install pyarrow)")
+
+
+def job_record_schema():
+    """ 書き出す求人レコードの型（run_date・company は分割キーにもなる） """
+    _require_pyarrow()
+    return pyarrow.schema([
+        pyarrow.field("run_date", pyarrow.string(), nullable=False),
+        pyarrow.field("company", pyarrow.string(), nullable=False),
+        pyarrow.field("jk", pyarrow.string()),
+        pyarrow.field("title", pyarrow.string()),
+        pyarrow.field("salary", pyarrow.string()),
+        pyarrow.field("location", pyarrow.string()),
+        pyarrow.field("remote", pyarrow.string()),
+        pyarrow.field("details", pyarrow.string()),
+        pyarrow.field("url", pyarrow.string()),
+        pyarrow.field("crawled_at", pyarrow.timestamp("ms", tz="UTC"), nullable=False),
+    ])
+
+
+def job_records(company, jobs, crawled_at=None):
+    """ 抽出した求人 dict を、型をそろえたレコードにする（jk は URL から取り出す） """
+    crawled_at = crawled_at or time.time()
+    run_date = time.strftime("%Y-%m-%d", time.localtime(crawled_at))
+    records = []
+    for job in jobs or []:
+        if not isinstance(job, dict):
+            continue
+        text = lambda key: None if job.get(key) is None else str(job.get(key))
+        url = text("url")
+        match = _JK_PATTERN.search(url or "")
+        records.append({
+            "run_date": run_date,
+            "company": company,
+            "jk": match.group(1) if match else None,
+            "title": text("title"),
+            "salary": text("salary"),
+            "location": text("location"),
+            "remote": text("remote"),
+            "details": text("details"),
+            "url": url,
+            "crawled_at": int(crawled_at * 1000),
+        })
+    return records
+
+
+def job_records_table(records):
+    _require_pyarrow()
+    schema = job_record_schema()
+    columns = {field.name: [r[field.name] for r in records] for field in schema}
+    return pyarrow.Table.from_pydict(columns, schema=schema)
+
+
+def write_jobs_parquet(root, records):
+    """ root 以下に run_date=.../company=.../part-*.parquet として追記する。書いた件数を返す """
+    if not records:
+        return 0
+    os.makedirs(root, exist_ok=True)
+    pyarrow_parquet.write_to_dataset(
+        job_records_table(records), root, partition_cols=PARQUET_PARTITION_COLS,
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore")
+    return len(records)
+
+
+def export_results_parquet(root, results, crawled_at=None):
+    """ run_many の {企業名: data} をまとめて書き出す """
+    crawled_at = crawled_at or time.time()
+    records = [record for name, data in results.items() if data
+               for record in job_records(name, data.get("raw_data"), crawled_at)]
+    return write_jobs_parquet(root, records)
+
+
+def jobs_parquet_bytes(records):
+    """ 分割しない1つの Parquet ファイル（ダウンロード用）のバイト列 """
+    table = job_records_table(records)
+    sink = pyarrow.BufferOutputStream()
+    pyarrow_parquet.write_table(table, sink, compression="zstd")
+    return sink.getvalue().to_pybytes()
+
+
+# ==========================================
+# ▼ 給与の正規化 (pandas)
+# ==========================================
+_SALARY_PERIOD_PATTERN = "(" + "|".join(SALARY_PERIODS) + ")"
+# "~40万", "25万~40万", "1200~1500", "400万以上", "1万2000円" など（波線類は ~ にそろえてから当てる）
+# 万の後ろの端数 (rest) は、すぐ後に 円 が続くときだけ取る（"25万 8時間" の 8 は端数ではない）
+_SALARY_AMOUNT_PATTERN = (
+    r"(?P<lead>~)?\s*(?P<lo>\d+(?:\.\d+)?)\s*(?:(?P<lo_man>万)\s*(?:(?P<lo_rest>\d+)(?=\s*円))?)?\s*円?"
+    r"(?:\s*~\s*(?:(?P<hi>\d+(?:\.\d+)?)\s*(?:(?P<hi_man>万)\s*(?:(?P<hi_rest>\d+)(?=\s*円))?)?)?)?"
+)
+SALARY_COLUMNS = ["salary_min", "salary_max", "salary_period", "salary_period_inferred",
+                  "annual_min", "annual_max", "annual_mid"]
+
+
+def _parse_salary_texts(texts):
+    """ 給与テキストの Series を列ごとの文字列操作でまとめて解析する（1行ずつのループはしない） """
+    text = (texts.astype("string")
+            .str.normalize("NFKC")
+            .str.replace(r"(?<=\d),(?=\d)", "", regex=True)
+            .str.replace(r"[〜～\-－−–—]", "~", regex=True))
+    period = text.str.extract(_SALARY_PERIOD_PATTERN, expand=False).map(SALARY_PERIODS).astype(object)
+    parts = text.str.extract(_SALARY_AMOUNT_PATTERN)
+
+    lo = pd.to_numeric(parts["lo"], errors="coerce").astype("float64")
+    hi = pd.to_numeric(parts["hi"], errors="coerce").astype("float64")
+    lo_rest = pd.to_numeric(parts["lo_rest"], errors="coerce").astype("float64").fillna(0)
+    hi_rest = pd.to_numeric(parts["hi_rest"], errors="coerce").astype("float64").fillna(0)
+    # "25~40万円" は下限も万単位。"1万2000円" は 万 の後ろの端数を足す
+    hi_man = parts["hi_man"].notna()
+    lo_man = parts["lo_man"].notna() | hi_man
+    lo = lo.mask(lo_man, lo * 10000 + lo_rest)
+    hi = hi.mask(hi_man, hi * 10000 + hi_rest)
+    # "~40万円" "40万円まで" は上限だけ
+    max_only = hi.isna() & (parts["lead"].notna() | text.str.match(r"\s*~").fillna(False)
+                            | text.str.contains("まで|以下").fillna(False))
+    hi = hi.mask(max_only, lo)
+    lo = lo.mask(max_only)
+
+    amount = lo.fillna(hi)
+    bins = [float("-inf")] + [limit for limit, _ in SALARY_PERIOD_GUESS] + [float("inf")]
+    guessed = pd.cut(amount, bins=bins, right=False,
+                     labels=[name for _, name in SALARY_PERIOD_GUESS] + ["year"]).astype(object)
+    inferred = period.isna() & amount.notna()
+    period = period.where(~inferred, guessed)
+    factor = period.map(SALARY_ANNUAL_FACTORS).astype("float64")
+
+    parsed = pd.DataFrame({
+        "salary_min": lo,
+        "salary_max": hi,
+        "salary_period": period,
+        "salary_period_inferred": inferred,
+        "annual_min": lo * factor,
+        "annual_max": hi * factor,
+    })
+    parsed["annual_mid"] = parsed[["annual_min", "annual_max"]].mean(axis=1)
+    return parsed
+
+
+def normalize_salaries(df, column="salary"):
+    """ df[column] の給与テキストから 下限・上限・支給単位・年換算額 の列を足した DataFrame を返す。
+        同じテキストは1度だけ解析する（蓄積データは同じ表記の繰り返しが多い） """
+    if pd is None:
+        raise RuntimeError("給与の正規化には pandas が必要です")
+    codes, uniques = pd.factorize(df[column])
+    rows = _parse_salary_texts(pd.Series(uniques, dtype=object)).reindex(codes)
+    rows.index = df.index
+    rows["salary_period_inferred"] = rows["salary_period_inferred"].fillna(False).astype(bool)
+    return df.drop(columns=[c for c in SALARY_COLUMNS if c in df.columns]).join(rows)
+
+
+def salary_summary(df, by):
+    """ normalize_salaries 済みの df を by（"company" / "title" など）ごとに集計する
+        （求人数・給与が読めた数・年換算の中央値・下限・上限） """
+    df = df.assign(_low=df["annual_min"].fillna(df["annual_max"]),
+                   _high=df["annual_max"].fillna(df["annual_min"]))
+    summary = df.groupby(by, sort=False, observed=True).agg(
+        postings=("annual_mid", "size"),
+        parsed=("annual_mid", "count"),
+        median_annual=("annual_mid", "median"),
+        min_annual=("_low", "min"),
+        max_annual=("_high", "max"),
+    )
+    return summary.sort_values("postings", ascending=False).reset_index()
+
+
+# ==========================================
+# ▼ Web 検索バックエンド
+# ==========================================
+class DDGSSearchBackend:
+    """ DuckDuckGo 検索。バックエンドは name と search(query, max_results) -> [{"body": ...}]
+        を持っていれば差し替えられる（テスト・ベンチマーク用のスタブなど） """
+    name = "ddgs"
+
+    def search(self, query, max_results=WEB_SEARCH_MAX_RESULTS):
+        with duckduckgo_search.DDGS() as ddgs:
+            return list(ddgs.text(query, max_results=max_results))
+
+
 class TalentScopeAI:
-    def __init__(self, api_key):
+    _profile_lock = threading.Lock()
+    _profiles_in_use = set()  # 使用中のブラウザプロファイル番号（_create_drission_driver のフォルダ名）
+
+    def __init__(self, api_key, browser_pool_size=BROWSER_POOL_SIZE, max_rps=INDEED_MAX_RPS,
+                 extractor_engine=JOB_EXTRACTOR_ENGINE, rule_extraction=RULE_EXTRACTION,
+                 use_cache=True, cache_path=None, search_backend=None, save_snapshots=SAVE_SNAPSHOTS,
+                 use_job_index=USE_JOB_INDEX, trace_path=TRACE_FILE, groq_base_url=GROQ_BASE_URL,
+                 compact_fulltext=FULLTEXT_COMPACT, hedge=HEDGE_REQUESTS):
         if not api_key:
-            print("❌ エラー: APIキー設定なし")
+            log("❌ エラー: APIキー設定なし")
             sys.exit(1)
-        self.client = Groq(api_key=api_key)
+        self.api_key = api_key
+        self.groq_base_url = groq_base_url
+        self._client = None
+        self._async_client = None
+        self.groq_cache = GroqResponseCache(cache_path) if use_cache else None
+        self.company_info_cache = CompanyInfoCache() if use_cache else None
+        self.filter_cache = StrictFilterCache() if use_cache else None
+        self.rate_scheduler = GroqRateScheduler.shared()
+        self.router = ModelRouter.shared()
+        self.hedge = hedge
+        self._hedge_executor = None
+        self._hedge_lock = threading.Lock()
+        self.tracer = Tracer(trace_path)
+        self.search_backend = search_backend or DDGSSearchBackend()
+        self.search_limiter = HostRateLimiter(WEB_SEARCH_MAX_RPS)
+        self.save_snapshots = save_snapshots
+        self._snapshots = None
+        self.job_index = JobIndex() if use_job_index else None
+        self._profile = self._claim_profile()
+        self.browser_pool = BrowserPool(self._create_drission_driver, size=browser_pool_size)
+        self.host_limiter = HostRateLimiter(max_rps)
+        self.readiness = PageReadiness()
+        self.extractor = get_job_extractor(extractor_engine)
+        self.rule_extraction = rule_extraction
+        self.compact_fulltext = compact_fulltext
+        self._stats_lock = threading.Lock()
+        self.extraction_stats = {"blocks": 0, "prefiltered": 0, "index_reused": 0, "local_only": 0, "sent_to_llm": 0,
+                                 "relevance_only": 0, "llm_calls_skipped": 0, "fulltext_tokens_in": 0, "fulltext_tokens_out": 0}
+        self.batch_stats = deque(maxlen=STATS_MAX_RECORDS)  # 抽出バッチごとの所要時間・トークン数
 
-    def _call_groq_safe(self, messages, model_id, response_format=None, allow_fallback=False):
-        max_retries = 5
-        wait_time = 20
-        current_model = model_id
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def snapshots(self):
+        """ スナップショット保存先（保存・再解析で初めて使うときに開く） """
+        if self._snapshots is None:
+            self._snapshots = SnapshotStore()
+        return self._snapshots
+
+    @classmethod
+    def _claim_profile(cls):
+        """ このプロセスで使われていない一番小さいプロファイル番号を確保する。
+            同じプロファイルは同時に開けないので、分析器が複数あるときは別フォルダを使う """
+        with cls._profile_lock:
+            number = next(i for i in itertools.count() if i not in cls._profiles_in_use)
+            cls._profiles_in_use.add(number)
+        return number
+
+    def close(self):
+        """ 借りているブラウザ・開いている SQLite（キャッシュ・求人インデックス・スナップショット）・
+            ヘッジ用のスレッドプール・Groq の接続を閉じる（作業キューは渡した側が閉じる） """
+        self.browser_pool.close()
+        with self._profile_lock:
+            self._profiles_in_use.discard(self._profile)
+        log(f"   🧹 ブラウザプール: {self.browser_pool.report()}")
+        log(f"   ⏱️ 読み込み待ち: {self.readiness.report()}")
+        if self.groq_cache is not None:
+            log(f"   💾 Groqキャッシュ: {self.groq_cache.report()}")
+        if self.company_info_cache is not None:
+            log(f"   💾 企業情報キャッシュ: {self.company_info_cache.report()}")
+        if self.filter_cache is not None:
+            log(f"   💾 業界フィルターキャッシュ: {self.filter_cache.report()}")
+        log(f"   🚦 Groqレート制御: {self.rate_scheduler.report()}")
+        log(f"   🧭 モデル選択: {self.router.report()}")
+        if self._hedge_executor is not None:
+            # 負けたヘッジは走り切らせてから閉じる（走っている間はキャッシュへ書き込むことがある）
+            self._hedge_executor.shutdown(wait=True)
+            self._hedge_executor = None
+        log(f"   ⏱️ 計測: {self.tracer.report()}")
+        for store in (self.groq_cache, self.company_info_cache, self.filter_cache, self.job_index, self._snapshots):
+            if store is not None:
+                store.close()
+        if self._client is not None:
+            self._client.close()
+
+    @property
+    def client(self):
+        """ Groq クライアントは最初の呼び出しで作る（キャッシュだけで済む実行では groq を読み込まない） """
+        if self._client is None:
+            self._client = groq.Groq(api_key=self.api_key, base_url=self.groq_base_url)
+        return self._client
+
+    @property
+    def async_client(self):
+        """ AsyncGroq は非同期 API を初めて使うときに作る """
+        if self._async_client is None:
+            self._async_client = groq.AsyncGroq(api_key=self.api_key, base_url=self.groq_base_url)
+        return self._async_client
+
+    def _prepare_groq_call(self, messages, model_id, response_format):
+        """ 同期・非同期共通: (temperature, キャッシュ済み応答, 見込みトークン数) """
+        temperature = 0.1 if response_format else 0.6
+
+        # 同じプロンプトを同じモデルに送ったことがあればキャッシュから返す
+        cached = None
+        if self.groq_cache is not None:
+            cached = self.groq_cache.get_completion(
+                self.groq_cache.completion_key(model_id, messages, temperature, response_format))
+
+        estimated = sum(estimate_tokens(m.get("content", "")) for m in messages) + EXPECTED_COMPLETION_TOKENS
+        return temperature, cached, estimated
+
+    def _cache_completion(self, model, messages, temperature, response_format, response):
+        """ 応答を、実際に答えたモデル（振り替え・ヘッジ・429 での切り替え後）のキーで保存する。
+            頼んだモデルのキーで保存すると、次回は別モデルの応答をそのモデルのものとして返してしまう """
+        if self.groq_cache is not None:
+            key = self.groq_cache.completion_key(model, messages, temperature, response_format)
+            self.groq_cache.put_completion(key, response)
+
+    def _groq_kwargs(self, messages, model, temperature, response_format):
+        kwargs = {"messages": messages, "model": model, "temperature": temperature}
+        if response_format:
+            kwargs["response_format"] = response_format
+        return kwargs
+
+    def _record_usage(self, span, model, usage):
+        span.set(model=model,
+                 prompt_tokens=getattr(usage, "prompt_tokens", None),
+                 completion_tokens=getattr(usage, "completion_tokens", None))
+
+    def _accept_groq_response(self, raw, model, estimated, span, response=None):
+        """ 生レスポンスからヘッダーをスケジューラへ渡し、応答を返す
+            （AsyncGroq の parse() はコルーチンなので、非同期側は await した結果を response で渡す） """
+        synced = self.rate_scheduler.update_from_headers(model, raw.headers)
+        if response is None:
+            response = raw.parse()
+        usage = getattr(response, "usage", None)
+        self._record_usage(span, model, usage)
+        self.rate_scheduler.settle(model, estimated, getattr(usage, "total_tokens", None), synced)
+        return response
+
+    def _on_rate_limit(self, error, model, attempt, allow_fallback):
+        """ 429 のときの処理。次に使うモデルを返す """
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        wait_time = self.rate_scheduler.penalize(model, headers, attempt)
+        log(f"   ⏳ API制限({model})。{wait_time:.1f}秒 待機...")
+        if allow_fallback and model == MODEL_HEAVY and attempt >= 1:
+            return MODEL_LIGHT
+        return model
+
+    def _route(self, model_id, estimated, deadline, allow_fallback, priority, span):
+        """ ルーターにモデルを選ばせる。(使うモデル, ヘッジ先) と、ヘッジまでの秒数 (しないなら None) """
+        model, backup = self.router.choose(model_id, estimated, deadline=deadline, allow_downgrade=allow_fallback,
+                                           allow_upgrade=priority != PRIORITY_BULK or ROUTER_BULK_UPGRADE)
+        if model != model_id:
+            span.set(routed_from=model_id)
+        span.set(model=model)
+        delay = self.router.hedge_delay(model) if self.hedge and backup is not None else None
+        return model, backup, delay
+
+    @staticmethod
+    def _is_valid_response(response, response_format):
+        """ ヘッジの勝ち判定: 応答があり、JSON を頼んだなら JSON として読めること """
+        if response is None:
+            return False
+        if not response_format or response_format.get("type") != "json_object":
+            return True
+        try:
+            json.loads(response.choices[0].message.content)
+        except (ValueError, TypeError, AttributeError, IndexError):
+            return False
+        return True
+
+    def _hedge_pool(self):
+        with self._hedge_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ContextThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS)
+            return self._hedge_executor
+
+    def _call_groq_safe(self, messages, model_id, response_format=None, allow_fallback=False,
+                        priority=PRIORITY_NORMAL, deadline=None):
+        """ deadline (秒) を渡すと、間に合わない見込みのときに速いモデルへ回す """
+        with self.tracer.span("llm", model=model_id, priority=priority) as span:
+            response = self._call_groq_attempts(messages, model_id, response_format, allow_fallback,
+                                                priority, deadline, span)
+            span.set(ok=response is not None)
+            return response
+
+    def _call_groq_attempts(self, messages, model_id, response_format, allow_fallback, priority, deadline, span):
+        temperature, cached, estimated = self._prepare_groq_call(messages, model_id, response_format)
+        span.set(cached=cached is not None)
+        if cached is not None:
+            self._record_usage(span, model_id, getattr(cached, "usage", None))
+            return cached
+
+        model, backup, delay = self._route(model_id, estimated, deadline, allow_fallback, priority, span)
 
+        def call(current_model, leg_span):
+            return self._call_model_attempts(messages, current_model, temperature, response_format, estimated,
+                                             allow_fallback, priority, leg_span)
+
+        if delay is None:
+            return call(model, span)
+        return self._hedged_call(call, model, backup, delay, response_format, span)
+
+    def _call_model_attempts(self, messages, model, temperature, response_format, estimated,
+                             allow_fallback, priority, span):
+        max_retries = 5
+        current_model = model
         for attempt in range(max_retries):
+            span.set(retries=attempt)
+            sent = time.perf_counter()
             try:
-                if response_format:
-                    return self.client.chat.completions.create(
-                        messages=messages,
-                        model=current_model,
-                        temperature=0.1,
-                        response_format=response_format
-                    )
-                else:
-                    return self.client.chat.completions.create(
-                        messages=messages,
-                        model=current_model,
-                        temperature=0.6,
-                    )
-            except RateLimitError:
-                print(f"   ⏳ API制限({current_model})。{wait_time}秒 待機...")
-                time.sleep(wait_time)
-                wait_time += 15
-                if allow_fallback and current_model == MODEL_HEAVY and attempt >= 1:
+                # 全スレッド共通のバケツで順番待ち（429 明けもここで待つ）
+                span.add("throttle_s", self.rate_scheduler.acquire(current_model, estimated, priority))
+                sent = time.perf_counter()
+                raw = self.client.chat.completions.with_raw_response.create(
+                    **self._groq_kwargs(messages, current_model, temperature, response_format))
+                elapsed = time.perf_counter() - sent
+                response = self._accept_groq_response(raw, current_model, estimated, span)
+                self.router.record(current_model, elapsed, estimated)
+                self._cache_completion(current_model, messages, temperature, response_format, response)
+                return response
+            except groq.RateLimitError as e:
+                self.router.record(current_model, time.perf_counter() - sent, estimated, "throttled")
+                current_model = self._on_rate_limit(e, current_model, attempt, allow_fallback)
+            except Exception as e:
+                self.router.record(current_model, time.perf_counter() - sent, estimated, "error")
+                if "decommissioned" in str(e) or "not found" in str(e):
                     current_model = MODEL_LIGHT
+                    continue
+                return None
+        return None
+
+    def _hedged_call(self, call, model, backup, delay, response_format, span):
+        """ model に送り、delay 秒たっても正しい応答が無ければ backup にも送る。先に届いた正しい応答を返す。
+            負けた方は止められないので最後まで走らせ、結果は捨てる """
+        executor = self._hedge_pool()
+
+        def leg(current_model, is_backup):
+            with self.tracer.span("llm_hedge", model=current_model, backup=is_backup) as leg_span:
+                return call(current_model, leg_span)
+
+        pending = {executor.submit(leg, model, False): model}
+        hedged = False
+        fallback = None
+        while pending:
+            done, _ = wait(pending, timeout=None if hedged else delay, return_when=FIRST_COMPLETED)
+            for future in done:
+                current_model = pending.pop(future)
+                response = future.result()
+                if self._is_valid_response(response, response_format):
+                    self._finish_hedge(span, current_model, getattr(response, "usage", None), hedged,
+                                       current_model == backup)
+                    return response
+                fallback = fallback or response
+            if not hedged:
+                # 1本目が遅い（または先に失敗した）ので別モデルにも送る
+                hedged = True
+                log(f"   🪁 {model} が{'失敗した' if done else f' {delay:.1f}秒 を超えた'}ため {backup} にも送信")
+                pending[executor.submit(leg, backup, True)] = backup
+        span.set(hedged=hedged)
+        return fallback
+
+    def _finish_hedge(self, span, model, usage, hedged, backup_won):
+        self._record_usage(span, model, usage)
+        span.set(hedged=hedged, hedge_winner=model)
+        if hedged:
+            self.router.record_hedge(backup_won)
+
+    async def _call_groq_safe_async(self, messages, model_id, response_format=None, allow_fallback=False,
+                                    priority=PRIORITY_NORMAL, timeout=GROQ_CALL_TIMEOUT, deadline=None):
+        """ _call_groq_safe の非同期版。1回の呼び出しが timeout 秒を超えたら None """
+        with self.tracer.span("llm", model=model_id, priority=priority) as span:
+            response = await self._call_groq_attempts_async(messages, model_id, response_format, allow_fallback,
+                                                            priority, timeout, deadline, span)
+            span.set(ok=response is not None)
+            return response
+
+    async def _call_groq_attempts_async(self, messages, model_id, response_format, allow_fallback, priority,
+                                        timeout, deadline, span):
+        temperature, cached, estimated = self._prepare_groq_call(messages, model_id, response_format)
+        span.set(cached=cached is not None)
+        if cached is not None:
+            self._record_usage(span, model_id, getattr(cached, "usage", None))
+            return cached
+
+        model, backup, delay = self._route(model_id, estimated, deadline, allow_fallback, priority, span)
+
+        async def call(current_model, leg_span):
+            return await self._call_model_attempts_async(messages, current_model, temperature, response_format,
+                                                         estimated, allow_fallback, priority, timeout, leg_span)
+
+        if delay is None:
+            return await call(model, span)
+        return await self._hedged_call_async(call, model, backup, delay, response_format, span)
+
+    async def _call_model_attempts_async(self, messages, model, temperature, response_format, estimated,
+                                         allow_fallback, priority, timeout, span):
+        max_retries = 5
+        current_model = model
+        for attempt in range(max_retries):
+            span.set(retries=attempt)
+            sent = time.perf_counter()
+            try:
+                span.add("throttle_s", await self.rate_scheduler.acquire_async(current_model, estimated, priority))
+                sent = time.perf_counter()
+                raw = await asyncio.wait_for(
+                    self.async_client.chat.completions.with_raw_response.create(
+                        **self._groq_kwargs(messages, current_model, temperature, response_format)),
+                    timeout)
+                elapsed = time.perf_counter() - sent
+                response = self._accept_groq_response(raw, current_model, estimated, span,
+                                                      response=await raw.parse())
+                self.router.record(current_model, elapsed, estimated)
+                self._cache_completion(current_model, messages, temperature, response_format, response)
+                return response
+            except groq.RateLimitError as e:
+                self.router.record(current_model, time.perf_counter() - sent, estimated, "throttled")
+                current_model = self._on_rate_limit(e, current_model, attempt, allow_fallback)
+            except asyncio.TimeoutError:
+                self.router.record(current_model, time.perf_counter() - sent, estimated, "error")
+                log(f"   ⚠️ Groq応答タイムアウト({current_model}, {timeout}秒)")
+                return None
             except Exception as e:
+                self.router.record(current_model, time.perf_counter() - sent, estimated, "error")
                 if "decommissioned" in str(e) or "not found" in str(e):
                     current_model = MODEL_LIGHT
                     continue
                 return None
         return None
 
-    def search_web_for_company_info(self, companies_list):
-        print(f"\n🌍 Web検索で業界コンテキストを学習中...")
+    async def _hedged_call_async(self, call, model, backup, delay, response_format, span):
+        """ _hedged_call の非同期版。勝負がついたら負けた方はキャンセルする """
+        async def leg(current_model, is_backup):
+            with self.tracer.span("llm_hedge", model=current_model, backup=is_backup) as leg_span:
+                return await call(current_model, leg_span)
+
+        pending = {asyncio.ensure_future(leg(model, False)): model}
+        hedged = False
+        fallback = None
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=None if hedged else delay,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    current_model = pending.pop(task)
+                    response = task.result()
+                    if self._is_valid_response(response, response_format):
+                        self._finish_hedge(span, current_model, getattr(response, "usage", None), hedged,
+                                           current_model == backup)
+                        return response
+                    fallback = fallback or response
+                if not hedged:
+                    hedged = True
+                    log(f"   🪁 {model} が{'失敗した' if done else f' {delay:.1f}秒 を超えた'}ため {backup} にも送信")
+                    pending[asyncio.ensure_future(leg(backup, True))] = backup
+            span.set(hedged=hedged)
+            return fallback
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _lookup_company(self, name):
+        """ 1社分の検索結果テキスト。キャッシュにあればネットワークに出ない。失敗時は None """
+        query = f"{name} 事業内容 業界"
+        cache_key = None
+        if self.company_info_cache is not None:
+            cache_key = self.company_info_cache.make_key(self.search_backend.name, query, WEB_SEARCH_MAX_RESULTS)
+            cached = self.company_info_cache.get(cache_key)
+            if cached is not None:
+                log(f"   💾 {name}: キャッシュを使用")
+                return cached
+
+        try:
+            self.search_limiter.wait(f"search://{self.search_backend.name}")
+            results = self.search_backend.search(query, max_results=WEB_SEARCH_MAX_RESULTS)
+        except Exception as e:
+            log(f"   ⚠️ {name}の検索失敗: {e}")
+            return None
+
+        info = f"■{name}の情報:\n"
+        for r in results:
+            info += f"- {r['body']}\n"
+        log(f"   🔎 {name}: 情報を取得")
+        if cache_key is not None:
+            self.company_info_cache.set(cache_key, info)
+        return info
+
+    def search_web_for_company_info(self, companies_list, max_workers=WEB_SEARCH_WORKERS):
+        log(f"\n🌍 Web検索で業界コンテキストを学習中...")
+        names = [comp['name'] for comp in companies_list]
+        if not names:
+            return ""
+        workers = max(1, min(max_workers, len(names)))
+        emit_event("web_search", total=len(names))
+        with self.tracer.span("web_search", companies=len(names)), \
+                ContextThreadPoolExecutor(max_workers=workers) as executor:
+            infos = list(executor.map(self._lookup_company, names))
+        emit_event("web_search_done", found=sum(1 for info in infos if info))
+
+        # 並列でも結果は入力順に並べる
         search_results_text = ""
-        with DDGS() as ddgs:
-            for comp in companies_list:
-                name = comp['name']
-                try:
-                    query = f"{name} 事業内容 業界"
-                    results = list(ddgs.text(query, max_results=2))
-                    info = f"■{name}の情報:\n"
-                    for r in results:
-                        info += f"- {r['body']}\n"
-                    search_results_text += info + "\n"
-                    print(f"   🔎 {name}: 情報を取得")
-                    time.sleep(1)
-                except Exception as e:
-                    print(f"   ⚠️ {name}の検索失敗: {e}")
+        for info in infos:
+            if info:
+                search_results_text += info + "\n"
         return search_results_text
 
-    def generate_strict_filter(self, search_results):
-        print("🧠 AIが業界フィルターを作成中...")
+    def _filter_messages(self, search_results):
         prompt = f"""
         Based on these search results, define the industry and negative keywords.
         Results: {search_results}
         JSON Format: {{ "target_industry": "Industry Name", "negative_keywords": "List of keywords to exclude" }}
         """
-        response = self._call_groq_safe(
-            messages=[{"role": "user", "content": prompt}],
-            model_id=MODEL_HEAVY,
-            response_format={"type": "json_object"}
-        )
+        return [{"role": "user", "content": prompt}]
+
+    def _parse_filter(self, response):
         try:
             return json.loads(response.choices[0].message.content)
         except:
             return {"target_industry": "General", "negative_keywords": ""}
 
+    def generate_strict_filter(self, search_results, cache_key=None):
+        """ cache_key を渡すと、作れたフィルターを filter_cache に保存する（失敗時は保存しない） """
+        log("🧠 AIが業界フィルターを作成中...")
+        response = self._call_groq_safe(
+            messages=self._filter_messages(search_results),
+            model_id=MODEL_HEAVY,
+            response_format={"type": "json_object"}
+        )
+        filter_data = self._parse_filter(response)
+        if cache_key is not None and self.filter_cache is not None and response is not None \
+                and "negative_keywords" in filter_data:
+            self.filter_cache.set(cache_key, filter_data)
+        emit_event("filter", target_industry=filter_data.get("target_industry"))
+        return filter_data
+
+    def build_strict_filter(self, companies_info):
+        """ 企業情報の Web 検索 → 業界フィルター作成。
+            同じ企業の組み合わせで作ったフィルターが残っていれば、検索も LLM 呼び出しもしない """
+        cache_key = None
+        if self.filter_cache is not None:
+            cache_key = self.filter_cache.make_key(MODEL_HEAVY, sorted(company_key(c) for c in companies_info))
+            cached = self.filter_cache.get(cache_key)
+            if cached is not None:
+                log(f"💾 業界フィルター: 前回の結果を使用 ({cached.get('target_industry')})")
+                emit_event("filter", target_industry=cached.get("target_industry"), cached=True)
+                return cached
+        return self.generate_strict_filter(self.search_web_for_company_info(companies_info), cache_key=cache_key)
+
+    async def generate_strict_filter_async(self, search_results):
+        log("🧠 AIが業界フィルターを作成中...")
+        response = await self._call_groq_safe_async(
+            messages=self._filter_messages(search_results),
+            model_id=MODEL_HEAVY,
+            response_format={"type": "json_object"}
+        )
+        return self._parse_filter(response)
+
     # ==========================================
     # ▼ DrissionPage設定 (ステルス強化版)
     # ==========================================
-    def _create_drission_driver(self):
-        co = ChromiumOptions()
+    def _create_drission_driver(self, slot=0):
+        co = DrissionPage.ChromiumOptions()
         
         # 記憶（Cookie）を保存するフォルダを設定
         # これにより、一度突破すれば次回から「顔なじみ」になります
+        # 同じプロファイルは同時に開けないので、2本目以降は別フォルダ
+        # 分析器が複数あるとき（ダッシュボードで設定を変えたとき）は2つ目以降も別フォルダ
         current_dir = os.getcwd()
-        user_data_path = os.path.join(current_dir, "browser_data_stealth")
+        folder = "browser_data_stealth"
+        if self._profile:
+            folder += f"_p{self._profile}"
+        if slot:
+            folder += f"_{slot}"
+        user_data_path = os.path.join(current_dir, folder)
         co.set_user_data_path(user_data_path)
 
         # 必須: 自動化フラグを消す
@@ -118,13 +2905,27 @@ class TalentScopeAI:
         # ポート衝突回避
         co.auto_port()
 
-        try:
-            page = ChromiumPage(co)
-            return page
-        except Exception as e:
-            print(f"   ⚠️ ブラウザ起動エラー(自動修復します): {e}")
-            time.sleep(3)
-            return ChromiumPage(co)
+        with self.tracer.span("browser_launch", slot=slot) as span:
+            try:
+                page = DrissionPage.ChromiumPage(co)
+                return page
+            except Exception as e:
+                log(f"   ⚠️ ブラウザ起動エラー(自動修復します): {e}")
+                span.set(retries=1)
+                time.sleep(3)
+                return DrissionPage.ChromiumPage(co)
+
+    def _polite_get(self, page, url):
+        """ アクセス間隔を守ってからページを開く """
+        with self.tracer.span("navigate", url=url) as span:
+            span.set(throttle_s=self.host_limiter.wait(url))
+            page.get(url)
+
+    def _wait_ready(self, page, conditions, timeout, label):
+        with self.tracer.span("readiness", label=label) as span:
+            matched = self.readiness.wait_for(page, conditions, timeout, label)
+            span.set(matched=matched, timed_out=matched is None)
+            return matched
 
     def _human_like_mouse_move(self, page):
         """ マウスを人間のようにランダムに動かす """
@@ -142,107 +2943,151 @@ class TalentScopeAI:
         except:
             pass
 
-    def _solve_cloudflare(self, page):
-        """ Cloudflare突破ロジック（強化版） """
-        time.sleep(2)
+    @staticmethod
+    def _sleep_unless_stopped(seconds, stop):
+        """ seconds 秒待つ。途中で stop が立てば True を返してすぐ抜ける """
+        if stop is None:
+            time.sleep(seconds)
+            return False
+        return stop.wait(seconds)
+
+    def _solve_cloudflare(self, page, stop=None):
+        """ Cloudflare突破ロジック（強化版）。stop が立ったら待つのをやめて戻る（借りたブラウザをすぐ返すため） """
+        # 固定で待たず、ドキュメントの読み込み完了だけ待つ
+        self._wait_ready(page, DOCUMENT_READY_CONDITIONS, DOCUMENT_READY_TIMEOUT, "document")
         title = page.title.lower() if page.title else ""
         
         # Cloudflareの画面かチェック
-        if "verify" in title or "challenge" in title or "security" in title or page.ele("text:人間であることを確認"):
-            print("   🛡️ Cloudflare検知。ステルス突破モード起動...")
+        if "verify" in title or "challenge" in title or "security" in title or page.ele("text:人間であることを確認", timeout=0):
+            with self.tracer.span("cloudflare_challenge") as span:
+                log("   🛡️ Cloudflare検知。ステルス突破モード起動...")
             
-            # 1. まず人間らしくマウスを揺らす（超重要）
-            self._human_like_mouse_move(page)
-            time.sleep(random.uniform(1.5, 3.0))
+                # 1. まず人間らしくマウスを揺らす（超重要）
+                self._human_like_mouse_move(page)
+                if self._sleep_unless_stopped(random.uniform(1.5, 3.0), stop):
+                    span.set(passed=False, cancelled=True)
+                    return
 
-            # 2. iframeの中のチェックボックスを探してクリック
-            found_checkbox = False
-            for _ in range(5): # 5回トライ
-                try:
-                    iframe = page.get_frame('@src^https://challenges.cloudflare.com')
-                    if iframe:
-                        # チェックボックスっぽい要素を全検索
-                        # input type=checkbox だけでなく、クリック可能なbodyも狙う
-                        target = iframe.ele('tag:input')
-                        if not target: target = iframe.ele('@type=checkbox')
-                        if not target: target = iframe.ele('tag:body') # 最終手段：iframe全体を押す
-
-                        if target:
-                            print("   👉 自動クリックを実行します...")
-                            target.click()
-                            found_checkbox = True
-                            break
-                except:
-                    pass
-                time.sleep(1)
+                # 2. iframeの中のチェックボックスを探してクリック
+                found_checkbox = False
+                for _ in range(5): # 5回トライ
+                    try:
+                        iframe = page.get_frame('@src^https://challenges.cloudflare.com')
+                        if iframe:
+                            # チェックボックスっぽい要素を全検索
+                            # input type=checkbox だけでなく、クリック可能なbodyも狙う
+                            target = iframe.ele('tag:input')
+                            if not target: target = iframe.ele('@type=checkbox')
+                            if not target: target = iframe.ele('tag:body') # 最終手段：iframe全体を押す
+
+                            if target:
+                                log("   👉 自動クリックを実行します...")
+                                target.click()
+                                found_checkbox = True
+                                break
+                    except:
+                        pass
+                    if self._sleep_unless_stopped(1, stop):
+                        span.set(passed=False, cancelled=True)
+                        return
 
-            # 3. 結果待ち (もし自動でダメなら、人間が押すのを待つ)
-            # 待機時間を【3分】に延長しました。ゆっくり手動クリックしてください。
-            print("   ⏳ 【重要】認証画面です。もし画面が変わらない場合、")
-            print("   ⏳ 手動で『人間であることを確認』をクリックしてください！(3分待ちます)")
+                # 3. 結果待ち (もし自動でダメなら、人間が押すのを待つ)
+                # 待機時間を【3分】に延長しました。ゆっくり手動クリックしてください。
+                log("   ⏳ 【重要】認証画面です。もし画面が変わらない場合、")
+                log("   ⏳ 手動で『人間であることを確認』をクリックしてください！(3分待ちます)")
             
-            start_time = time.time()
-            while time.time() - start_time < 180: # 180秒待機
-                title = page.title.lower() if page.title else ""
-                if "verify" not in title and "challenge" not in title and "security" not in title:
-                    print("   🚀 突破成功！（または手動認証完了）")
-                    # 成功したら少し待ってCookieを馴染ませる
-                    time.sleep(3)
-                    return
-                time.sleep(1)
+                start_time = time.time()
+                while time.time() - start_time < 180: # 180秒待機
+                    title = page.title.lower() if page.title else ""
+                    if "verify" not in title and "challenge" not in title and "security" not in title:
+                        log("   🚀 突破成功！（または手動認証完了）")
+                        span.set(passed=True, clicked=found_checkbox)
+                        # 成功したら少し待ってCookieを馴染ませる
+                        self._sleep_unless_stopped(3, stop)
+                        return
+                    if self._sleep_unless_stopped(1, stop):
+                        log("   🛑 中止されたため認証待ちを打ち切ります")
+                        span.set(passed=False, clicked=found_checkbox, cancelled=True)
+                        return
             
-            print("   ⚠️ 時間切れ。今回はスキップします。")
+                log("   ⚠️ 時間切れ。今回はスキップします。")
+                span.set(passed=False, clicked=found_checkbox)
 
-    def extract_jobs_via_ai(self, raw_html, company, location, filter_data):
-        print(f"   🤖 Groq解析中... ({company})")
-        soup = BeautifulSoup(raw_html, "html.parser")
+    def _location_instruction(self, company, location):
+        if not location:
+            return ""
+        return f"4. LOCATION: Prioritize jobs in '{location}', but if the job is clearly for {company}, include it."
 
-        extracted_jobs_text = ""
-        
-        job_titles = soup.find_all("h2", class_=lambda x: x and "jobTitle" in x)
-        if not job_titles:
-            job_links = soup.find_all("a", href=True)
-            candidates = [a for a in job_links if "jk=" in a['href'] or "/rc/clk" in a['href']]
-        else:
-            candidates = [h2.find("a") for h2 in job_titles if h2.find("a")]
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for key, value in deltas.items():
+                self.extraction_stats[key] += value
 
-        for i, a_tag in enumerate(candidates):
-            if not a_tag: continue
-            
-            href = a_tag.get('href', '')
-            jk_id = ""
-            if "jk=" in href:
-                match = re.search(r'jk=([a-zA-Z0-9]+)', href)
-                if match: jk_id = match.group(1)
-            
-            stable_url = f"https://jp.indeed.com/viewjob?jk={jk_id}" if jk_id else "URL_NOT_FOUND"
-            title = a_tag.get_text(strip=True)
-            
-            card = a_tag.find_parent("div", class_=lambda x: x and "card" in x.lower()) 
-            if not card: card = a_tag.find_parent("td")
-            if not card: card = a_tag.find_parent("div")
+    def _record_batch(self, index, prompts, company, token_counts, start, response):
+        usage = getattr(response, "usage", None) if response else None
+        stat = {
+            "company": company,
+            "batch": index + 1,
+            "batches": len(prompts),
+            "est_tokens": token_counts[index],
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            "seconds": round(time.monotonic() - start, 3),
+            "cached": bool(getattr(response, "cached", False)),
+            "ok": response is not None,
+        }
+        with self._stats_lock:
+            self.batch_stats.append(stat)
+        log(f"   📦 バッチ{index+1}/{len(prompts)}: 推定{token_counts[index]}tok "
+              f"-> {stat['prompt_tokens']}+{stat['completion_tokens']}tok {stat['seconds']:.1f}秒")
 
-            card_text = card.get_text(separator=" | ", strip=True) if card else ""
-            
-            extracted_jobs_text += f"""
-            [JOB_BLOCK_{i+1}]
-            Title: {title}
-            URL: {stable_url}
-            RawContent: {card_text}
-            --------------------------------
-            """
+    def _batch_messages(self, prompt):
+        return [{"role": "user", "content": prompt}]
 
-        if not extracted_jobs_text:
-            print("   ⚠️ 構造化抽出失敗。全文モードへ。")
-            for tag in soup(["script", "style", "svg", "path", "footer", "nav", "noscript", "header"]):
-                tag.decompose()
-            extracted_jobs_text = soup.get_text(separator=" ", strip=True)[:18000]
+    def _run_llm_batches(self, prompts, company, token_counts):
+        """ バッチごとのプロンプトを軽量モデルへ同時に投げ、入力順の応答リストを返す """
+        def run(index):
+            start = time.monotonic()
+            response = self._call_groq_safe(
+                messages=self._batch_messages(prompts[index]),
+                model_id=MODEL_LIGHT,
+                response_format={"type": "json_object"},
+                priority=PRIORITY_BULK,
+                deadline=EXTRACTION_DEADLINE
+            )
+            self._record_batch(index, prompts, company, token_counts, start, response)
+            return response
 
-        location_instruction = ""
-        if location:
-            location_instruction = f"4. LOCATION: Prioritize jobs in '{location}', but if the job is clearly for {company}, include it."
+        if not prompts:
+            return []
+        if len(prompts) == 1:
+            return [run(0)]
+        workers = min(EXTRACTION_MAX_CONCURRENCY, len(prompts))
+        with ContextThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(run, range(len(prompts))))
 
-        prompt = f"""
+    async def _run_llm_batches_async(self, prompts, company, token_counts):
+        """ _run_llm_batches の非同期版（同時実行数は EXTRACTION_MAX_CONCURRENCY まで） """
+        semaphore = asyncio.Semaphore(EXTRACTION_MAX_CONCURRENCY)
+
+        async def run(index):
+            async with semaphore:
+                start = time.monotonic()
+                response = await self._call_groq_safe_async(
+                    messages=self._batch_messages(prompts[index]),
+                    model_id=MODEL_LIGHT,
+                    response_format={"type": "json_object"},
+                    priority=PRIORITY_BULK,
+                    deadline=EXTRACTION_DEADLINE
+                )
+                self._record_batch(index, prompts, company, token_counts, start, response)
+                return response
+
+        return list(await asyncio.gather(*(run(i) for i in range(len(prompts)))))
+
+    def _full_extraction_prompt(self, company, location, filter_data, text):
+        location_instruction = self._location_instruction(company, location)
+        return f"""
         Extract job postings for "{company}" from the text.
         FILTERING RULES:
         1. Industry: {filter_data['target_industry']}
@@ -264,25 +3109,250 @@ class TalentScopeAI:
         If no relevant jobs found, return [].
         
         TEXT BLOCKS:
-        {extracted_jobs_text[:25000]}
+        {text}
         """
 
-        response = self._call_groq_safe(
-            messages=[{"role": "user", "content": prompt}],
-            model_id=MODEL_LIGHT, 
-            response_format={"type": "json_object"}
-        )
+    def _plan_extraction(self, raw_html, company, location, filter_data, index_key=None, parsed_jks=None):
+        """ 同期・非同期共通の抽出計画。
+            (LLM に送るプロンプト, 推定トークン数, 応答リストを受けて求人リストを返す関数)
+            index_key は求人インデックスの企業キー（省略時は company と location から作る）。
+            parsed_jks にリストを渡すと、ページから読めたカードの jk を（除外する分も含めて）足す """
+        with self.tracer.span("parse", engine=self.extractor.name, html_bytes=len(raw_html)) as span:
+            blocks = self.extractor.extract_blocks(raw_html)
+            span.set(blocks=len(blocks))
+        if parsed_jks is not None:
+            parsed_jks.extend(block["jk"] for block in blocks)
 
-        if not response: return []
-        try:
-            data = json.loads(response.choices[0].message.content)
-            if isinstance(data, dict):
-                for key in data:
-                    if isinstance(data[key], list): return data[key]
-                return [] 
-            return data
-        except:
-            return []
+        if not blocks:
+            log("   ⚠️ 構造化抽出失敗。全文モードへ。")
+            with self.tracer.span("parse", engine=self.extractor.name, mode="fulltext") as span:
+                if self.compact_fulltext:
+                    chunks = self._compact_fulltext(raw_html, filter_data, span)
+                else:
+                    chunks = split_text_by_tokens(self.extractor.full_text(raw_html))
+            return self._plan_llm_chunks(chunks, company, location, filter_data)
+
+        if self.job_index is not None:
+            index_key = index_key or company_key({"name": company, "loc": location})
+            # 一覧に載っていたカードは、除外キーワード・抽出の失敗・件数の上限で使わなかった分も
+            # 最終確認日時を更新する（close_missing で掲載終了にしない）
+            self.job_index.touch(index_key, [block["jk"] for block in blocks])
+
+        blocks = self._prefilter_blocks(blocks, filter_data)
+
+        if self.job_index is None:
+            prompts, token_counts, finish, _ = self._plan_block_extraction(blocks, company, location, filter_data)
+            return prompts, token_counts, finish
+        return self._plan_incremental_extraction(blocks, company, location, filter_data, index_key)
+
+    def _compact_fulltext(self, raw_html, filter_data, span):
+        """ ページを行に分けて求人の載っている部分だけを残し、トークン予算ごとのチャンクにする """
+        boost_terms = _split_keywords((filter_data or {}).get("target_industry"))
+        lines, stats = compact_page_lines(self.extractor.text_lines(raw_html), boost_terms=boost_terms)
+        batches = pack_by_tokens(lines)[:FULLTEXT_MAX_BATCHES]
+        span.set(**stats)
+        self._count(fulltext_tokens_in=stats["tokens_in"], fulltext_tokens_out=stats["tokens_out"])
+        log(f"   🗜️ 全文を圧縮: {stats['tokens_in']} → {stats['tokens_out']}tok ({stats['ratio']:.0%}) "
+            f"領域 {stats['regions_kept']}/{stats['regions']} / 定型文 {stats['boilerplate']}行・"
+            f"重複 {stats['duplicates']}行を除外", stage="compact", **stats)
+        return ["\n".join(lines[i] for i in batch) for batch in batches]
+
+    def _prefilter_blocks(self, blocks, filter_data):
+        """ 除外キーワードに当たるカードを LLM に送る前に落とす（落としたカードは excluded イベントに残す） """
+        matcher = keyword_matcher(filter_data)
+        kept = []
+        for block in blocks:
+            hit = matcher.search(f"{block['title']} {block['card_text']}")
+            if hit is None:
+                kept.append(block)
+                continue
+            log(f"   🚫 除外: {block['title']} (キーワード: {hit})", stage="excluded",
+                jk=block['jk'], title=block['title'], keyword=hit)
+        if len(kept) < len(blocks):
+            self._count(prefiltered=len(blocks) - len(kept))
+        return kept
+
+    def _plan_block_extraction(self, blocks, company, location, filter_data):
+        """ 戻り値の4つ目は、プロンプトごとに載せたブロックの位置（blocks の添字）のリスト """
+        if not blocks:
+            return [], [], lambda responses: [], []
+        if self.rule_extraction:
+            return self._plan_rule_extraction(blocks, company, location, filter_data)
+        # ブロック単位でトークン予算ごとにまとめる（ブロックの途中では切らない）
+        block_texts = [format_job_block(i + 1, block) for i, block in enumerate(blocks)]
+        batches = pack_by_tokens(block_texts)
+        chunks = ["".join(block_texts[i] for i in batch) for batch in batches]
+        return (*self._plan_llm_chunks(chunks, company, location, filter_data), batches)
+
+    def _plan_llm_chunks(self, chunks, company, location, filter_data):
+        prompts = [self._full_extraction_prompt(company, location, filter_data, chunk) for chunk in chunks]
+
+        def finish(responses):
+            jobs = []
+            for response in responses:
+                jobs.extend(_parse_json_list(response))
+            return _dedupe_jobs(jobs)
+
+        return prompts, [estimate_tokens(c) for c in chunks], finish
+
+    def _plan_incremental_extraction(self, blocks, company, location, filter_data, index_key):
+        """ インデックスと照合し、新規・変更ありのカードだけを抽出に回す """
+        # 同じカードでも条件（フィルター・エリア）が変われば判定し直す
+        filter_key = SQLiteCache.make_key(filter_data, location, self.rule_extraction)
+        hashes = [job_content_hash(block) for block in blocks]
+        known = self.job_index.lookup(index_key, [block["jk"] for block in blocks])
+
+        reused = {}   # ブロック位置 -> 保存済みの求人（対象外なら None）
+        fresh = []    # ブロック位置
+        for pos, block in enumerate(blocks):
+            entry = known.get(block["jk"]) if block["jk"] else None
+            if entry and entry["content_hash"] == hashes[pos] and entry["filter_key"] == filter_key:
+                reused[pos] = entry["record"] if entry["relevant"] else None
+            else:
+                fresh.append(pos)
+
+        self._count(index_reused=len(reused))
+        if reused:
+            log(f"   🗂️ インデックス: {len(reused)}/{len(blocks)}件は前回から変更なし")
+
+        prompts, token_counts, inner_finish, prompt_blocks = self._plan_block_extraction(
+            [blocks[pos] for pos in fresh], company, location, filter_data)
+
+        def finish(responses):
+            seen_at = time.time()
+            new_jobs = inner_finish(responses)
+            # 呼び出しに失敗したバッチ（429 の使い切り・タイムアウト・API エラー）のカードは判定が無い
+            undecided = {fresh[i] for batch, response in zip(prompt_blocks, responses)
+                         if response is None for i in batch}
+            fresh_jks = {blocks[pos]["jk"] for pos in fresh if blocks[pos]["jk"]}
+            by_jk = {}
+            unmatched = []
+            for job in new_jobs:
+                match = _JK_PATTERN.search(str(job.get("url", ""))) if isinstance(job, dict) else None
+                if match and match.group(1) in fresh_jks:
+                    by_jk.setdefault(match.group(1), job)
+                else:
+                    unmatched.append(job)
+
+            # 新規・変更ありのカードを判定結果ごと保存
+            # LLM の回答をカードに対応付けられなかったとき・バッチが失敗したときは「対象外」とは記録しない
+            # （次回また LLM に送る）
+            for pos in fresh:
+                jk = blocks[pos]["jk"]
+                if not jk:
+                    continue
+                record = by_jk.get(jk)
+                if record is None and (unmatched or pos in undecided):
+                    continue
+                self.job_index.upsert(index_key, jk, hashes[pos], filter_key, record, seen_at)
+            if undecided:
+                log(f"   ⚠️ 抽出に失敗したバッチの {len(undecided)}件は判定保留（次回再送）")
+
+            # カードの並び順で結果を組み立てる
+            jobs = []
+            for pos, block in enumerate(blocks):
+                if pos in reused:
+                    if reused[pos] is not None:
+                        jobs.append(reused[pos])
+                elif block["jk"] in by_jk:
+                    jobs.append(by_jk.pop(block["jk"]))
+            return _dedupe_jobs(jobs + unmatched)
+
+        return prompts, token_counts, finish
+
+    def extract_jobs_via_ai(self, raw_html, company, location, filter_data, index_key=None, parsed_jks=None):
+        log(f"   🤖 Groq解析中... ({company})")
+        prompts, token_counts, finish = self._plan_extraction(raw_html, company, location, filter_data, index_key,
+                                                              parsed_jks)
+        responses = self._run_llm_batches(prompts, company, token_counts)
+        _raise_if_all_failed(responses, company)
+        return finish(responses)
+
+    async def extract_jobs_via_ai_async(self, raw_html, company, location, filter_data, index_key=None,
+                                        parsed_jks=None):
+        log(f"   🤖 Groq解析中... ({company})")
+        prompts, token_counts, finish = self._plan_extraction(raw_html, company, location, filter_data, index_key,
+                                                              parsed_jks)
+        responses = await self._run_llm_batches_async(prompts, company, token_counts)
+        _raise_if_all_failed(responses, company)
+        return finish(responses)
+
+    def _plan_rule_extraction(self, blocks, company, location, filter_data):
+        """ ルールで埋まる項目は自前で埋め、足りない項目だけ LLM に聞く計画を立てる。
+            対象かどうか（業種・ホテル/クリニック・エリア・他社の求人）は全件 LLM に判定させる
+            （除外キーワードは _prefilter_blocks で判定済み） """
+        records = {}   # ブロック番号 -> 求人 dict
+        pending = []   # (ブロック番号, ブロック, 未確定の項目)
+        for no, block in enumerate(blocks, start=1):
+            fields = rule_extract_fields(block)
+            pending.append((no, block, [f for f in JOB_FIELDS if not fields[f]]))
+            records[no] = fields
+
+        local_only = sum(1 for _, _, missing in pending if not missing)
+        self._count(blocks=len(blocks), local_only=local_only, sent_to_llm=len(pending) - local_only,
+                    relevance_only=local_only)
+        log(f"   🧩 ルール抽出: {local_only}/{len(blocks)}件は項目を自前で埋め、LLM は対象判定のみ")
+        if not pending:
+            self._count(llm_calls_skipped=1)
+
+        prompts, token_counts, batches = self._missing_fields_prompts(pending, company, location, filter_data)
+        prompt_blocks = [[pending[i][0] - 1 for i in batch] for batch in batches]
+
+        def finish(responses):
+            answers = {}
+            for response in responses:
+                for item in _parse_json_list(response):
+                    if not isinstance(item, dict): continue
+                    try:
+                        answers[int(item.get("block"))] = item
+                    except (TypeError, ValueError):
+                        continue
+            for no, _, missing in pending:
+                item = answers.get(no)
+                if item is None:
+                    # LLM が対象外と判断（または失敗）。項目が埋まっていても対象外なら落とす
+                    records.pop(no, None)
+                    continue
+                for field in missing:
+                    records[no][field] = item.get(field) or "不明"
+            return _dedupe_jobs([records[no] for no in sorted(records)])
+
+        return prompts, token_counts, finish, prompt_blocks
+
+    def _missing_fields_prompts(self, pending, company, location, filter_data):
+        """ 対象かどうかと、未確定の項目だけを問い合わせるプロンプトをバッチごとに作る。
+            項目が埋まっているカードは本文を短くして判定だけ聞く。
+            (プロンプト, 推定トークン数, プロンプトごとの pending の添字) """
+        if not pending:
+            return [], [], []
+        location_instruction = self._location_instruction(company, location)
+
+        block_texts = [format_job_block(no, block, missing, None if missing else RELEVANCE_CONTENT_CHARS)
+                       for no, block, missing in pending]
+        batches = pack_by_tokens(block_texts)
+        chunks = ["".join(block_texts[i] for i in batch) for batch in batches]
+
+        prompts = [f"""
+        These are job postings for "{company}". Some fields could not be read automatically.
+        FILTERING RULES:
+        1. Industry: {filter_data['target_industry']}
+        2. Exclude keywords: {filter_data['negative_keywords']}
+        3. Exclude Hotel/Clinic staff unless target is one.
+        {location_instruction}
+        
+        For every RELEVANT block, return its number and only the fields listed in "Missing"
+        ("Missing: none" means return just the block number).
+        Field meanings: title = Job Title, url = URL found in block, salary = Salary text,
+        location = Location, remote = Remote Info, details = Summary.
+        Omit blocks that break the filtering rules or are not posted by "{company}".
+        
+        Return JSON: {{"jobs": [{{"block": <JOB_BLOCK number>, "<missing field>": "value"}}]}}
+        If no relevant jobs found, return {{"jobs": []}}.
+        
+        TEXT BLOCKS:
+        {chunk}
+        """ for chunk in chunks]
+        return prompts, [estimate_tokens(c) for c in chunks], batches
 
     def _extract_prefecture(self, address):
         if not address: return None
@@ -290,7 +3360,8 @@ class TalentScopeAI:
         if match: return match.group(1)
         return None
 
-    def run_single_search(self, company_info, filter_data):
+    def _build_strategies(self, company_info):
+        """ 検索戦略（指定エリア → 都道府県 → 全国）のリスト """
         raw_name = company_info['name']
         original_loc = company_info['loc']
 
@@ -299,7 +3370,7 @@ class TalentScopeAI:
         if not search_loc and (" " in raw_name or "　" in raw_name):
             parts = re.split(r'[ 　]', raw_name)
             if any(x in parts[1] for x in ["都", "道", "府", "県", "市", "区"]):
-                print(f"   💡 住所自動検出: {parts[1]}")
+                log(f"   💡 住所自動検出: {parts[1]}")
                 clean_name = parts[0]
                 search_loc = parts[1]
 
@@ -310,99 +3381,510 @@ class TalentScopeAI:
             if pref and pref != search_loc:
                 strategies.append({"q": clean_name, "l": pref, "desc": "都道府県"})
         strategies.append({"q": clean_name, "l": None, "desc": "全国"})
+        return strategies
+
+    def _format_search_result(self, jobs_data):
+        """ 抽出結果を analyze_with_groq に渡す形にまとめる """
+        formatted_jobs = ""
+        count = 0
+        for job in jobs_data[:10]:
+            if isinstance(job, dict):
+                t = job.get('title', '不明')
+                u = job.get('url', '#')
+                sal = job.get('salary', 'なし')
+                l = job.get('location', 'なし')
+                r = job.get('remote', '不明')
+                d = job.get('details', '')
+                formatted_jobs += f"JOB_START\nTitle:{t}\nURL:{u}\nSalary:{sal}\nLoc:{l}\nRem:{r}\nDet:{d}\nJOB_END\n"
+                count += 1
+        
+        return {"count": len(jobs_data), "jobs": formatted_jobs, "raw_data": jobs_data}
+
+    def _search_url(self, q_val, l_val, page_no=0):
+        base_url = f"https://jp.indeed.com/jobs?q={urllib.parse.quote(q_val)}"
+        if l_val:
+            base_url += f"&l={urllib.parse.quote(l_val)}"
+        if page_no:
+            base_url += f"&start={page_no * RESULTS_PER_PAGE}"
+        return base_url
+
+    def _has_next_page(self, page):
+        for loc in NEXT_PAGE_LOCATORS:
+            try:
+                if page.ele(loc, timeout=0):
+                    return True
+            except Exception:
+                pass
+        return False
+
+    def _fetch_live_pages(self, q_val, l_val, desc, attempt, max_pages, out, stop):
+        """ ブラウザで検索結果を1ページずつ取得して out キューへ流す（別スレッドで動く）
+            消費側が前のページを解析している間に次のページを読み込む """
+        page = None
+        try:
+            # ブラウザはプールから借りる（毎回起動しない）
+            page = self.browser_pool.acquire()
+            
+            # 戦略: まずトップページに行って、人間アピールをする
+            if attempt == 0:
+                self._polite_get(page, "https://jp.indeed.com/")
+                self._solve_cloudflare(page, stop)
+            
+            for page_no in range(max_pages):
+                if stop.is_set():
+                    break
+                base_url = self._search_url(q_val, l_val, page_no)
+                self._polite_get(page, base_url)
+                
+                # 再度チェック
+                self._solve_cloudflare(page, stop)
+                if stop.is_set():
+                    break
+                
+                # 読み込み待機: 求人カード or 「該当なし」表示が出るまで
+                state = self._wait_ready(page, SEARCH_RESULT_CONDITIONS, PAGE_READY_TIMEOUT, "search_results")
+                if state is None:
+                    log(f"   ⚠️ {PAGE_READY_TIMEOUT}秒以内に結果が表示されませんでした")
+                page.scroll.to_bottom()
+                
+                html_content = page.html
+                has_next = state == "results" and self._has_next_page(page)
+                
+                # 後からブラウザ無しで再解析できるよう保存
+                if self.save_snapshots:
+                    try:
+                        snapshot_key = desc if page_no == 0 else f"{desc}#p{page_no + 1}"
+                        self.snapshots.save(html_content, q_val, l_val, snapshot_key, url=base_url)
+                    except Exception as e:
+                        log(f"   ⚠️ スナップショット保存失敗: {e}")
+                
+                if not self._put_until_stopped(out, ("page", page_no, (html_content, has_next)), stop):
+                    break
+                if not has_next:
+                    break
+        except Exception as e:
+            self._put_until_stopped(out, ("error", None, e), stop)
+        finally:
+            # 全ページ取り終えたらすぐ返却（次の企業・戦略で使い回す）
+            if page is not None:
+                self.browser_pool.release(page)
+            self._put_until_stopped(out, ("done", None, None), stop)
+
+    @staticmethod
+    def _put_until_stopped(out, item, stop):
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _iter_live_pages(self, q_val, l_val, desc, attempt, max_pages):
+        """ (ページ番号, HTML, 次ページの有無) を順に返す。読み込みは裏のスレッドで1ページ先行する """
+        out = queue.Queue(maxsize=1)
+        stop = threading.Event()
+        fetcher = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._fetch_live_pages, q_val, l_val, desc, attempt, max_pages, out, stop),
+            daemon=True)
+        fetcher.start()
+        try:
+            while True:
+                kind, page_no, payload = out.get()
+                if kind == "done":
+                    break
+                if kind == "error":
+                    raise payload
+                html_content, has_next = payload
+                yield page_no, html_content, has_next
+        finally:
+            stop.set()
+            fetcher.join(timeout=PAGE_READY_TIMEOUT)
+
+    def _iter_snapshot_pages(self, q_val, l_val, desc, max_pages):
+        for page_no in range(max_pages):
+            snapshot_key = desc if page_no == 0 else f"{desc}#p{page_no + 1}"
+            html_content = self.snapshots.latest(q_val, l_val, snapshot_key)
+            if html_content is None:
+                if page_no == 0:
+                    log(f"   📼 '{q_val}' ({desc}) のスナップショットなし")
+                break
+            # スナップショットでは続きの有無がわからない
+            yield page_no, html_content, None
+
+    def _iter_page_jobs(self, pages, q_val, l_val, filter_data, seen, limit, progress, index_key=None):
+        """ ページごとに抽出し、まだ出ていない求人だけを返す。
+            新しいカード（jk）が1枚も無いページが来たら打ち切る。除外キーワードや LLM の判定で
+            1件も残らなかっただけのページでは打ち切らない（カードが読めない全文モードでは、
+            新しい求人が1件も無いことで代える）。
+            最後のページまで読み切ったかを progress["complete"] に残す """
+        progress["complete"] = False
+        seen_jks = set()
+        for page_no, html_content, has_next in pages:
+            parsed_jks = []
+            jobs_data = self.extract_jobs_via_ai(html_content, q_val, l_val, filter_data, index_key,
+                                                 parsed_jks) or []
+            new_cards = len(set(parsed_jks) - seen_jks)
+            seen_jks.update(parsed_jks)
+            new_jobs = 0
+            for job in jobs_data:
+                if not isinstance(job, dict):
+                    continue
+                url = job.get("url")
+                key = url if url and url != "URL_NOT_FOUND" else (job.get("title"), job.get("salary"))
+                if key in seen:
+                    continue
+                seen.add(key)
+                new_jobs += 1
+                yield job
+                if len(seen) >= limit:
+                    log(f"   ✋ 上限 {limit}件に達しました")
+                    return
+            emit_event("page", page=page_no + 1, new_jobs=new_jobs, new_cards=new_cards)
+            if page_no > 0:
+                log(f"   📄 {page_no + 1}ページ目: 新規 {new_jobs}件（新しいカード {new_cards}枚）")
+            if has_next is False:
+                progress["complete"] = True
+            if (new_cards if parsed_jks else new_jobs) == 0:
+                return
+
+    def _close_missing_jobs(self, index_key, since):
+        """ 最後のページまで読んで一度も出てこなかった求人を掲載終了にする """
+        if self.job_index is None:
+            return
+        closed = self.job_index.close_missing(index_key, since)
+        if closed:
+            log(f"   📕 掲載終了: {closed}件")
+
+    def iter_jobs(self, company_info, filter_data, max_pages=MAX_RESULT_PAGES,
+                  max_jobs=MAX_JOBS_PER_COMPANY, replay=False):
+        """ 求人を見つけた順に1件ずつ返すジェネレーター。
+            戦略（指定エリア → 都道府県 → 全国）ごとにページ送りし、求人が見つかった戦略で終える。
+            replay=True ならブラウザを使わずスナップショットから読む。
+            求人が見つからず、どの試行も例外で終わった戦略があれば、その最後の例外を送出する
+            （取得・抽出の失敗を「求人ゼロ」として返さない） """
+        strategies = self._build_strategies(company_info)
+        index_key = company_key(company_info)
+        search_started = time.time()
+        seen = set()
+        listing_complete = False  # 求人ゼロでも最後のページまで読めた戦略があったか
+        failure = None            # 全試行が例外で終わった戦略の、最後の例外
 
-        MAX_RETRIES = 2 
+        MAX_RETRIES = 1 if replay else 2
 
         for strategy in strategies:
             q_val = strategy["q"]
             l_val = strategy["l"]
             desc = strategy["desc"]
+            strategy_ok = False
+            last_error = None
 
             for attempt in range(MAX_RETRIES):
-                page = None
                 try:
-                    retry_label = f" ({desc} - 試行{attempt+1})"
-                    print(f"🔍 '{q_val}' を検索中... エリア: {l_val if l_val else '全国'}{retry_label}")
-                    
-                    page = self._create_drission_driver()
-                    
-                    # 戦略: まずトップページに行って、人間アピールをする
-                    if attempt == 0:
-                        page.get("https://jp.indeed.com/")
-                        self._solve_cloudflare(page)
-                    
-                    # 本番検索
-                    base_url = f"https://jp.indeed.com/jobs?q={urllib.parse.quote(q_val)}"
-                    if l_val:
-                        base_url += f"&l={urllib.parse.quote(l_val)}"
-                    
-                    page.get(base_url)
-                    
-                    # 再度チェック
-                    self._solve_cloudflare(page)
-                    
-                    # 読み込み待機
-                    time.sleep(2)
-                    page.scroll.to_bottom()
-                    time.sleep(1)
-                    
-                    html_content = page.html
-                    jobs_data = self.extract_jobs_via_ai(html_content, q_val, l_val, filter_data)
-                    
-                    page.quit() # 終わったら閉じる
+                    if replay:
+                        log(f"📼 '{q_val}' をスナップショットから再解析中... エリア: {l_val if l_val else '全国'} ({desc})")
+                        pages = self._iter_snapshot_pages(q_val, l_val, desc, max_pages)
+                    else:
+                        retry_label = f" ({desc} - 試行{attempt+1})"
+                        log(f"🔍 '{q_val}' を検索中... エリア: {l_val if l_val else '全国'}{retry_label}")
+                        pages = self._iter_live_pages(q_val, l_val, desc, attempt, max_pages)
+
+                    found = 0
+                    progress = {}
+                    try:
+                        for job in self._iter_page_jobs(pages, q_val, l_val, filter_data, seen, max_jobs, progress,
+                                                        index_key):
+                            found += 1
+                            yield job
+                    finally:
+                        # 打ち切ったときは先読み中のページ取得も止める
+                        pages.close()
+                    strategy_ok = True
                     
-                    if jobs_data is not None and len(jobs_data) > 0:
-                        print(f"   ✅ ヒットしました！ ({len(jobs_data)}件)")
-                        
-                        formatted_jobs = ""
-                        count = 0
-                        for job in jobs_data[:10]:
-                            if isinstance(job, dict):
-                                t = job.get('title', '不明')
-                                u = job.get('url', '#')
-                                sal = job.get('salary', 'なし')
-                                l = job.get('location', 'なし')
-                                r = job.get('remote', '不明')
-                                d = job.get('details', '')
-                                formatted_jobs += f"JOB_START\nTitle:{t}\nURL:{u}\nSalary:{sal}\nLoc:{l}\nRem:{r}\nDet:{d}\nJOB_END\n"
-                                count += 1
-                        
-                        return {"count": len(jobs_data), "jobs": formatted_jobs, "raw_data": jobs_data}
+                    if found > 0:
+                        log(f"   ✅ ヒットしました！ ({found}件)")
+                        if progress.get("complete"):
+                            self._close_missing_jobs(index_key, search_started)
+                        return
                     
                     else:
-                        print(f"   ⚠️ 求人なし (次の戦略へ)")
+                        log(f"   ⚠️ 求人なし (次の戦略へ)")
+                        listing_complete = listing_complete or progress.get("complete")
                         continue 
 
                 except Exception as e:
-                    print(f"   ⚠️ エラー: {e}")
+                    log(f"   ⚠️ エラー: {e}")
+                    last_error = e
                     time.sleep(3)
                     continue 
 
-        return None
+            if not strategy_ok:
+                failure = last_error
 
-    def analyze_with_groq(self, company_data_list, companies_info, filter_data):
-        print("\n🧠 Groqで最終レポートを作成中...")
-        input_data_str = ""
-        for comp in companies_info:
-            name = comp['name'] 
-            loc_req = comp['loc']
-            data = company_data_list.get(name)
-            
-            input_data_str += f"\n### 対象企業: {name} (希望エリア: {loc_req if loc_req else '指定なし/自動検出'})\n"
-            if data and data['count'] > 0:
-                input_data_str += f"検出数: {data['count']}\n{data['jobs']}\n"
+        if failure is not None:
+            # 読み切れなかった戦略があるので掲載終了の判定もしない
+            raise failure
+        if listing_complete:
+            # どの戦略でも対象の求人が無かった。最後まで読めた一覧に出てこなかった求人は掲載終了
+            self._close_missing_jobs(index_key, search_started)
+
+    def run_single_search(self, company_info, filter_data, max_pages=MAX_RESULT_PAGES,
+                          max_jobs=MAX_JOBS_PER_COMPANY, on_job=None, replay=False):
+        """ iter_jobs を最後まで回して、analyze_with_groq に渡す形でまとめて返す。
+            on_job(company_info, job) を渡すと見つかった求人を逐次受け取れる """
+        jobs_data = []
+        with event_context(company=company_info['name']), \
+                self.tracer.span("company_search", replay=replay) as span:
+            for job in self.iter_jobs(company_info, filter_data, max_pages, max_jobs, replay=replay):
+                jobs_data.append(job)
+                if on_job is not None:
+                    on_job(company_info, job)
+            span.set(jobs=len(jobs_data))
+        if not jobs_data:
+            return None
+        return self._format_search_result(jobs_data)
+
+    def replay_single_search(self, company_info, filter_data, **kwargs):
+        """ ブラウザを使わず、保存済みスナップショットから run_single_search と同じ結果を作る """
+        return self.run_single_search(company_info, filter_data, replay=True, **kwargs)
+
+    def iter_many(self, companies_info, filter_data, max_workers=MAX_PARALLEL_SEARCHES, replay=False,
+                  on_error=None, **search_kwargs):
+        """ 複数企業を並列に検索し、終わった順に (index, company_info, data) を返す
+            replay=True ならブラウザを使わずスナップショットから再解析する。
+            検索に失敗した企業は data=None で返し、on_error(company_info, exception) があれば呼ぶ
+            （求人ゼロの None と区別したいとき）。
+            search_kwargs (max_pages, max_jobs, on_job) は run_single_search へそのまま渡す """
+        def search(comp, filter_data):
+            with event_context(company=comp['name']):
+                emit_event("company_start")
+                data = self.run_single_search(comp, filter_data, replay=replay, **search_kwargs)
+                emit_event("company_done", count=data['count'] if data else 0)
+                return data
+
+        def failed(comp, e):
+            log(f"   ⚠️ {comp['name']}の検索失敗: {e}")
+            if on_error is not None:
+                on_error(comp, e)
+
+        workers = max(1, min(max_workers, len(companies_info)))
+        if workers == 1:
+            for i, comp in enumerate(companies_info):
+                try:
+                    data = search(comp, filter_data)
+                except Exception as e:
+                    failed(comp, e)
+                    data = None
+                yield i, comp, data
+            return
+
+        log(f"   ⚡ 並列検索モード: {workers}並列 / {self.host_limiter.interval:.1f}秒間隔")
+        with ContextThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(search, comp, filter_data): i
+                for i, comp in enumerate(companies_info)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    data = future.result()
+                except Exception as e:
+                    failed(companies_info[i], e)
+                    data = None
+                yield i, companies_info[i], data
+
+    def run_many(self, companies_info, filter_data, max_workers=MAX_PARALLEL_SEARCHES, replay=False,
+                 **search_kwargs):
+        """ iter_many の結果を入力順に並べ直して {企業名: data} で返す """
+        ordered = [None] * len(companies_info)
+        for i, _, data in self.iter_many(companies_info, filter_data, max_workers, replay=replay,
+                                         **search_kwargs):
+            ordered[i] = data
+        return {comp['name']: data for comp, data in zip(companies_info, ordered)}
+
+    def run_batch(self, input_path, output_path, checkpoint_path=None, max_workers=MAX_PARALLEL_SEARCHES,
+                  replay=False, filter_sample=BATCH_FILTER_SAMPLE, parquet_dir=None, **search_kwargs):
+        """ 企業リスト (CSV / JSONL) を少しずつ読みながら検索し、1社終わるごとに
+            {"company", "loc", "status", "count", "jobs", "finished_at"} を output_path へ1行追記する。
+            status は ok / no_jobs / error（検索が例外で失敗。"error" に内容が入る）。
+            parquet_dir を渡すと同じ求人を Parquet にも1社ずつ書き足す。
+            進捗は checkpoint_path（省略時は output_path + ".checkpoint.sqlite3"）に残し、
+            再実行すると終わった企業は飛ばす（error の企業はやり直し、同じ企業の行が後ろに追記される）。
+            結果はメモリに溜めない（最終レポートは作らない） """
+        if parquet_dir:
+            _require_pyarrow()
+        checkpoint = BatchCheckpoint(checkpoint_path or output_path + ".checkpoint.sqlite3")
+        try:
+            # 業界フィルターは先頭の企業から1度だけ作り、再開時も同じものを使う
+            filter_data = checkpoint.get_meta("filter")
+            if filter_data is None:
+                sample = list(itertools.islice(iter_company_entries(input_path), max(1, filter_sample)))
+                if not sample:
+                    log("❌ 企業リストが空です")
+                    return {}
+                filter_data = self.build_strict_filter(sample)
+                checkpoint.set_meta("filter", filter_data)
             else:
-                input_data_str += f"ステータス: 該当求人なし\n"
-            input_data_str += "-"*10
+                log(f"♻️ 前回の業界フィルターを使います: {filter_data.get('target_industry')}")
+
+            workers = max(1, max_workers)
+            chunk_size = workers * BATCH_CHUNK_PER_WORKER
+            pending = (comp for comp in iter_company_entries(input_path) if not checkpoint.is_done(company_key(comp)))
+            processed = 0
+            errors = {}  # company_key -> 例外
+
+            def record_error(comp, e):
+                errors[company_key(comp)] = e
+
+            with open(output_path, "a", encoding="utf-8") as out:
+                while True:
+                    chunk = list(itertools.islice(pending, chunk_size))
+                    if not chunk:
+                        break
+                    for _, comp, data in self.iter_many(chunk, filter_data, max_workers=workers, replay=replay,
+                                                        on_error=record_error, **search_kwargs):
+                        count = data["count"] if data else 0
+                        error = errors.pop(company_key(comp), None)
+                        status = "error" if error is not None else "ok" if count else "no_jobs"
+                        record = {"company": comp["name"], "loc": comp.get("loc"), "status": status,
+                                  "count": count, "jobs": data["raw_data"] if data else [],
+                                  "finished_at": time.time()}
+                        if error is not None:
+                            record["error"] = str(error)
+                        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        out.flush()
+                        os.fsync(out.fileno())
+                        if parquet_dir:
+                            write_jobs_parquet(parquet_dir, job_records(comp["name"], record["jobs"],
+                                                                       record["finished_at"]))
+                        # 書き出せてから「終わった」と記録する（error は次回やり直す）
+                        checkpoint.mark_done(company_key(comp), status, count)
+                        processed += 1
+                        emit_event("batch_progress", processed=processed)
+                    log(f"   💾 バッチ: 今回 {processed}社 完了 ({checkpoint.counts()})")
+            return checkpoint.counts()
+        finally:
+            checkpoint.close()
+
+    def enqueue_companies(self, work_queue, input_path, filter_sample=BATCH_FILTER_SAMPLE):
+        """ 企業リスト (CSV / JSONL) をキューに積む。業界フィルターは最初の1回だけ作ってキューに置く
+            （全ワーカーが同じフィルターを使う）。追加した数を返す """
+        if work_queue.get_meta("filter") is None:
+            sample = list(itertools.islice(iter_company_entries(input_path), max(1, filter_sample)))
+            if not sample:
+                log("❌ 企業リストが空です")
+                return 0
+            work_queue.set_meta("filter", self.build_strict_filter(sample))
+        added = work_queue.enqueue(iter_company_entries(input_path))
+        log(f"📥 キューに {added}社 追加しました ({work_queue.counts()})")
+        return added
+
+    def _run_queue_task(self, work_queue, owner, task, filter_data, task_timeout, replay, search_kwargs):
+        """ 借りたタスクを1つ実行する。実行中はハートビートでリースを延ばす """
+        task_id, comp, attempt = task
+        stop = threading.Event()
+        started = time.monotonic()
+
+        def heartbeat():
+            interval = max(1.0, work_queue.lease_seconds / 3)
+            while not stop.wait(interval):
+                if time.monotonic() - started > task_timeout:
+                    # 延長をやめればリースが切れ、他のワーカーが取り直す
+                    log(f"   ⏰ {comp['name']}: {task_timeout}秒を超えたので他のワーカーに任せます")
+                    return
+                if not work_queue.heartbeat(task_id, owner):
+                    return
+
+        beat = threading.Thread(target=heartbeat, daemon=True)
+        beat.start()
+        try:
+            with event_context(company=comp['name']):
+                log(f"📦 [{owner}] {comp['name']} (試行{attempt}/{work_queue.max_attempts})")
+                data = self.run_single_search(comp, filter_data, replay=replay, **search_kwargs)
+        except Exception as e:
+            log(f"   ⚠️ {comp['name']}の検索失敗: {e}")
+            if not work_queue.fail(task_id, owner, e):
+                log(f"   ⚠️ {comp['name']}: リースが他のワーカーに移っていたため失敗は記録しません")
+            return
+        finally:
+            stop.set()
+        if not work_queue.complete(task_id, owner, data):
+            log(f"   ⚠️ {comp['name']}: リースが他のワーカーに移っていたため結果は捨てます")
+
+    def run_work_queue(self, work_queue, max_workers=MAX_PARALLEL_SEARCHES, worker_id=None, replay=False,
+                       task_timeout=QUEUE_TASK_TIMEOUT, **search_kwargs):
+        """ キューからタスクを借りて run_single_search を回すワーカー。max_workers 本を並行に動かし、
+            キューが空（全部 完了 かデッドレター）になったら戻る。
+            1社に task_timeout 秒以上かかったらリースを手放し、固まったブラウザで全体が止まらないようにする """
+        filter_data = work_queue.get_meta("filter")
+        if filter_data is None:
+            raise RuntimeError("キューに業界フィルターがありません（先に企業リストを積んでください）")
+        worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+
+        def loop(slot):
+            owner = f"{worker_id}#{slot}"
+            while True:
+                task = work_queue.lease(owner)
+                if task is None:
+                    if work_queue.is_drained():
+                        return
+                    # 他のワーカーが実行中。リース切れで戻ってくるかもしれないので待つ
+                    time.sleep(QUEUE_POLL_SECONDS)
+                    continue
+                self._run_queue_task(work_queue, owner, task, filter_data, task_timeout, replay, search_kwargs)
+
+        workers = max(1, max_workers)
+        log(f"👷 ワーカー {worker_id}: {workers}並列でキューを処理します ({work_queue.counts()})")
+        if workers == 1:
+            loop(0)
+        else:
+            with ContextThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(loop, range(workers)))
+        return work_queue.counts()
+
+    def coordinate_queue(self, work_queue, on_event=None, poll_seconds=QUEUE_POLL_SECONDS):
+        """ 全タスクが終わるまで待ち、投入順の結果で analyze_with_groq を1回だけ実行する """
+        last = None
+        while not work_queue.is_drained():
+            counts = work_queue.counts()
+            if counts != last:
+                log(f"   ⏳ キュー: {counts}")
+                emit_event("queue", **counts)
+                last = counts
+            time.sleep(poll_seconds)
+
+        for comp, attempts, error in work_queue.dead_letters():
+            log(f"   ☠️ デッドレター: {comp['name']} ({attempts}回失敗: {error})")
+        companies_info = []
+        results = {}
+        for comp, data in work_queue.results():
+            companies_info.append(comp)
+            results[comp['name']] = data
+        if not companies_info:
+            return None
+        return self.analyze_with_groq(results, companies_info, work_queue.get_meta("filter"), on_event=on_event)
+
+    def _section_header(self, comp):
+        loc_req = comp['loc']
+        return f"【{comp['name']}】 (エリア: {loc_req if loc_req else '指定なし/自動検出'})"
+
+    def _section_messages(self, comp, data, filter_data):
+        """ 1社分のセクション（テンプレの 1〜8）を作るプロンプト """
+        name = comp['name'] 
+        loc_req = comp['loc']
+        input_data_str = f"\n### 対象企業: {name} (希望エリア: {loc_req if loc_req else '指定なし/自動検出'})\n"
+        input_data_str += f"検出数: {data['count']}\n{data['jobs']}\n"
 
         prompt = f"""
-        あなたは採用アナリストです。以下のデータからレポートを作成してください。
+        あなたは採用アナリストです。以下のデータから、この企業1社分のレポートを作成してください。
         ターゲット業界: {filter_data['target_industry']}
         
         【重要指示: 出力形式】
         1. プレーンテキストのみ使用 (Markdown記号なし)。
         2. 以下のテンプレに完全に準拠すること。
         3. 「8. 求人票リンク」のセクションを最後に追加し、そこにURLをまとめること。
+        4. 1行目は「{self._section_header(comp)}」とすること。
         
         【出力テンプレート】
         
@@ -434,63 +3916,477 @@ class TalentScopeAI:
            [職種名] : [URL]
            [職種名] : [URL]
         
-        --------------------------------------------------
-        
         【データ】
         {input_data_str}
         """
-        response = self._call_groq_safe(
-            messages=[{"role": "user", "content": prompt}],
-            model_id=MODEL_HEAVY,
-            allow_fallback=True 
-        )
-        text = response.choices[0].message.content if response else "❌ 生成失敗"
+        return [{"role": "user", "content": prompt}]
+
+    def _summary_messages(self, sections, filter_data):
+        """ 各社セクションをまとめる短い全体サマリーのプロンプト """
+        prompt = f"""
+        あなたは採用アナリストです。以下は競合各社の求人レポートです。
+        ターゲット業界: {filter_data['target_industry']}
         
-        clean_text = text.replace("**", "").replace("##", "■").replace("###", "■").replace("* ", "・")
-        clean_text = re.sub(r'^\s*-\s', '・', clean_text, flags=re.MULTILINE)
+        各社を横断して、給与水準・リモート可否・訴求ポイントの違いを5行以内でまとめてください。
+        プレーンテキストのみ使用 (Markdown記号なし)。各行は「・」で始めること。
         
-        return clean_text
+        【各社レポート】
+        {sections}
+        """
+        return [{"role": "user", "content": prompt}]
+
+    def _empty_section(self, comp):
+        """ 求人が無い企業は LLM を使わずに書く """
+        return f"{self._section_header(comp)}\n\nステータス: 該当求人なし"
+
+    def _clean_report_text(self, text):
+        return clean_report_markup(text).strip()
+
+    def _clean_report(self, response):
+        text = response.choices[0].message.content if response else "❌ 生成失敗"
+        return self._clean_report_text(text)
+
+    def assemble_report(self, sections, companies_info, summary=None):
+        """ セクションを入力順に並べ、最後に全体サマリーを付けた最終レポート """
+        separator = "\n\n" + "-" * 50 + "\n\n"
+        body = separator.join(sections[comp['name']] for comp in companies_info if comp['name'] in sections)
+        if summary:
+            body += separator + "【全体サマリー】\n\n" + summary
+        return body
+
+    def _stream_groq_safe(self, messages, model_id, on_delta, allow_fallback=False,
+                          priority=PRIORITY_NORMAL, deadline=None):
+        """ stream=True で呼び出し、届いた断片を on_delta(text) に渡す。全文を返す（失敗時 None） """
+        with self.tracer.span("llm", model=model_id, priority=priority, stream=True) as span:
+            text = self._stream_groq_attempts(messages, model_id, on_delta, allow_fallback, priority, deadline, span)
+            span.set(ok=text is not None)
+            return text
+
+    def _stream_groq_attempts(self, messages, model_id, on_delta, allow_fallback, priority, deadline, span):
+        temperature, cached, estimated = self._prepare_groq_call(messages, model_id, None)
+        span.set(cached=cached is not None)
+        if cached is not None:
+            self._record_usage(span, model_id, getattr(cached, "usage", None))
+            text = cached.choices[0].message.content
+            on_delta(text)
+            return text
+
+        model, backup, delay = self._route(model_id, estimated, deadline, allow_fallback, priority, span)
+
+        def call(current_model, leg_span, claim=None):
+            return self._stream_model_attempts(messages, current_model, temperature, estimated, on_delta,
+                                               allow_fallback, priority, leg_span, claim)
+
+        if delay is None:
+            return call(model, span)
+        return self._hedged_stream(call, model, backup, delay, span)
+
+    def _stream_model_attempts(self, messages, model, temperature, estimated, on_delta, allow_fallback,
+                               priority, span, claim=None):
+        """ claim（ヘッジ時）は最初の断片を流す前に呼ぶ。False なら相手の勝ちなので打ち切って None """
+        max_retries = 5
+        current_model = model
+        for attempt in range(max_retries):
+            span.set(retries=attempt)
+            parts = []
+            sent = time.perf_counter()
+            try:
+                span.add("throttle_s", self.rate_scheduler.acquire(current_model, estimated, priority))
+                sent = time.perf_counter()
+                stream = self.client.chat.completions.create(
+                    stream=True, **self._groq_kwargs(messages, current_model, temperature, None))
+                usage = None
+                for chunk in stream:
+                    if chunk.choices:
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            if not parts:
+                                if claim is not None and not claim():
+                                    # ヘッジで相手が先に流し始めた
+                                    stream.close()
+                                    return None
+                                span.set(first_token_ms=round((time.perf_counter() - sent) * 1000, 1))
+                            parts.append(delta)
+                            on_delta(delta)
+                    x_groq = getattr(chunk, "x_groq", None)
+                    if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+                        usage = x_groq.usage
+                text = "".join(parts)
+                self.router.record(current_model, time.perf_counter() - sent, estimated)
+                self._record_usage(span, current_model, usage)
+                self.rate_scheduler.settle(current_model, estimated, getattr(usage, "total_tokens", None))
+                self._cache_completion(current_model, messages, temperature, None, SimpleNamespace(
+                    id=None, model=current_model, usage=usage,
+                    choices=[SimpleNamespace(message=SimpleNamespace(content=text), finish_reason="stop")]))
+                return text
+            except groq.RateLimitError as e:
+                self.router.record(current_model, time.perf_counter() - sent, estimated, "throttled")
+                current_model = self._on_rate_limit(e, current_model, attempt, allow_fallback)
+            except Exception as e:
+                self.router.record(current_model, time.perf_counter() - sent, estimated, "error")
+                if parts:
+                    # 途中まで届いていればそこまでを使う
+                    log(f"   ⚠️ ストリーム中断({current_model}): {e}")
+                    return "".join(parts)
+                if "decommissioned" in str(e) or "not found" in str(e):
+                    current_model = MODEL_LIGHT
+                    continue
+                return None
+        return None
+
+    def _hedged_stream(self, call, model, backup, delay, span):
+        """ 最初の断片が delay 秒以内に届かなければ backup でもストリームを始め、先に流し始めた方だけを on_delta に渡す。
+            負けた方は最初の断片が届いた時点で接続を閉じる """
+        executor = self._hedge_pool()
+        lock = threading.Lock()
+        winner = []
+
+        def claim(is_backup):
+            with lock:
+                if not winner:
+                    winner.append(is_backup)
+                return winner[0] == is_backup
+
+        def leg(current_model, is_backup):
+            with self.tracer.span("llm_hedge", model=current_model, backup=is_backup, stream=True) as leg_span:
+                return call(current_model, leg_span, lambda: claim(is_backup))
+
+        pending = {executor.submit(leg, model, False): model}
+        hedged = False
+        while pending:
+            # 1本目が流れ始めていれば、あとは終わるのを待つだけ
+            done, _ = wait(pending, timeout=None if hedged or winner else delay, return_when=FIRST_COMPLETED)
+            for future in done:
+                current_model = pending.pop(future)
+                text = future.result()
+                if text is not None and claim(current_model == backup):
+                    self._finish_hedge(span, current_model, None, hedged, current_model == backup)
+                    return text
+            if not hedged and not winner:
+                hedged = True
+                log(f"   🪁 {model} が{'失敗した' if done else f' {delay:.1f}秒 以内に流れ始めなかった'}ため "
+                    f"{backup} でも生成")
+                pending[executor.submit(leg, backup, True)] = backup
+        span.set(hedged=hedged)
+        return None
+
+    def iter_report(self, company_data_list, companies_info, filter_data, summary=REPORT_SUMMARY):
+        """ 企業ごとのセクションを並列に生成し、届いた順にイベントを返すジェネレーター。
+            {"section": 企業名 or REPORT_SUMMARY_KEY, "type": "delta" | "done", "text": ...}
+            "done" の text は整形済みのセクション全文 """
+        events = queue.Queue()
+        sections = {}
+
+        def write_section(comp, data):
+            name = comp['name']
+            with self.tracer.span("report_section", section=name):
+                text = self._stream_groq_safe(
+                    messages=self._section_messages(comp, data, filter_data),
+                    model_id=MODEL_HEAVY,
+                    on_delta=lambda delta: events.put({"section": name, "type": "delta", "text": delta}),
+                    allow_fallback=True,
+                    priority=PRIORITY_INTERACTIVE,
+                    deadline=REPORT_DEADLINE
+                )
+            return self._clean_report_text(text) if text else f"{self._section_header(comp)}\n\n❌ 生成失敗"
+
+        def write_summary():
+            with self.tracer.span("report_summary"):
+                text = self._stream_groq_safe(
+                    messages=self._summary_messages(self.assemble_report(sections, companies_info), filter_data),
+                    model_id=MODEL_HEAVY,
+                    on_delta=lambda delta: events.put({"section": REPORT_SUMMARY_KEY, "type": "delta",
+                                                       "text": delta}),
+                    allow_fallback=True,
+                    priority=PRIORITY_INTERACTIVE,
+                    deadline=REPORT_DEADLINE
+                )
+            return self._clean_report_text(text) if text else None
+
+        def drain(executor, jobs):
+            """ jobs: [(関数, 引数, セクション名)]。delta は届いた順に、done は終わった順に返す """
+            futures = {}
+            for fn, args, name in jobs:
+                future = executor.submit(fn, *args)
+                futures[future] = name
+                future.add_done_callback(lambda f: events.put({"future": f}))
+
+            remaining = len(futures)
+            while remaining:
+                event = events.get()
+                if "future" not in event:
+                    yield event
+                    continue
+                future = event["future"]
+                name = futures[future]
+                remaining -= 1
+                try:
+                    text = future.result()
+                except Exception as e:
+                    text = None if name == REPORT_SUMMARY_KEY else f"【{name}】\n\n❌ 生成失敗: {e}"
+                if text is None:
+                    continue
+                if name != REPORT_SUMMARY_KEY:
+                    sections[name] = text
+                yield {"section": name, "type": "done", "text": text}
+
+        pending = []
+        for comp in companies_info:
+            data = company_data_list.get(comp['name'])
+            if data and data['count'] > 0:
+                pending.append((write_section, (comp, data), comp['name']))
+            else:
+                sections[comp['name']] = self._empty_section(comp)
+                yield {"section": comp['name'], "type": "done", "text": sections[comp['name']]}
+
+        if not pending:
+            return
+        workers = max(1, min(REPORT_MAX_CONCURRENCY, len(pending)))
+        with ContextThreadPoolExecutor(max_workers=workers) as executor:
+            yield from drain(executor, pending)
+            # 全社がそろってから短い横断サマリー（2社以上のときだけ）
+            if summary and len(pending) >= 2:
+                yield from drain(executor, [(write_summary, (), REPORT_SUMMARY_KEY)])
+
+    def analyze_with_groq(self, company_data_list, companies_info, filter_data, on_event=None,
+                          summary=REPORT_SUMMARY):
+        """ 最終レポート。on_event を渡すと iter_report のイベントを逐次受け取れる """
+        log("\n🧠 Groqで最終レポートを作成中...")
+        sections = {}
+        summary_text = None
+        with self.tracer.span("report", companies=len(companies_info)):
+            for event in self.iter_report(company_data_list, companies_info, filter_data, summary=summary):
+                if on_event is not None:
+                    on_event(event)
+                if event["type"] == "done":
+                    if event["section"] == REPORT_SUMMARY_KEY:
+                        summary_text = event["text"]
+                    else:
+                        sections[event["section"]] = event["text"]
+        return self.assemble_report(sections, companies_info, summary_text)
+
+    async def analyze_with_groq_async(self, company_data_list, companies_info, filter_data,
+                                      summary=REPORT_SUMMARY):
+        log("\n🧠 Groqで最終レポートを作成中...")
+        semaphore = asyncio.Semaphore(REPORT_MAX_CONCURRENCY)
+
+        async def write_section(comp):
+            data = company_data_list.get(comp['name'])
+            if not (data and data['count'] > 0):
+                return self._empty_section(comp)
+            async with semaphore:
+                response = await self._call_groq_safe_async(
+                    messages=self._section_messages(comp, data, filter_data),
+                    model_id=MODEL_HEAVY,
+                    allow_fallback=True,
+                    priority=PRIORITY_INTERACTIVE,
+                    deadline=REPORT_DEADLINE
+                )
+            return self._clean_report(response)
+
+        with self.tracer.span("report", companies=len(companies_info)):
+            texts = await asyncio.gather(*(write_section(comp) for comp in companies_info))
+            sections = {comp['name']: text for comp, text in zip(companies_info, texts)}
+
+            summary_text = None
+            with_jobs = [c for c in companies_info if (company_data_list.get(c['name']) or {}).get('count')]
+            if summary and len(with_jobs) >= 2:
+                response = await self._call_groq_safe_async(
+                    messages=self._summary_messages(self.assemble_report(sections, companies_info), filter_data),
+                    model_id=MODEL_HEAVY,
+                    allow_fallback=True,
+                    priority=PRIORITY_INTERACTIVE,
+                    deadline=REPORT_DEADLINE
+                )
+                if response:
+                    summary_text = self._clean_report(response)
+        return self.assemble_report(sections, companies_info, summary_text)
+
+
+# ==========================================
+# ▼ レポートの表示
+# ==========================================
+def clean_report_markup(text):
+    """ Markdown の記号を端末向けに置き換える。行の中だけで完結するので、届いた行ごとに使ってよい """
+    clean_text = text.replace("**", "").replace("##", "■").replace("###", "■").replace("* ", "・")
+    return re.sub(r'^\s*-\s', '・', clean_text, flags=re.MULTILINE)
+
+
+class ReportPrinter:
+    """ iter_report のイベントを受け、企業の入力順（最後に全体サマリー）で端末に出す。
+        順番が来たセクションは届いた行から整形して流し、先に書き上がった他社のセクションは順番まで取っておく """
+
+    def __init__(self, names):
+        self.order = list(names) + [REPORT_SUMMARY_KEY]
+        self.head = 0
+        self.pending = {}     # セクション名 -> まだ出していない断片
+        self.done = {}        # セクション名 -> 整形済みの全文
+        self.started = set()  # 見出し・区切りを出したセクション
+
+    def __call__(self, event):
+        name = event["section"]
+        if event["type"] == "delta":
+            self.pending[name] = self.pending.get(name, "") + event["text"]
+        else:
+            self.done[name] = event["text"]
+        self._flush()
+
+    def _flush(self):
+        while self.head < len(self.order):
+            name = self.order[self.head]
+            if name in self.done:
+                if name in self.started:
+                    # 流していたセクションは残り（最後の改行より後ろ）だけ出す
+                    self._write_lines(name, final=True)
+                    print("\n")
+                else:
+                    self._begin(name)
+                    print(self.done[name] + "\n")
+                self.head += 1
+            elif name in self.pending:
+                self._begin(name)
+                self._write_lines(name)
+                return
+            else:
+                return
+
+    def _begin(self, name):
+        if name in self.started:
+            return
+        if self.started:
+            print("-" * 50 + "\n")
+        if name == REPORT_SUMMARY_KEY:
+            print("【全体サマリー】\n")
+        self.started.add(name)
+
+    def _write_lines(self, name, final=False):
+        text = self.pending.get(name, "")
+        cut = len(text) if final else text.rfind("\n") + 1
+        self.pending[name] = text[cut:]
+        if cut:
+            print(clean_report_markup(text[:cut]), end="", flush=True)
+
 
 def main():
+    parser = argparse.ArgumentParser(description="TalentScope AI - Indeed 競合求人分析")
+    parser.add_argument("--workers", type=int, default=MAX_PARALLEL_SEARCHES,
+                        help="同時に検索する企業数")
+    parser.add_argument("--rps", type=float, default=INDEED_MAX_RPS,
+                        help="jp.indeed.com へのアクセス上限（回/秒）")
+    parser.add_argument("--replay", action="store_true",
+                        help="ブラウザを使わず、保存済みスナップショットから再解析する")
+    parser.add_argument("--max-pages", type=int, default=MAX_RESULT_PAGES,
+                        help="1検索あたりに読む結果ページ数")
+    parser.add_argument("--max-jobs", type=int, default=MAX_JOBS_PER_COMPANY,
+                        help="1社あたりの求人数の上限")
+    parser.add_argument("--hedge", action="store_true", default=HEDGE_REQUESTS,
+                        help="Groq の応答が p95 を超えたら別モデルにも送り、先に届いた方を使う")
+    parser.add_argument("--trace", metavar="PATH", default=TRACE_FILE,
+                        help="処理ごとの計測 (スパン) を JSON Lines で書き出す")
+    parser.add_argument("--trace-otlp", metavar="PATH",
+                        help="終了時に今回の計測を OTLP/JSON 形式で書き出す")
+    parser.add_argument("--batch", metavar="INPUT",
+                        help="企業リスト (CSV / JSONL) を対話なしで処理し、1社ずつ JSONL へ書き出す")
+    parser.add_argument("--output", metavar="PATH",
+                        help="バッチモードの出力先（省略時は INPUT と同じ場所の *.results.jsonl）")
+    parser.add_argument("--checkpoint", metavar="PATH",
+                        help="バッチモードの進捗ファイル（省略時は 出力先.checkpoint.sqlite3）")
+    parser.add_argument("--parquet", metavar="DIR",
+                        help="求人データを DIR 以下へ Parquet (run_date/company で分割) で書き出す")
+    parser.add_argument("--queue", metavar="PATH",
+                        help="複数ワーカーで分担するための作業キュー (SQLite)。--enqueue / --worker / --coordinate と使う")
+    parser.add_argument("--enqueue", metavar="INPUT",
+                        help="企業リスト (CSV / JSONL) をキューに積む")
+    parser.add_argument("--worker", action="store_true",
+                        help="キューのタスクを処理するワーカーとして動く（空になったら終了）")
+    parser.add_argument("--coordinate", action="store_true",
+                        help="キューが空になるのを待って最終レポートを作る（--output に保存）")
+    parser.add_argument("--requeue-dead", action="store_true",
+                        help="キューのデッドレターを再投入する")
+    args = parser.parse_args()
+
     print("=========================================")
     print("   TalentScope AI - Final Stealth Ver    ")
     print("=========================================")
-    
+
+    workers = max(1, args.workers)
+    if args.queue:
+        work_queue = WorkQueue(args.queue)
+        with TalentScopeAI(api_key=GROQ_API_KEY, browser_pool_size=workers, max_rps=args.rps,
+                           trace_path=args.trace, hedge=args.hedge) as analyzer:
+            if args.requeue_dead:
+                print(f"♻️ デッドレターを {work_queue.requeue_dead()}件 再投入しました")
+            if args.enqueue:
+                analyzer.enqueue_companies(work_queue, args.enqueue)
+            if args.worker:
+                counts = analyzer.run_work_queue(work_queue, max_workers=workers, replay=args.replay,
+                                                 max_pages=max(1, args.max_pages), max_jobs=args.max_jobs)
+                print(f"\n👷 ワーカー終了: {counts}")
+            if args.coordinate:
+                report = analyzer.coordinate_queue(work_queue)
+                if report and args.output:
+                    with open(args.output, "w", encoding="utf-8") as f:
+                        f.write(report)
+                    print(f"\n📝 レポートを保存しました: {args.output}")
+                elif report:
+                    print("\n" + report)
+        work_queue.close()
+        return
+
+    if args.batch:
+        output = args.output or os.path.splitext(args.batch)[0] + ".results.jsonl"
+        with TalentScopeAI(api_key=GROQ_API_KEY, browser_pool_size=workers, max_rps=args.rps,
+                           trace_path=args.trace, hedge=args.hedge) as analyzer:
+            counts = analyzer.run_batch(args.batch, output, args.checkpoint, max_workers=workers,
+                                        replay=args.replay, max_pages=max(1, args.max_pages),
+                                        max_jobs=args.max_jobs, parquet_dir=args.parquet)
+        print(f"\n📦 バッチ完了: {counts} -> {output}")
+        return
+
     input_str = input("企業リストを入力してください (例: 株式会社エレファントストーン@東京都渋谷区)\n> ")
-    input_str = input_str.replace("，", ",").replace("　", " ").strip()
-    
-    raw_list = [x.strip() for x in input_str.split(",") if x.strip()]
-    companies_info = []
-    
-    for item in raw_list:
-        if "@" in item:
-            parts = item.split("@")
-            companies_info.append({"name": parts[0].strip(), "loc": parts[1].strip()})
-        else:
-            companies_info.append({"name": item, "loc": None})
-            
+    input_str = input_str.replace("，", ",")
+    companies_info = [entry for entry in map(parse_company_entry, input_str.split(",")) if entry]
+
     if not companies_info: return
 
-    analyzer = TalentScopeAI(api_key=GROQ_API_KEY)
-    
-    web_info = analyzer.search_web_for_company_info(companies_info)
-    filter_data = analyzer.generate_strict_filter(web_info)
-    
-    results = {}
-    for comp in companies_info:
-        if len(results) > 0:
-            print("   ☕ 次の検索へ...")
-            time.sleep(2)
+    with TalentScopeAI(api_key=GROQ_API_KEY, browser_pool_size=workers, max_rps=args.rps,
+                       trace_path=args.trace, hedge=args.hedge) as analyzer:
+        with analyzer.tracer.span("run", companies=len(companies_info), replay=args.replay) as run_span:
+            filter_data = analyzer.build_strict_filter(companies_info)
         
-        data = analyzer.run_single_search(comp, filter_data)
-        results[comp['name']] = data
-
-    if results:
-        report = analyzer.analyze_with_groq(results, companies_info, filter_data)
-        print("\n" + "="*50)
-        print("          分析レポート結果")
-        print("="*50 + "\n")
-        print(report)
+            # 企業間の固定 sleep はやめ、アクセス間隔は HostRateLimiter に任せる
+            def show_job(comp, job):
+                print(f"   📄 [{comp['name']}] {job.get('title', '不明')} / {job.get('salary', 'なし')} / {job.get('location', 'なし')}")
+
+            results = analyzer.run_many(companies_info, filter_data, max_workers=workers, replay=args.replay,
+                                        max_pages=max(1, args.max_pages), max_jobs=args.max_jobs, on_job=show_job)
+
+            if args.parquet:
+                try:
+                    written = export_results_parquet(args.parquet, results)
+                    print(f"   🗃️ Parquet に {written}件書き出しました: {args.parquet}")
+                except Exception as e:
+                    print(f"   ⚠️ Parquet 書き出し失敗: {e}")
+
+            if results:
+                print("\n" + "="*50)
+                print("          分析レポート結果")
+                print("="*50 + "\n")
+
+                # 順番の来たセクションは流しながら、他社は入力順が来るまで取っておいて出す
+                printer = ReportPrinter(c['name'] for c in companies_info)
+                analyzer.analyze_with_groq(results, companies_info, filter_data, on_event=printer)
+
+        # 企業ごとの所要時間（どこを速くすべきかの目安）
+        print("\n⏱️ 企業ごとの所要時間")
+        for row in analyzer.tracer.company_summary(run_span.trace_id):
+            print(f"   {row['company']}: 検索{row['search_s']:.1f}秒 / {row['pages']}ページ / "
+                  f"LLM {row['llm_calls']}回 {row['prompt_tokens']}+{row['completion_tokens']}tok / "
+                  f"待ち{row['throttle_s']:.1f}秒")
+        if args.trace_otlp:
+            analyzer.tracer.export(args.trace_otlp, run_span.trace_id, fmt="otlp")
+            print(f"   📝 トレースを書き出しました: {args.trace_otlp}")
+
 
 if __name__ == "__main__":
     main()